@@ -3,7 +3,14 @@ if '/Users' not in os.path.expanduser("~"):
      os.environ['STREAMLIT_CACHE_DIR'] = "/shared-data"  # shared data path in the docker container
 import streamlit as st
 from src.docindex import DocIndex
-from src.config import EMBEDDER_MODELS, CHAT_MODELS, SELLER_CONTENT_PATH, HELP_GUIDES_CONTENT_PATH
+from src.config import EMBEDDER_MODELS, CHAT_MODELS, SELLER_CONTENT_PATH, HELP_GUIDES_CONTENT_PATH, \
+    RERANKER_MODEL, RERANK_CANDIDATES, RERANK_TIME_BUDGET_SECONDS, ANSWER_CACHE_SIMILARITY_THRESHOLD, \
+    ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL_SECONDS, PROMPT_TOKEN_ENCODING, PROMPT_HISTORY_TOKENS, PROMPT_PARAGRAPH_TOKENS, \
+    PROMPT_SUMMARY_TOKENS, LLM_MAX_WORKERS, LLM_RATE_LIMITS
+from src.answer_cache import SemanticAnswerCache
+from src.prompt_builder import PromptBuilder
+from src.llm_client import LLMClient
+from src.rerank import CrossEncoderReranker
 from src.generation import Answerer, load_llm
 
 
@@ -29,6 +36,9 @@ def show_page():
     issues_sheet = "https://docs.google.com/spreadsheets/d/1gxN6K1FWv0hcjWdYnG6HOXDlKXvBOawR2nCBBghe2KE/edit?usp=sharing"
     st.sidebar.markdown(f"[Report an issue]({issues_sheet})")
 
+    rerank = st.sidebar.checkbox("Rerank paragraphs", value=False)
+    use_answer_cache = not st.sidebar.checkbox("Skip answer cache", value=False)
+
     col1, col2, col3, col4 = st.columns([2, 2, 2, 2])
     with col1:
         model_selected = st.selectbox("Chat Model", options=CHAT_MODELS.keys(), index=1)
@@ -44,11 +54,12 @@ def show_page():
         doc_index = DocIndex(index_path=EMBEDDER_MODELS[embedder_selected]["index_path"],
                              embedder=EMBEDDER_MODELS[embedder_selected]["model_name"])
 
-        if not os.path.exists(EMBEDDER_MODELS[embedder_selected]["index_path"]):
+        if doc_index.index is None:
             doc_index.build(index_path=EMBEDDER_MODELS[embedder_selected]["index_path"],
                             content_paths=[SELLER_CONTENT_PATH, HELP_GUIDES_CONTENT_PATH],
                             embedder_model_name=EMBEDDER_MODELS[embedder_selected]["model_name"],
-                            chunk_size=EMBEDDER_MODELS[embedder_selected]["chunk_size"])
+                            chunk_size=EMBEDDER_MODELS[embedder_selected]["chunk_size"],
+                            index_config=EMBEDDER_MODELS[embedder_selected]["index"])
         return doc_index
 
     @st.cache_resource
@@ -56,36 +67,68 @@ def show_page():
         return load_llm(model, max_tokens)
 
     @st.cache_resource
-    def get_answerer(_index, prompt_file):
-        return Answerer(index=_index, prompt_file=prompt_file)
+    def get_reranker():
+        return CrossEncoderReranker(RERANKER_MODEL, candidates=RERANK_CANDIDATES,
+                                    time_budget_seconds=RERANK_TIME_BUDGET_SECONDS)
+
+    @st.cache_resource
+    def get_answer_cache():
+        return SemanticAnswerCache(threshold=ANSWER_CACHE_SIMILARITY_THRESHOLD, max_entries=ANSWER_CACHE_SIZE,
+                                   ttl_seconds=ANSWER_CACHE_TTL_SECONDS)
+
+    @st.cache_resource
+    def get_prompt_builder():
+        return PromptBuilder(PROMPT_TOKEN_ENCODING, history_tokens=PROMPT_HISTORY_TOKENS,
+                             paragraph_tokens=PROMPT_PARAGRAPH_TOKENS, summary_tokens=PROMPT_SUMMARY_TOKENS)
+
+    @st.cache_resource
+    def get_llm_client():
+        return LLMClient(max_workers=LLM_MAX_WORKERS, rate_limits=LLM_RATE_LIMITS)
+
+    @st.cache_resource
+    def get_answerer(_index, prompt_file, rerank):
+        return Answerer(index=_index, prompt_file=prompt_file, reranker=get_reranker() if rerank else None,
+                        answer_cache=get_answer_cache(), prompt_builder=get_prompt_builder(),
+                        llm_client=get_llm_client())
 
     llm = get_conversation(CHAT_MODELS[model_selected], max_tokens)
 
     index = get_doc_index(embedder_selected)
 
-    answerer = get_answerer(index, f"{PROMPTS_PATH}/{PROMPTS[prompt_selected]['prompt_file']}")
+    answerer = get_answerer(index, f"{PROMPTS_PATH}/{PROMPTS[prompt_selected]['prompt_file']}", rerank)
 
     # Display chat messages from history on app rerun
     for message in st.session_state.messages:
         with st.chat_message(message["role"]):
             st.markdown(message["content"])
 
+    stream_metrics = {}
     if question := st.chat_input("How to boost my selling?"):
         # Display user message in chat message container
         with st.chat_message("user"):
             st.markdown(question)
         # Add user message to chat history
         st.session_state.messages.append({"role": "user", "content": question})
-        response = answerer.answer_question(messages=st.session_state.messages,
-                                            llm=llm,
-                                            top_k=PROMPTS[prompt_selected]['top_k'])
-
         with st.chat_message("assistant"):
-            st.markdown(response)
+            response = st.write_stream(answerer.stream_answer(messages=st.session_state.messages,
+                                                              llm=llm,
+                                                              top_k=PROMPTS[prompt_selected]['top_k'],
+                                                              use_cache=use_answer_cache,
+                                                              metrics=stream_metrics))
 
         # Add assistant response to chat history
         st.session_state.messages.append({"role": "assistant", "content": response})
 
+    if stream_metrics:
+        st.sidebar.caption(f"Time to first token: {stream_metrics['time_to_first_token']:.2f}s, "
+                           f"total: {stream_metrics['total_seconds']:.2f}s")
+    if 'prompt_tokens' in stream_metrics:
+        st.sidebar.caption(f"Prompt tokens: {stream_metrics['prompt_tokens']}")
+    st.sidebar.caption(f"Query embedding cache: {index.query_embedding_cache.stats()}")
+    st.sidebar.caption(f"Answer cache: {get_answer_cache().stats()}")
+    if rerank:
+        st.sidebar.caption(f"Reranker: {get_reranker().stats()}")
+
 
 if __name__ == "__main__":
     if "auth_tokens" not in st.session_state:
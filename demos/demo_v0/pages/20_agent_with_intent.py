@@ -4,7 +4,14 @@ if '/Users' not in os.path.expanduser("~"):
      os.environ['STREAMLIT_CACHE_DIR'] = "/shared-data"  # shared data path in the docker container
 import streamlit as st
 from src.docindex import DocIndex
-from src.config import EMBEDDER_MODELS, CHAT_MODELS, SELLER_CONTENT_PATH, HELP_GUIDES_CONTENT_PATH
+from src.config import EMBEDDER_MODELS, CHAT_MODELS, SELLER_CONTENT_PATH, HELP_GUIDES_CONTENT_PATH, \
+    RERANKER_MODEL, RERANK_CANDIDATES, RERANK_TIME_BUDGET_SECONDS, ANSWER_CACHE_SIMILARITY_THRESHOLD, \
+    ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL_SECONDS, PROMPT_TOKEN_ENCODING, PROMPT_HISTORY_TOKENS, PROMPT_PARAGRAPH_TOKENS, \
+    PROMPT_SUMMARY_TOKENS, SPECULATIVE_RETRIEVAL_THRESHOLD, LLM_MAX_WORKERS, LLM_RATE_LIMITS
+from src.answer_cache import SemanticAnswerCache
+from src.prompt_builder import PromptBuilder
+from src.llm_client import LLMClient
+from src.rerank import CrossEncoderReranker
 from src.generation import DialogueSystemGraph, load_llm
 
 
@@ -29,6 +36,10 @@ def show_page():
     issues_sheet = "https://docs.google.com/spreadsheets/d/1gxN6K1FWv0hcjWdYnG6HOXDlKXvBOawR2nCBBghe2KE/edit?gid=322918608#gid=322918608"
     st.sidebar.markdown(f"[Report an issue]({issues_sheet})")
 
+    rerank = st.sidebar.checkbox("Rerank paragraphs", value=False)
+    use_answer_cache = not st.sidebar.checkbox("Skip answer cache", value=False)
+    speculative_retrieval = st.sidebar.checkbox("Speculative retrieval", value=False)
+
     col1, col2, col3, col4 = st.columns([2, 2, 2, 2])
     with col1:
         model_selected = st.selectbox("Chat Model", options=CHAT_MODELS.keys(), index=1)
@@ -44,17 +55,37 @@ def show_page():
         doc_index = DocIndex(index_path=EMBEDDER_MODELS[embedder_selected]["index_path"],
                              embedder=EMBEDDER_MODELS[embedder_selected]["model_name"])
 
-        if not os.path.exists(EMBEDDER_MODELS[embedder_selected]["index_path"]):
+        if doc_index.index is None:
             doc_index.build(index_path=EMBEDDER_MODELS[embedder_selected]["index_path"],
                             content_paths=[SELLER_CONTENT_PATH, HELP_GUIDES_CONTENT_PATH],
                             embedder_model_name=EMBEDDER_MODELS[embedder_selected]["model_name"],
-                            chunk_size=EMBEDDER_MODELS[embedder_selected]["chunk_size"])
+                            chunk_size=EMBEDDER_MODELS[embedder_selected]["chunk_size"],
+                            index_config=EMBEDDER_MODELS[embedder_selected]["index"])
         return doc_index
 
     @st.cache_resource
     def get_conversation(model, max_tokens, temperature):
         return load_llm(model, max_tokens, temperature)
 
+    @st.cache_resource
+    def get_reranker():
+        return CrossEncoderReranker(RERANKER_MODEL, candidates=RERANK_CANDIDATES,
+                                    time_budget_seconds=RERANK_TIME_BUDGET_SECONDS)
+
+    @st.cache_resource
+    def get_answer_cache():
+        return SemanticAnswerCache(threshold=ANSWER_CACHE_SIMILARITY_THRESHOLD, max_entries=ANSWER_CACHE_SIZE,
+                                   ttl_seconds=ANSWER_CACHE_TTL_SECONDS)
+
+    @st.cache_resource
+    def get_prompt_builder():
+        return PromptBuilder(PROMPT_TOKEN_ENCODING, history_tokens=PROMPT_HISTORY_TOKENS,
+                             paragraph_tokens=PROMPT_PARAGRAPH_TOKENS, summary_tokens=PROMPT_SUMMARY_TOKENS)
+
+    @st.cache_resource
+    def get_llm_client():
+        return LLMClient(max_workers=LLM_MAX_WORKERS, rate_limits=LLM_RATE_LIMITS)
+
     @st.cache_resource
     def get_answerer(
             _index,
@@ -62,7 +93,9 @@ def show_page():
             prompt_file,
             no_intent_answer_file,
             live_agent_answer_file,
-            no_response_answer_file
+            no_response_answer_file,
+            rerank,
+            speculative_retrieval,
     ):
         return DialogueSystemGraph(
             index=_index,
@@ -71,6 +104,12 @@ def show_page():
             no_intent_answer_file=no_intent_answer_file,
             live_agent_answer_file=live_agent_answer_file,
             no_response_answer_file=no_response_answer_file,
+            reranker=get_reranker() if rerank else None,
+            answer_cache=get_answer_cache(),
+            speculative_retrieval=speculative_retrieval,
+            speculation_threshold=SPECULATIVE_RETRIEVAL_THRESHOLD,
+            prompt_builder=get_prompt_builder(),
+            llm_client=get_llm_client(),
         )
 
     llm = get_conversation(CHAT_MODELS[model_selected], max_tokens, 0.0)
@@ -84,6 +123,8 @@ def show_page():
         os.path.join(PROMPTS_PATH, "no_intent_response.txt"),
         os.path.join(PROMPTS_PATH, "live_agent_response.txt"),
         os.path.join(PROMPTS_PATH, "no_answer_response.txt"),
+        rerank,
+        speculative_retrieval,
     )
 
     # Display chat messages from history on app rerun
@@ -92,6 +133,7 @@ def show_page():
             st.markdown(message["content"])
 
     meta_info = {}
+    stream_metrics = {}
 
     if question := st.chat_input("How to boost my selling?"):
         # Display user message in chat message container
@@ -100,19 +142,32 @@ def show_page():
         # Add user message to chat history
         print(st.session_state.user_state)
         st.session_state.messages.append({"role": "user", "content": question})
-        response, meta_info = answerer.answer_question(
-            messages=st.session_state.messages,
-            llm=llm,
-            top_k=PROMPTS[prompt_selected]['top_k'],
-            user_context=st.session_state.user_state,
-        )
-
         with st.chat_message("assistant"):
-            st.markdown(response)
+            response_stream, meta_info = answerer.stream_answer_question(
+                messages=st.session_state.messages,
+                llm=llm,
+                top_k=PROMPTS[prompt_selected]['top_k'],
+                user_context=st.session_state.user_state,
+                use_cache=use_answer_cache,
+                metrics=stream_metrics,
+            )
+            response = st.write_stream(response_stream)
 
         # Add assistant response to chat history
         st.session_state.messages.append({"role": "assistant", "content": response})
 
+    if stream_metrics:
+        st.sidebar.caption(f"Time to first token: {stream_metrics['time_to_first_token']:.2f}s, "
+                           f"total: {stream_metrics['total_seconds']:.2f}s")
+    if 'prompt_tokens' in stream_metrics:
+        st.sidebar.caption(f"Prompt tokens: {stream_metrics['prompt_tokens']}")
+    st.sidebar.caption(f"Query embedding cache: {index.query_embedding_cache.stats()}")
+    st.sidebar.caption(f"Answer cache: {get_answer_cache().stats()}")
+    if rerank:
+        st.sidebar.caption(f"Reranker: {get_reranker().stats()}")
+    if speculative_retrieval:
+        st.sidebar.caption(f"Speculative retrieval: {answerer.speculation_stats()}")
+
     st.sidebar.json(meta_info)
 
 
@@ -0,0 +1,90 @@
+import json
+import time
+import hashlib
+import itertools
+import threading
+from collections import OrderedDict
+
+import faiss
+import numpy as np
+
+
+class SemanticAnswerCache:
+    """
+    Caches final answers by the embedding of the question that produced them. A question hits when a cached
+    question of the same namespace is at least `threshold` cosine-similar to it; the namespace holds everything
+    else the answer depends on (index version, prompts, chat model, earlier turns). Each namespace has its own
+    small exact FAISS index, entries expire after ttl_seconds and the least recently used are evicted past
+    max_entries.
+    """
+
+    def __init__(self, threshold: float = 0.95, max_entries: int = 5000, ttl_seconds: float = 3600):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+        self.indexes = {}  # namespace -> faiss.IndexIDMap2 over normalised question embeddings
+        self.entries = OrderedDict()  # id -> (namespace, expiry time, answer)
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def namespace(*parts) -> str:
+        return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _normalized(embedding: np.array) -> np.array:
+        embedding = np.array(embedding, dtype=np.float32).reshape(1, -1)
+        faiss.normalize_L2(embedding)
+        return embedding
+
+    def lookup(self, namespace: str, embedding: np.array):
+        """Returns the answer cached for the most similar question of the namespace, or None."""
+        with self._lock:
+            index = self.indexes.get(namespace)
+            if index is None or index.ntotal == 0:
+                self.misses += 1
+                return None
+            scores, ids = index.search(self._normalized(embedding), 1)
+            entry_id, score = int(ids[0][0]), float(scores[0][0])
+            if entry_id < 0 or score < self.threshold:
+                self.misses += 1
+                return None
+            if self.entries[entry_id][1] < time.monotonic():
+                self._remove(entry_id)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(entry_id)
+            self.hits += 1
+            return self.entries[entry_id][2]
+
+    def put(self, namespace: str, embedding: np.array, answer):
+        with self._lock:
+            index = self.indexes.get(namespace)
+            if index is None:
+                index = self.indexes[namespace] = faiss.IndexIDMap2(faiss.IndexFlatIP(np.size(embedding)))
+            entry_id = next(self._ids)
+            index.add_with_ids(self._normalized(embedding), np.array([entry_id], dtype=np.int64))
+            self.entries[entry_id] = (namespace, time.monotonic() + self.ttl_seconds, answer)
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+
+    def bypass(self):
+        """Counts a request that skipped the cache."""
+        with self._lock:
+            self.bypassed += 1
+
+    def _remove(self, entry_id: int):
+        namespace, _, _ = self.entries.pop(entry_id)
+        index = self.indexes[namespace]
+        index.remove_ids(np.array([entry_id], dtype=np.int64))
+        if index.ntotal == 0:
+            del self.indexes[namespace]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "bypassed": self.bypassed,
+                "hit_rate": self.hits / lookups if lookups else 0.0, "size": len(self.entries)}
@@ -0,0 +1,145 @@
+import os
+import re
+import json
+import array
+from collections import Counter
+import numpy as np
+
+BM25_VOCAB_FILE = "bm25_vocab.json"
+BM25_INDPTR_FILE = "bm25_indptr.npy"
+BM25_DOC_IDS_FILE = "bm25_doc_ids.npy"
+BM25_IMPACTS_FILE = "bm25_impacts.npy"
+
+DEFAULT_K1 = 1.5
+DEFAULT_B = 0.75
+# Reciprocal-rank fusion constant, damps the weight of the first ranks.
+RRF_K = 60
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list[str]:
+    return _TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25IndexWriter:
+    """
+    Builds a BM25 inverted index over chunks added in id order. Postings are stored in CSR form: the postings of
+    term t are doc_ids[indptr[t]:indptr[t + 1]], each with its precomputed BM25 impact, so a query only sums the
+    impacts of its terms' postings.
+    """
+
+    def __init__(self, directory: str, k1: float = DEFAULT_K1, b: float = DEFAULT_B):
+        self.directory = directory
+        self.k1 = k1
+        self.b = b
+        self.vocab = {}
+        self._term_ids = array.array('i')
+        self._doc_ids = array.array('i')
+        self._term_freqs = array.array('i')
+        self._doc_lengths = array.array('i')
+
+    def __len__(self):
+        return len(self._doc_lengths)
+
+    def add(self, chunk: str):
+        doc_id = len(self._doc_lengths)
+        tokens = tokenize(chunk)
+        for term, freq in Counter(tokens).items():
+            self._term_ids.append(self.vocab.setdefault(term, len(self.vocab)))
+            self._doc_ids.append(doc_id)
+            self._term_freqs.append(freq)
+        self._doc_lengths.append(len(tokens))
+
+    def close(self) -> list[str]:
+        """Writes the index and returns the names of the files it wrote."""
+        term_ids = np.frombuffer(self._term_ids, dtype=np.int32)
+        doc_ids = np.frombuffer(self._doc_ids, dtype=np.int32)
+        term_freqs = np.frombuffer(self._term_freqs, dtype=np.int32).astype(np.float32)
+        doc_lengths = np.frombuffer(self._doc_lengths, dtype=np.int32).astype(np.float32)
+
+        # Stable sort keeps the postings of every term in doc id order.
+        order = np.argsort(term_ids, kind="stable")
+        term_ids, doc_ids, term_freqs = term_ids[order], doc_ids[order], term_freqs[order]
+        indptr = np.zeros(len(self.vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(self.vocab)), out=indptr[1:])
+
+        num_docs = len(doc_lengths)
+        avg_length = doc_lengths.mean() if num_docs else 0.0
+        doc_freqs = np.diff(indptr).astype(np.float32)
+        idf = np.log1p((num_docs - doc_freqs + 0.5) / (doc_freqs + 0.5))
+        norm = self.k1 * (1 - self.b + self.b * doc_lengths[doc_ids] / max(avg_length, 1e-9))
+        impacts = np.repeat(idf, np.diff(indptr)) * term_freqs * (self.k1 + 1) / (term_freqs + norm)
+
+        with open(os.path.join(self.directory, BM25_VOCAB_FILE), 'w', encoding='utf-8') as f:
+            json.dump(sorted(self.vocab, key=self.vocab.get), f, ensure_ascii=False)
+        np.save(os.path.join(self.directory, BM25_INDPTR_FILE), indptr)
+        np.save(os.path.join(self.directory, BM25_DOC_IDS_FILE), doc_ids)
+        np.save(os.path.join(self.directory, BM25_IMPACTS_FILE), impacts.astype(np.float32))
+        return [BM25_VOCAB_FILE, BM25_INDPTR_FILE, BM25_DOC_IDS_FILE, BM25_IMPACTS_FILE]
+
+
+class BM25Index:
+    """Memory-mapped BM25 index, scores every chunk of the corpus with a few vectorised adds per query term."""
+
+    def __init__(self, directory: str, num_docs: int):
+        self.num_docs = num_docs
+        with open(os.path.join(directory, BM25_VOCAB_FILE), 'r', encoding='utf-8') as f:
+            self.vocab = {term: term_id for term_id, term in enumerate(json.load(f))}
+        self.indptr = np.load(os.path.join(directory, BM25_INDPTR_FILE), mmap_mode='r')
+        self.doc_ids = np.load(os.path.join(directory, BM25_DOC_IDS_FILE), mmap_mode='r')
+        self.impacts = np.load(os.path.join(directory, BM25_IMPACTS_FILE), mmap_mode='r')
+
+    def scores(self, query: str) -> np.array:
+        """BM25 score of every chunk for the query."""
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        for term, query_freq in Counter(tokenize(query)).items():
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            # A term has one posting per chunk, so the fancy-indexed add never collides.
+            scores[self.doc_ids[start:end]] += query_freq * self.impacts[start:end]
+        return scores
+
+    def search(self, query: str, top_k: int = 5, mask: np.array = None):
+        """
+        Returns the scores and chunk ids of the top-k matching chunks, best first, padded with -1 ids. mask
+        restricts the search to the chunks where it is True.
+        """
+        scores = self.scores(query)
+        if mask is not None:
+            scores[~mask] = 0
+        top_scores = np.zeros(top_k, dtype=np.float32)
+        top_ids = np.full(top_k, -1, dtype=np.int64)
+
+        matches = np.flatnonzero(scores)
+        if len(matches) > top_k:
+            matches = matches[np.argpartition(-scores[matches], top_k - 1)[:top_k]]
+        matches = matches[np.argsort(-scores[matches], kind="stable")]
+        top_scores[:len(matches)], top_ids[:len(matches)] = scores[matches], matches
+        return top_scores, top_ids
+
+    def search_many(self, queries: list[str], top_k: int = 5, mask: np.array = None):
+        """(n, top_k) scores and chunk ids for a batch of queries, laid out like a FAISS search result."""
+        results = [self.search(query, top_k, mask) for query in queries]
+        return np.vstack([scores for scores, _ in results]), np.vstack([ids for _, ids in results])
+
+
+def reciprocal_rank_fusion(rankings: list[np.array], top_k: int, k: int = RRF_K):
+    """
+    Fuses ranked id lists (best first, -1 padded) by reciprocal rank: every id scores the sum of 1 / (k + rank)
+    over the lists it appears in. Returns the fused scores and ids, padded with -1 ids like the inputs.
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, i in enumerate(ranking, start=1):
+            if i >= 0:
+                fused[int(i)] = fused.get(int(i), 0.0) + 1.0 / (k + rank)
+
+    best = sorted(fused.items(), key=lambda item: -item[1])[:top_k]
+    scores = np.zeros(top_k, dtype=np.float32)
+    ids = np.full(top_k, -1, dtype=np.int64)
+    scores[:len(best)] = [score for _, score in best]
+    ids[:len(best)] = [i for i, _ in best]
+    return scores, ids
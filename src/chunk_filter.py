@@ -0,0 +1,115 @@
+import os
+import json
+from collections import OrderedDict
+import faiss
+import numpy as np
+
+# Document attributes stored per chunk, with one precomputed bitmap per distinct value.
+FILTER_ATTRIBUTES = ("source", "locale")
+# Filter keys resolved against the document table at query time.
+_URL_PREFIX = "url_prefix"
+
+
+def _attribute_file(name: str) -> str:
+    return f"attr_{name}.npy"
+
+
+def _bitmaps_file(name: str) -> str:
+    return f"attr_{name}_bitmaps.npy"
+
+
+def pack_mask(mask: np.array) -> np.array:
+    """Packs a boolean chunk mask into the little-endian bitmap layout of faiss.IDSelectorBitmap."""
+    return np.packbits(mask, bitorder="little")
+
+
+def write_chunk_attributes(directory: str, docs: list[dict], chunk_to_doc: np.array):
+    """
+    Writes the code of every filter attribute per chunk, and a bitmap of the chunks of every attribute value.
+    Returns the names of the files written and the values of each attribute, in code order.
+    """
+    files, attributes = [], {}
+    for name in FILTER_ATTRIBUTES:
+        values = sorted({doc.get(name, "") for doc in docs})
+        value_codes = {value: code for code, value in enumerate(values)}
+        doc_codes = np.array([value_codes[doc.get(name, "")] for doc in docs], dtype=np.int32)
+        codes = doc_codes[chunk_to_doc] if len(chunk_to_doc) else np.empty(0, dtype=np.int32)
+        codes = codes.astype(np.uint16 if len(values) <= np.iinfo(np.uint16).max else np.int32)
+
+        bitmaps = np.vstack([pack_mask(codes == code) for code in range(len(values))]) if values else \
+            np.empty((0, 0), dtype=np.uint8)
+        np.save(os.path.join(directory, _attribute_file(name)), codes)
+        np.save(os.path.join(directory, _bitmaps_file(name)), bitmaps)
+        files += [_attribute_file(name), _bitmaps_file(name)]
+        attributes[name] = values
+    return files, attributes
+
+
+class ChunkFilter:
+    """The chunks matching a filter, as a bitmap shared by FAISS (through an IDSelector) and BM25 (as a mask)."""
+
+    def __init__(self, bitmap: np.array, num_chunks: int):
+        self.bitmap = np.ascontiguousarray(bitmap, dtype=np.uint8)
+        self.num_chunks = num_chunks
+        self.mask = np.unpackbits(self.bitmap, count=num_chunks, bitorder="little").astype(bool)
+        self.count = int(np.count_nonzero(self.mask))
+        # The selector points into self.bitmap, which lives as long as this filter.
+        self.selector = faiss.IDSelectorBitmap(num_chunks, faiss.swig_ptr(self.bitmap))
+
+
+class ChunkFilters:
+    """
+    Turns filters like {"source": "help_guides_data", "url_prefix": "https://www.ebay.com/help/"} into chunk
+    bitmaps. Keys are ANDed and a list of values matches any of them. Attribute bitmaps precomputed at build
+    time are read from the index directory; indexes without them are filtered through the document table.
+    """
+
+    def __init__(self, docs: list[dict], chunk_to_doc: np.array, directory: str = None, attributes: dict = None,
+                 cache_size: int = 64):
+        self.docs = docs
+        self.chunk_to_doc = np.asarray(chunk_to_doc)
+        self.num_chunks = len(self.chunk_to_doc)
+        self.cache_size = cache_size
+        self.attributes = {}
+        self._bitmaps = {}
+        for name, values in (attributes or {}).items():
+            self.attributes[name] = {value: code for code, value in enumerate(values)}
+            self._bitmaps[name] = np.load(os.path.join(directory, _bitmaps_file(name)), mmap_mode='r')
+        self._cache = OrderedDict()
+
+    def resolve(self, filters: dict | None) -> ChunkFilter | None:
+        if not filters:
+            return None
+        key = json.dumps(filters, sort_keys=True)
+        chunk_filter = self._cache.get(key)
+        if chunk_filter is not None:
+            self._cache.move_to_end(key)
+            return chunk_filter
+
+        bitmap = pack_mask(np.ones(self.num_chunks, dtype=bool))
+        for name, wanted in filters.items():
+            wanted = [wanted] if isinstance(wanted, str) else list(wanted)
+            bitmap &= self._bitmap(name, wanted)
+        chunk_filter = self._cache[key] = ChunkFilter(bitmap, self.num_chunks)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return chunk_filter
+
+    def _bitmap(self, name: str, wanted: list) -> np.array:
+        if name == _URL_PREFIX:
+            return self._doc_bitmap([doc_id for doc_id, doc in enumerate(self.docs)
+                                     if doc["url"].startswith(tuple(wanted))])
+        if name not in FILTER_ATTRIBUTES:
+            raise ValueError(f"Unsupported filter {name}, expected one of {FILTER_ATTRIBUTES + (_URL_PREFIX,)}")
+
+        if name not in self._bitmaps:
+            return self._doc_bitmap([doc_id for doc_id, doc in enumerate(self.docs) if doc.get(name, "") in wanted])
+        bitmap = pack_mask(np.zeros(self.num_chunks, dtype=bool))
+        for value in wanted:
+            code = self.attributes[name].get(value)
+            if code is not None:
+                bitmap |= self._bitmaps[name][code]
+        return bitmap
+
+    def _doc_bitmap(self, doc_ids: list[int]) -> np.array:
+        return pack_mask(np.isin(self.chunk_to_doc, doc_ids))
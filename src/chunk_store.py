@@ -0,0 +1,137 @@
+import os
+import zlib
+import array
+import threading
+from collections import OrderedDict
+import numpy as np
+
+CHUNKS_FILE = "chunks.bin"
+CHUNK_OFFSETS_FILE = "chunk_offsets.npy"
+CHUNK_BLOCKS_FILE = "chunk_blocks.npy"
+
+COMPRESSIONS = (None, "zlib")
+DEFAULT_BLOCK_SIZE = 16 * 1024
+
+
+class ChunkStoreWriter:
+    """
+    Appends chunk text to a single contiguous file. Offsets always address the uncompressed utf-8 stream; with
+    zlib compression the stream is cut into fixed-size blocks compressed independently, so one chunk can be read
+    by inflating only the blocks it spans.
+    """
+
+    def __init__(self, directory: str, compression: str | None = None, block_size: int = DEFAULT_BLOCK_SIZE):
+        assert compression in COMPRESSIONS, f"Unsupported chunk compression: {compression}"
+        self.directory = directory
+        self.compression = compression
+        self.block_size = block_size
+        self._file = open(os.path.join(directory, CHUNKS_FILE), 'wb')
+        self._offsets = array.array('q', [0])
+        self._block_offsets = array.array('q', [0])
+        self._pending = bytearray()
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def add(self, chunk: str):
+        encoded = chunk.encode('utf-8')
+        self._offsets.append(self._offsets[-1] + len(encoded))
+        if not self.compression:
+            self._file.write(encoded)
+            return
+
+        self._pending += encoded
+        while len(self._pending) >= self.block_size:
+            self._write_block(self._pending[:self.block_size])
+            del self._pending[:self.block_size]
+
+    def _write_block(self, data: bytes):
+        compressed = zlib.compress(bytes(data))
+        self._file.write(compressed)
+        self._block_offsets.append(self._block_offsets[-1] + len(compressed))
+
+    def close(self) -> list[str]:
+        """Flushes the store and returns the names of the files it wrote."""
+        if self._pending:
+            self._write_block(self._pending)
+            self._pending = bytearray()
+        self._file.close()
+
+        np.save(os.path.join(self.directory, CHUNK_OFFSETS_FILE), np.frombuffer(self._offsets, dtype=np.int64))
+        if not self.compression:
+            return [CHUNKS_FILE, CHUNK_OFFSETS_FILE]
+        np.save(os.path.join(self.directory, CHUNK_BLOCKS_FILE), np.frombuffer(self._block_offsets, dtype=np.int64))
+        return [CHUNKS_FILE, CHUNK_OFFSETS_FILE, CHUNK_BLOCKS_FILE]
+
+
+class ChunkStore:
+    """
+    Lazy, memory-mapped chunk text indexed like a list. Only the requested chunks are read, and a small LRU keeps
+    the hot ones (and, when compressed, the last inflated blocks) decoded.
+    """
+
+    def __init__(self, directory: str, compression: str | None = None, block_size: int = DEFAULT_BLOCK_SIZE,
+                 cache_size: int = 1024, block_cache_size: int = 16):
+        assert compression in COMPRESSIONS, f"Unsupported chunk compression: {compression}"
+        self.compression = compression
+        self.block_size = block_size
+        self.cache_size = cache_size
+        self.block_cache_size = block_cache_size
+
+        self.offsets = np.load(os.path.join(directory, CHUNK_OFFSETS_FILE), mmap_mode='r')
+        self.block_offsets = None
+        if compression:
+            self.block_offsets = np.load(os.path.join(directory, CHUNK_BLOCKS_FILE), mmap_mode='r')
+        chunks_path = os.path.join(directory, CHUNKS_FILE)
+        self._data = np.memmap(chunks_path, dtype=np.uint8, mode='r') if os.path.getsize(chunks_path) else None
+
+        self._cache = OrderedDict()
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        i = int(i)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(f"Chunk {i} out of range")
+
+        with self._lock:
+            chunk = self._cache.get(i)
+            if chunk is not None:
+                self._cache.move_to_end(i)
+                return chunk
+            chunk = self._read(i)
+            self._cache[i] = chunk
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return chunk
+
+    def get_many(self, ids) -> list[str]:
+        return [self[i] for i in ids]
+
+    def _read(self, i: int) -> str:
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        if start == end:
+            return ""
+        if not self.compression:
+            return bytes(self._data[start:end]).decode('utf-8')
+
+        first_block, last_block = start // self.block_size, (end - 1) // self.block_size
+        data = b"".join(self._block(block) for block in range(first_block, last_block + 1))
+        block_start = first_block * self.block_size
+        return data[start - block_start:end - block_start].decode('utf-8')
+
+    def _block(self, block: int) -> bytes:
+        data = self._blocks.get(block)
+        if data is not None:
+            self._blocks.move_to_end(block)
+            return data
+        data = zlib.decompress(bytes(self._data[self.block_offsets[block]:self.block_offsets[block + 1]]))
+        self._blocks[block] = data
+        if len(self._blocks) > self.block_cache_size:
+            self._blocks.popitem(last=False)
+        return data
@@ -1,3 +1,5 @@
+import os
+
 # General Configuration
 SELLER_CONTENT_PATH = "demos/demo_v0/resources/content/sellercenter_crawled_data.json"
 HELP_GUIDES_CONTENT_PATH = "demos/demo_v0/resources/content/help_guides_data.json"
@@ -5,16 +7,59 @@ HELP_GUIDES_RAW_PATH = "../../data/help_guides/en_US.json"
 
 INDEX_PATH = "demos/demo_v0/resources/indexes"
 
+# Persistent chunk embedding cache shared by index builds, the eval CLI and the demo.
+EMBEDDING_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "how_to_agent/embeddings")
+EMBEDDING_CACHE_MAX_BYTES = 2 * 1024 ** 3
+# Persistent chat response cache, used by the eval scripts and by temperature 0 chat models.
+LLM_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "how_to_agent/llm_responses.sqlite")
+# In-process query embedding cache of each DocIndex, backed by the persistent cache above.
+QUERY_EMBEDDING_CACHE_SIZE = 10000
+QUERY_EMBEDDING_CACHE_TTL_SECONDS = 24 * 3600
+
+# FAISS index of each embedder, "type" is one of:
+#   flat      exact inner product search
+#   hnsw      graph index, params M, ef_construction, ef_search
+#   ivf_flat  inverted lists, params nlist, nprobe
+#   ivf_pq    inverted lists of product-quantized vectors, params nlist, pq_m, pq_nbits, nprobe
+# Unset params take the defaults in src/index_utils.py; ef_search and nprobe can be overridden per query.
 EMBEDDER_MODELS = {"MPNet-V2":
                        {"model_name": "sentence-transformers/all-mpnet-base-v2",
-                        "index_path": f"{INDEX_PATH}/mpnet_index.pkl",
-                        "chunk_size": 384},
+                        "index_path": f"{INDEX_PATH}/mpnet_index",
+                        "chunk_size": 384,
+                        "index": {"type": "flat"}},
                    "Vector-Prime":
                        {"model_name": "EBAY_INTERNAL_VECTOR_PRIME",
-                        "index_path": f"{INDEX_PATH}/vector_prime_index.pkl",
-                        "chunk_size": 384}
+                        "index_path": f"{INDEX_PATH}/vector_prime_index",
+                        "chunk_size": 384,
+                        "index": {"type": "flat"}}
                    }
 
+# Optional cross-encoder reranking of the retrieved chunks before they go into the answer prompt.
+RERANKER_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+RERANK_CANDIDATES = 50
+RERANK_TIME_BUDGET_SECONDS = 0.3
+
+# Semantic cache of final answers, a question hits when it is this cosine-similar to a cached one.
+ANSWER_CACHE_SIMILARITY_THRESHOLD = 0.95
+ANSWER_CACHE_SIZE = 5000
+ANSWER_CACHE_TTL_SECONDS = 3600
+
+# Speculative retrieval on the raw user message is kept when the rewritten query is this cosine-similar to it.
+SPECULATIVE_RETRIEVAL_THRESHOLD = 0.9
+
+# Token budgets of the conversation history and retrieved paragraphs in the answer and intent prompts.
+PROMPT_TOKEN_ENCODING = "cl100k_base"
+PROMPT_HISTORY_TOKENS = 1024
+PROMPT_PARAGRAPH_TOKENS = 3072
+PROMPT_SUMMARY_TOKENS = 128
+
+# Concurrent LLM calls of the shared client and the quotas it keeps to, per model name or "default".
+LLM_MAX_WORKERS = 8
+LLM_RATE_LIMITS = {"default": {"requests_per_minute": 60, "tokens_per_minute": 100000}}
+
+# Questions per LLM call when generating question variants; 1 keeps the single-question prompt.
+QUESTION_VARIANT_BATCH_SIZE = 1
+
 CHAT_MODELS = {"GPT4-Turbo": "azure-chat-completions-gpt-4-turbo-2024-04-09",
                "LLaMa3-70B": "ebay-internal-chat-completions-sandbox-llama-3-70b-instruct",
                "Phi-3-5": "ebay-internal-chat-completions-phi-3-5-mini-instruct",
@@ -25,6 +25,7 @@ def guides_processor(guides_path: str, target_dir: str):
         if {'TITLE', 'ARTICLE_DESCRIPTION', 'PAGE_URL', 'DESKTOP_BODY'}.issubset(webpage):
             docs.append({
                 "url": f"https://www.ebay.com{webpage['PAGE_URL']}",
+                "title": webpage['TITLE'],
                 "content": (
                     f"Help webpage title: {webpage['TITLE']} \n"
                     f"Help webpage description: {extract_text_from_html(webpage['ARTICLE_DESCRIPTION'])} \n"
@@ -7,89 +7,349 @@ import sys
 sys.path.insert(1, os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
 
-from src.config import EMBEDDER_MODELS
+from src.config import (EMBEDDER_MODELS, EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_BYTES, QUERY_EMBEDDING_CACHE_SIZE,
+                        QUERY_EMBEDDING_CACHE_TTL_SECONDS)
 from src.embedder import Embedder
-from src.index_utils import build_index
+from src.embedding_cache import EmbeddingCache, QueryEmbeddingCache
+from src.bm25 import reciprocal_rank_fusion
+from src.chunk_filter import ChunkFilters
+from src.index_store import IndexVersion, index_exists, aggregate_by_document
+from src.index_utils import build_index, update_index, search_parameters
+
+# Dense: FAISS only, lexical: BM25 only, hybrid: both fused by reciprocal rank.
+RETRIEVAL_MODES = ("dense", "lexical", "hybrid")
+# Candidates taken from each retriever before fusing them in hybrid mode.
+_HYBRID_CANDIDATES = 50
+# Document-level search first fetches this many chunks per wanted document.
+_COLLAPSE_OVERFETCH = 3
+_COLLAPSE_SCORINGS = ("max", "sum")
 
 
 class DocIndex:
-    def __init__(self, index_path=None, embedder = None, vector_prime_tokenizer_path=None):
+    def __init__(self, index_path=None, embedder = None, vector_prime_tokenizer_path=None,
+                 embedding_cache_dir=EMBEDDING_CACHE_PATH, retrieval_mode: str = "dense"):
+        assert retrieval_mode in RETRIEVAL_MODES, f"Unsupported retrieval mode: {retrieval_mode}"
+        self.retrieval_mode = retrieval_mode
         self.index = None
-        self.urls = None
+        # BM25 index over the same chunks, None for indexes built without one.
+        self.bm25 = None
+        self.chunk_filters = None
+        # Document table and the int32 document id of every chunk, URLs are stored once per document.
+        self.docs = None
+        self.chunk_to_doc = None
         self.embedder = embedder
         self.chunks = None
+        self.manifest = None
+        self.index_path = None
         self.vector_prime_tokenizer_path = vector_prime_tokenizer_path
+        # Persistent embedding caches, disabled when embedding_cache_dir is None. Query embeddings are also
+        # cached in memory.
+        self.embedding_cache_dir = embedding_cache_dir
+        self.query_embedding_cache = None
 
         # Load index.
-        if not index_path or not os.path.exists(index_path):
+        if not index_path or not index_exists(index_path):
             print(f"No index at {index_path}")
             return
 
         print(f"Loading index from {index_path}")
         self.load_data(index_path, embedder)
 
-    def build(self, content_paths: list, index_path: str, embedder_model_name: str, chunk_size:int, dev: bool= False):
-        # Don't override.
-        if os.path.exists(index_path):
+    def build(self, content_paths: list, index_path: str, embedder_model_name: str, chunk_size:int, dev: bool= False,
+              workers: int = 1, incremental: bool = False, chunk_compression: str | None = None,
+              index_config: dict | None = None):
+        # Don't override, unless asked to update the existing index incrementally.
+        if index_exists(index_path) and not incremental:
             print(f"Index exists at {index_path}")
             return
+        if os.path.isfile(index_path):
+            print(f"Legacy pickled index at {index_path} can't be updated, build a new index directory instead")
+            return
 
         embedder = Embedder(embedder_model_name=embedder_model_name,
                             vector_prime_tokenizer_path=self.vector_prime_tokenizer_path)
-        build_index(content_paths, index_path, embedder, chunk_size, dev)
-        # Build the index.
-        self.load_data(index_path)
+        embedding_cache = self._open_embedding_cache("chunks", embedder_model_name)
+        if incremental:
+            index_path = update_index(content_paths, index_path, embedder, chunk_size, dev, workers=workers,
+                                      embedding_cache=embedding_cache, chunk_compression=chunk_compression,
+                                      index_config=index_config)
+        else:
+            index_path = build_index(content_paths, index_path, embedder, chunk_size, dev, workers=workers,
+                                     embedding_cache=embedding_cache, chunk_compression=chunk_compression,
+                                     index_config=index_config)
+        # Load the built index.
+        self.load_data(index_path, embedder)
+
+    def _open_embedding_cache(self, kind: str, embedder_model_name: str):
+        if not self.embedding_cache_dir:
+            return None
+        return EmbeddingCache(os.path.join(self.embedding_cache_dir, kind), embedder_model_name,
+                              EMBEDDING_CACHE_MAX_BYTES)
 
     def retrieve_question_embedding(self, question):
-        # Generate embedding for the query
-        query_embedding = self.embedder.generate_embedding(question)
-        query_embedding = query_embedding.astype(np.float32).reshape(1, -1)
-        faiss.normalize_L2(query_embedding)
+        return self.retrieve_question_embeddings([question])
+
+    def retrieve_question_embeddings(self, questions: list[str], batch_size: int = 32) -> np.array:
+        """Embeds questions in batches, skipping cached ones, returns L2-normalised (len(questions), d) float32."""
+        query_embeddings = [None] * len(questions)
+        if self.query_embedding_cache:
+            query_embeddings = self.query_embedding_cache.lookup(questions)
+
+        missing = [i for i, query_embedding in enumerate(query_embeddings) if query_embedding is None]
+        if missing:
+            # Generate embeddings for the queries
+            missing_questions = [questions[i] for i in missing]
+            new_embeddings = self.embedder.generate_embeddings(missing_questions, batch_size=batch_size, query=True)
+            if self.query_embedding_cache:
+                self.query_embedding_cache.put_many(missing_questions, new_embeddings)
+            for i, query_embedding in zip(missing, new_embeddings):
+                query_embeddings[i] = query_embedding
+        query_embeddings = np.vstack(query_embeddings).astype(np.float32)
+        faiss.normalize_L2(query_embeddings)
+
+        return query_embeddings
+
+    def search_chunk_ids(self, query_embeddings, top_k=5, search_params: dict | None = None,
+                         filters: dict | None = None):
+        """
+        Returns the (n, top_k) scores and chunk ids of the top-k chunks of every query, in one FAISS call.
+        Approximate indexes pad with -1 ids when fewer than top_k vectors are reachable, or match the filters.
+        """
+        query_embeddings = np.ascontiguousarray(query_embeddings, dtype=np.float32).reshape(-1, self.index.d)
+        chunk_filter = self.resolve_filters(filters)
+        if chunk_filter is not None and chunk_filter.count == 0:
+            return (np.zeros((len(query_embeddings), top_k), dtype=np.float32),
+                    np.full((len(query_embeddings), top_k), -1, dtype=np.int64))
+
+        params = search_parameters(self.index, search_params, chunk_filter.selector if chunk_filter else None)
+        if params is None:
+            return self.index.search(query_embeddings, top_k)
+        return self.index.search(query_embeddings, top_k, params=params)
+
+    def resolve_filters(self, filters: dict | None):
+        """
+        Turns filters such as {"source": "help_guides_data"}, {"locale": ["en_US", "en_GB"]} or
+        {"url_prefix": "https://www.ebay.com/help/"} into the ChunkFilter of the matching chunks.
+        """
+        if not filters:
+            return None
+        if self.chunk_filters is None:
+            self.chunk_filters = ChunkFilters(self.docs, self.chunk_to_doc)
+        return self.chunk_filters.resolve(filters)
+
+    def _results(self, scores, indices) -> list[dict]:
+        results = []
+        for score, chunk_id in zip(scores, indices):
+            if chunk_id < 0:
+                break
+            doc = self.doc(chunk_id)
+            results.append({'chunk': self.chunks[chunk_id], 'url': doc["url"], 'title': doc.get("title", ""),
+                            'source': doc.get("source", ""), 'score': float(score), 'actions': None, 'tips': None})
+        return results
+
+    def _retrieval_mode(self, mode: str | None) -> str:
+        mode = mode or self.retrieval_mode
+        if mode != "dense" and self.bm25 is None:
+            print(f"No BM25 index for {mode} retrieval, searching the dense index only")
+            return "dense"
+        return mode
+
+    def _search_chunks(self, questions, query_embeddings, top_k: int, mode: str, search_params: dict | None,
+                       filters: dict | None):
+        """(n, top_k) scores and chunk ids of the top chunks of every query in the given mode, -1 padded."""
+        if mode == "dense":
+            return self.search_chunk_ids(query_embeddings, top_k, search_params, filters)
+
+        chunk_filter = self.resolve_filters(filters)
+        mask = chunk_filter.mask if chunk_filter else None
+        if mode == "lexical":
+            return self.bm25.search_many(questions, top_k, mask)
+
+        num_candidates = max(top_k, _HYBRID_CANDIDATES)
+        _, dense_indices = self.search_chunk_ids(query_embeddings, num_candidates, search_params, filters)
+        _, lexical_indices = self.bm25.search_many(questions, num_candidates, mask)
+        fused = [reciprocal_rank_fusion([dense, lexical], top_k)
+                 for dense, lexical in zip(dense_indices, lexical_indices)]
+        return np.vstack([row_scores for row_scores, _ in fused]), np.vstack([row_ids for _, row_ids in fused])
 
-        return query_embedding
-    
-    def search_with_question_emb(self, query_embedding, top_k=5):
-        # Perform search in the FAISS index
-        _, indices = self.index.search(query_embedding, top_k)
+    def _search_documents(self, questions, query_embeddings, top_k: int, mode: str, search_params: dict | None,
+                          filters: dict | None, scoring: str):
+        """
+        Collapses chunk hits per document. Chunks are fetched top_k * _COLLAPSE_OVERFETCH at a time, doubling for
+        the queries that have not reached top_k distinct documents yet, until they do or the index runs out.
+        """
+        assert scoring in _COLLAPSE_SCORINGS, f"Unsupported document scoring: {scoring}"
+        num_queries = len(questions) if questions is not None else len(query_embeddings)
+        num_chunks = len(self.chunk_to_doc)
+        scores = np.zeros((num_queries, top_k), dtype=np.float32)
+        results = [[] for _ in range(num_queries)]
+
+        pending = np.arange(num_queries)
+        num_fetched = min(top_k * _COLLAPSE_OVERFETCH, num_chunks)
+        while len(pending) and num_fetched:
+            chunk_scores, chunk_ids = self._search_chunks(
+                [questions[i] for i in pending] if questions is not None else None,
+                query_embeddings[pending] if query_embeddings is not None else None,
+                num_fetched, mode, search_params, filters)
+
+            unfinished = []
+            for row, i in enumerate(pending):
+                doc_ids, best, total, hits = self.aggregate_hits(chunk_ids[row], chunk_scores[row])
+                exhausted = chunk_ids[row, -1] < 0 or num_fetched >= num_chunks
+                if len(doc_ids) < top_k and not exhausted:
+                    unfinished.append(i)
+                    continue
+
+                doc_scores = best
+                if scoring == "sum":
+                    order = np.argsort(-total, kind="stable")
+                    doc_ids, doc_scores, hits = doc_ids[order], total[order], hits[order]
+                hit_docs = self.chunk_to_doc[chunk_ids[row][chunk_ids[row] >= 0]]
+                for doc_id, doc_score, doc_hits in zip(doc_ids[:top_k], doc_scores[:top_k], hits[:top_k]):
+                    # Hits are ordered best first, the first hit of a document is its best chunk.
+                    best_chunk_id = chunk_ids[row][np.argmax(hit_docs == doc_id)]
+                    doc = self.docs[doc_id]
+                    results[i].append({'chunk': self.chunks[best_chunk_id], 'url': doc["url"],
+                                       'title': doc.get("title", ""), 'source': doc.get("source", ""),
+                                       'score': float(doc_score), 'num_chunks': int(doc_hits),
+                                       'actions': None, 'tips': None})
+                scores[i, :len(results[i])] = [result['score'] for result in results[i]]
+
+            pending = np.array(unfinished, dtype=np.int64)
+            num_fetched = min(2 * num_fetched, num_chunks)
+        return scores, results
+
+    def search_many_with_embeddings(self, query_embeddings, top_k=5, search_params: dict | None = None,
+                                    filters: dict | None = None, collapse: str | None = None):
+        """
+        Searches the top-k chunks of every row of a query embedding matrix. Returns the (n, top_k) scores and,
+        per query, the list of hits with their chunk, document metadata and score. filters restricts the search
+        to matching chunks inside FAISS, so filtered searches return top_k hits without over-fetching.
+        collapse ("max" or "sum") returns the top-k distinct documents instead, see search_many.
+        """
+        query_embeddings = np.ascontiguousarray(query_embeddings, dtype=np.float32).reshape(-1, self.index.d)
+        if collapse:
+            return self._search_documents(None, query_embeddings, top_k, "dense", search_params, filters, collapse)
+        scores, indices = self.search_chunk_ids(query_embeddings, top_k, search_params, filters)
+        return scores, [self._results(row_scores, row_indices) for row_scores, row_indices in zip(scores, indices)]
+
+    def search_many(self, questions: list[str], top_k=5, search_params: dict | None = None, batch_size: int = 32,
+                    mode: str | None = None, query_embeddings=None, filters: dict | None = None,
+                    collapse: str | None = None):
+        """
+        Batched search: questions are embedded in batches, or taken from query_embeddings, and searched with a
+        single FAISS call. mode overrides the retrieval mode of the index; in hybrid mode the dense and BM25
+        candidates of every question are fused by reciprocal rank, and the scores are the fused ones.
+
+        collapse returns the top-k distinct documents of every question instead of chunks, each with its best
+        chunk, scored by the "max" or the "sum" of the scores of its retrieved chunks.
+        """
+        mode = self._retrieval_mode(mode)
+        if mode != "lexical" and query_embeddings is None:
+            query_embeddings = self.retrieve_question_embeddings(questions, batch_size)
+        if query_embeddings is not None:
+            query_embeddings = np.ascontiguousarray(query_embeddings, dtype=np.float32).reshape(-1, self.index.d)
+
+        if collapse:
+            return self._search_documents(questions, query_embeddings, top_k, mode, search_params, filters, collapse)
+        scores, indices = self._search_chunks(questions, query_embeddings, top_k, mode, search_params, filters)
+        return scores, [self._results(row_scores, row_indices) for row_scores, row_indices in zip(scores, indices)]
+
+    def search_with_question_emb(self, query_embedding, top_k=5, search_params: dict | None = None,
+                                 filters: dict | None = None):
+        _, [results] = self.search_many_with_embeddings(query_embedding, top_k, search_params, filters)
 
         # Retrieve the corresponding documents
-        res_chunks = [self.chunks[i] for i in indices[0]]
-        res_urls = [self.urls[i] for i in indices[0]]
+        res_chunks = [result['chunk'] for result in results]
+        res_urls = [result['url'] for result in results]
 
         return res_chunks, res_urls
 
+    def doc(self, chunk_id: int) -> dict:
+        """Document row ({"url", "title", "source", ...}) of a chunk."""
+        return self.docs[self.chunk_to_doc[chunk_id]]
+
+    def aggregate_hits(self, chunk_ids, scores):
+        """Collapses chunk hits onto documents, see index_store.aggregate_by_document."""
+        return aggregate_by_document(self.chunk_to_doc, chunk_ids, scores)
 
-    def search(self, question, top_k=5):
-        """Searches for the top-k most similar documents to the query."""
-        query_embedding = self.retrieve_question_embedding(question)
 
-        return self.search_with_question_emb(query_embedding, top_k)
+    def search(self, question, top_k=5, search_params: dict | None = None, mode: str | None = None,
+               filters: dict | None = None, collapse: str | None = None):
+        """
+        Searches for the top-k most similar documents to the query. search_params overrides the search parameters
+        of approximate indexes for this query, e.g. {"nprobe": 32} for IVF or {"ef_search": 128} for HNSW, and
+        filters restricts it to some sources, locales or URL prefixes, see resolve_filters. collapse ("max" or
+        "sum") returns the top-k distinct documents rather than chunks.
+        """
+        results = self.search_full(question, top_k, search_params, mode, filters, collapse)
+
+        return [result['chunk'] for result in results], [result['url'] for result in results]
         
 
-    def search_full(self, question, top_k=5) -> list[dict]:
+    def search_full(self, question, top_k=5, search_params: dict | None = None, mode: str | None = None,
+                    filters: dict | None = None, collapse: str | None = None) -> list[dict]:
         """Search for the top-k most similar documents to the query with metadata"""
-        res_chunks, res_urls = self.search(question, top_k)
-
-        results = [
-            {'chunk': chunk, 'url': url, 'actions': None, 'tips': None}
-            for chunk, url in zip(res_chunks, res_urls)
-        ]
+        _, [results] = self.search_many([question], top_k, search_params, mode=mode, filters=filters,
+                                        collapse=collapse)
         return results
 
-    def load_data(self, index_path: str, embedder_model_name_or_path=None):
+    def load_data(self, index_path: str, embedder_model_name_or_path=None, verify: bool = False):
         # Load FAISS index and metadata
-        with open(index_path, 'rb') as f:
-            data = pickle.load(f)
+        self.index_path = os.path.abspath(index_path)
+        if os.path.isfile(index_path):
+            # Legacy pickled index bundle.
+            with open(index_path, 'rb') as f:
+                data = pickle.load(f)
             self.index = data["index"]
-            self.urls = data["urls"]
-            embedder_model_name = embedder_model_name_or_path or data["embedder_model"]
-            self.embedder = Embedder(embedder_model_name=embedder_model_name,
+            # Intern the per-chunk URLs of the legacy format into a document table.
+            doc_ids = {url: doc_id for doc_id, url in enumerate(dict.fromkeys(data["urls"]))}
+            self.docs = [{"url": url, "title": "", "source": ""} for url in doc_ids]
+            self.chunk_to_doc = np.fromiter((doc_ids[url] for url in data["urls"]), dtype=np.int32,
+                                            count=len(data["urls"]))
+            self.chunks = data["chunks"]
+            self.bm25 = None
+            self.chunk_filters = None
+            self.manifest = {"embedder_model": data["embedder_model"], "version": data.get("version", 1),
+                             "created_at": os.path.getmtime(index_path)}
+        else:
+            index_version = IndexVersion(index_path, verify=verify)
+            self.index = index_version.read_index()
+            self.docs = index_version.docs
+            self.chunk_to_doc = index_version.chunk_to_doc
+            # Chunk text stays on disk, search only reads the hits.
+            self.chunks = index_version.chunks
+            self.bm25 = index_version.bm25
+            self.chunk_filters = index_version.filters
+            self.manifest = index_version.manifest
+
+        expected_model_name = self.manifest["embedder_model"]
+        if isinstance(embedder_model_name_or_path, Embedder):
+            self.embedder = embedder_model_name_or_path
+        else:
+            self.embedder = Embedder(embedder_model_name=embedder_model_name_or_path or expected_model_name,
                                      vector_prime_tokenizer_path=self.vector_prime_tokenizer_path)
-            if self.embedder.embedder_model_name != data["embedder_model"]:
-                print(f"Warning: Embedder model name mismatch. Expected {data['embedder_model']}, "
-                      f"but got {self.embedder.embedder_model_name}")
+        if self.embedder.embedder_model_name != expected_model_name:
+            print(f"Warning: Embedder model name mismatch. Expected {expected_model_name}, "
+                  f"but got {self.embedder.embedder_model_name}")
+        self.query_embedding_cache = QueryEmbeddingCache(
+            self.embedder.embedder_model_name, QUERY_EMBEDDING_CACHE_SIZE, QUERY_EMBEDDING_CACHE_TTL_SECONDS,
+            disk_cache=self._open_embedding_cache("queries", self.embedder.embedder_model_name))
 
-            self.chunks = data["chunks"]
+    @property
+    def version(self) -> int | None:
+        return self.manifest["version"] if self.manifest else None
+
+    @property
+    def identity(self) -> tuple | None:
+        """
+        Tells the loaded index apart from every other one, for caches shared between indexes: versions are only
+        numbered per index directory, and rebuilding a directory from scratch starts them over.
+        """
+        if not self.manifest:
+            return None
+        return (self.index_path, self.version, self.manifest.get("created_at"), self.manifest.get("checksums"),
+                self.embedder.embedder_model_name)
 
 
 if __name__ == "__main__":
@@ -103,5 +363,6 @@ if __name__ == "__main__":
         d.build(content_paths = contents,
                 index_path = f"../{EMBEDDER_MODELS[embedder_model]['index_path']}",
                 embedder_model_name=EMBEDDER_MODELS[embedder_model]["model_name"],
-                chunk_size=EMBEDDER_MODELS[embedder_model]["chunk_size"])
+                chunk_size=EMBEDDER_MODELS[embedder_model]["chunk_size"],
+                index_config=EMBEDDER_MODELS[embedder_model]["index"])
         print(d.search(question="how to sell", top_k=3))
\ No newline at end of file
@@ -21,6 +21,7 @@ class Embedder:
             os.path.join(os.path.dirname(__file__), "vector_prime_tokenizer")
 
         self.embedder_model_name = embedder_model_name
+        self.vector_prime_tokenizer_path = vector_prime_tokenizer_path
 
         if self.embedder_model_name == "EBAY_INTERNAL_VECTOR_PRIME":
             self.embedder = EbayLLMEmbeddingWrapper(model_name="EBAY_INTERNAL_VECTOR_PRIME")
@@ -44,4 +45,40 @@ class Embedder:
                 print(f"Error generating embedding (attempt {attempts + 1}/{max_retries}): {e}")
                 attempts += 1
                 time.sleep(retry_delay)
-        raise RuntimeError("Failed to generate embedding after multiple attempts")
\ No newline at end of file
+        raise RuntimeError("Failed to generate embedding after multiple attempts")
+
+    def generate_embeddings(self, texts: list[str], batch_size: int = 32, max_retries: int = 3,
+                            retry_delay: float = 1.0, query: bool = False) -> np.array:
+        """
+        Embeds texts in length-sorted batches and returns a (len(texts), d) float32 array in input order.
+        query embeds search queries rather than documents, for models that embed them differently.
+        """
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+
+        # Sorting by length keeps texts of similar size in the same batch, which minimises padding.
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        embeddings = None
+        for start in range(0, len(order), batch_size):
+            batch_ids = order[start:start + batch_size]
+            batch_embeddings = self._embed_batch([texts[i] for i in batch_ids], max_retries, retry_delay, query)
+            if embeddings is None:
+                embeddings = np.empty((len(texts), batch_embeddings.shape[1]), dtype=np.float32)
+            embeddings[batch_ids] = batch_embeddings
+        return embeddings
+
+    def _embed_batch(self, texts: list[str], max_retries: int, retry_delay: float, query: bool = False) -> np.array:
+        attempts = 0
+        while attempts < max_retries:
+            try:
+                if self.embedder_model_name == "EBAY_INTERNAL_VECTOR_PRIME":
+                    if query:
+                        return np.array([self.embedder.embed_query(text=text) for text in texts], dtype=np.float32)
+                    return np.array(self.embedder.embed_documents(texts), dtype=np.float32)
+                return self.embedder.encode(texts, batch_size=len(texts), convert_to_numpy=True,
+                                            show_progress_bar=False).astype(np.float32)
+            except Exception as e:
+                print(f"Error generating batch embeddings (attempt {attempts + 1}/{max_retries}): {e}")
+                attempts += 1
+                time.sleep(retry_delay)
+        raise RuntimeError(f"Failed to generate embeddings for a batch of {len(texts)} texts after multiple attempts")
\ No newline at end of file
@@ -0,0 +1,351 @@
+import fcntl
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+
+# Compaction shrinks the store to this fraction of max_bytes, so evictions don't run on every insert.
+_COMPACTION_TARGET = 0.8
+
+# Lookup hits are buffered in memory and appended to the touch log in batches of this many keys.
+_TOUCH_FLUSH_KEYS = 256
+
+_QUERY_TRAILING_PUNCTUATION = "?!.,;: "
+
+
+class EmbeddingCache:
+    """
+    Persistent embedding store keyed by (model name, chunk text hash), shared by all processes on a host.
+
+    Vectors are appended to a float32 file read through a memory map, then their keys to an append-only log of
+    "row key" lines. Rows are explicit so that a crash between the two appends only leaves unreferenced vectors
+    behind; a partial vector or key record is dropped. Once the vectors file outgrows max_bytes it is compacted,
+    keeping the most recently used entries. Lookup hits of every process are appended to a touch log, folded into
+    the recency order at compaction, so entries only another process reads are not evicted as unused.
+    """
+
+    def __init__(self, cache_dir: str, model_name: str, max_bytes: int = 2 * 1024 ** 3):
+        self.root_dir = cache_dir
+        self.model_name = model_name
+        self.max_bytes = max_bytes
+        self.cache_dir = os.path.join(cache_dir, re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name))
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        self.vectors_path = os.path.join(self.cache_dir, "vectors.f32")
+        self.keys_path = os.path.join(self.cache_dir, "keys.log")
+        self.touches_path = os.path.join(self.cache_dir, "touches.log")
+        self.meta_path = os.path.join(self.cache_dir, "meta.json")
+        self.lock_path = os.path.join(self.cache_dir, ".lock")
+
+        self.dimension = None
+        self.rows = OrderedDict()  # text hash -> row, least recently used first
+        self._num_keys = 0
+        self._keys_offset = 0
+        self._generation = None
+        self._vectors = None
+        self._touched = []
+        self._touched_lock = threading.Lock()
+        with self._lock():
+            self._refresh()
+
+    @staticmethod
+    def key(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def lookup(self, texts: list[str]) -> list:
+        """Returns the cached embedding of each text, or None where it is not cached."""
+        keys = [self.key(text) for text in texts]
+        if any(key not in self.rows for key in keys):
+            # Another process may have added them since we last looked.
+            with self._lock():
+                self._refresh()
+
+        results = []
+        for key in keys:
+            row = self.rows.get(key)
+            if row is None or self._vectors is None or row >= len(self._vectors):
+                results.append(None)
+                continue
+            self.rows.move_to_end(key)
+            results.append(np.array(self._vectors[row]))
+
+        touched = [key for key, result in zip(keys, results) if result is not None]
+        if touched:
+            with self._touched_lock:
+                self._touched.extend(touched)
+                flush = len(self._touched) >= _TOUCH_FLUSH_KEYS
+            if flush:
+                with self._lock():
+                    self._flush_touches()
+        return results
+
+    def put_many(self, texts: list[str], embeddings: np.array):
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(len(texts), -1)
+        with self._lock():
+            self._refresh()
+            if self.dimension is None:
+                self.dimension = embeddings.shape[1]
+                self._write_meta()
+
+            new_keys, new_rows = [], []
+            for text, embedding in zip(texts, embeddings):
+                key = self.key(text)
+                if key in self.rows or key in new_keys:
+                    continue
+                new_keys.append(key)
+                new_rows.append(embedding)
+            if not new_keys:
+                return
+
+            first_row = self._truncate_vectors()
+            with open(self.vectors_path, "ab") as f:
+                f.write(np.vstack(new_rows).tobytes())
+            with open(self.keys_path, "ab") as f:
+                if f.tell() and not self._ends_with_newline(self.keys_path):
+                    # Terminate the partial record of a crashed write, it is skipped when read.
+                    f.write(b"\n")
+                f.write("".join(f"{first_row + i} {key}\n" for i, key in enumerate(new_keys)).encode("ascii"))
+            self._refresh()
+
+            self._flush_touches()
+            if os.path.getsize(self.vectors_path) > self.max_bytes:
+                self._compact()
+
+    def embed(self, embedder, texts: list[str], batch_size: int = 32) -> np.array:
+        """Embeds texts, calling the model only for the texts missing from the cache."""
+        embeddings = self.lookup(texts)
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            new_embeddings = embedder.generate_embeddings(missing_texts, batch_size=batch_size)
+            self.put_many(missing_texts, new_embeddings)
+            for i, embedding in zip(missing, new_embeddings):
+                embeddings[i] = embedding
+        return np.vstack(embeddings).astype(np.float32)
+
+    @contextmanager
+    def _lock(self):
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_meta(self) -> dict:
+        if not os.path.exists(self.meta_path):
+            return {}
+        with open(self.meta_path, "r") as f:
+            return json.load(f)
+
+    def _write_meta(self):
+        tmp_path = f"{self.meta_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"model_name": self.model_name, "dimension": self.dimension,
+                       "generation": self._generation or 0}, f)
+        os.replace(tmp_path, self.meta_path)
+
+    def _truncate_vectors(self) -> int:
+        """Drops a partially written trailing vector and returns the number of whole rows. Needs the lock."""
+        if not os.path.exists(self.vectors_path):
+            return 0
+        row_bytes = 4 * self.dimension
+        size = os.path.getsize(self.vectors_path)
+        if size % row_bytes:
+            os.truncate(self.vectors_path, size - size % row_bytes)
+        return size // row_bytes
+
+    @staticmethod
+    def _ends_with_newline(path: str) -> bool:
+        with open(path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def _flush_touches(self):
+        """Appends the buffered lookup hits to the touch log. Needs the lock."""
+        with self._touched_lock:
+            touched, self._touched = self._touched, []
+        if not touched:
+            return
+        with open(self.touches_path, "ab") as f:
+            if f.tell() and not self._ends_with_newline(self.touches_path):
+                f.write(b"\n")
+            f.write("".join(f"{key}\n" for key in touched).encode("ascii"))
+            size = f.tell()
+        # Without compactions the log only grows; once it repeats keys often enough, keep the last touch of each.
+        if size > 2 * 65 * max(len(self.rows), _TOUCH_FLUSH_KEYS):
+            touches = self._read_touches()
+            with open(f"{self.touches_path}.tmp", "w") as f:
+                f.write("".join(f"{key}\n" for key in touches))
+            os.replace(f"{self.touches_path}.tmp", self.touches_path)
+
+    def _read_touches(self) -> list[str]:
+        """Keys of the touch log, each once, least recently touched first. Needs the lock."""
+        touches = OrderedDict()
+        if os.path.exists(self.touches_path):
+            with open(self.touches_path, "rb") as f:
+                for line in f:
+                    key = line.strip().decode("ascii", "replace")
+                    if line.endswith(b"\n") and len(key) == 64:
+                        touches.pop(key, None)
+                        touches[key] = None
+        return list(touches)
+
+    def _parse_key_line(self, line: bytes):
+        """
+        (key, row) of a key log line, None for a damaged one. The key comes last, so a line cut short loses part
+        of it and is rejected. Lines without a row are from the older format, where the row is the line number.
+        """
+        parts = line.split()
+        if len(parts) == 1:
+            parts = [str(self._num_keys).encode("ascii")] + parts
+        if len(parts) != 2 or not parts[0].isdigit() or len(parts[1]) != 64:
+            return None
+        return parts[1].decode("ascii"), int(parts[0])
+
+    def _refresh(self):
+        """Picks up keys appended since the last refresh, or reloads everything after a compaction."""
+        meta = self._read_meta()
+        generation = meta.get("generation", 0)
+        if generation != self._generation:
+            self.rows = OrderedDict()
+            self._num_keys = 0
+            self._keys_offset = 0
+            self._generation = generation
+            # The vectors file was rewritten, a map of the old one is stale even if the row count matches.
+            self._vectors = None
+        self.dimension = meta.get("dimension", self.dimension)
+
+        if os.path.exists(self.keys_path):
+            with open(self.keys_path, "rb") as f:
+                f.seek(self._keys_offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        # Being written, or cut short by a crash; read again once it is terminated.
+                        break
+                    entry = self._parse_key_line(line)
+                    if entry is not None:
+                        self.rows[entry[0]] = entry[1]
+                    self._num_keys += 1
+                    self._keys_offset += len(line)
+
+        if self.dimension and os.path.exists(self.vectors_path) and os.path.getsize(self.vectors_path) > 0:
+            num_rows = os.path.getsize(self.vectors_path) // (4 * self.dimension)
+            if self._vectors is None or len(self._vectors) != num_rows:
+                self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r",
+                                          shape=(num_rows, self.dimension))
+        else:
+            self._vectors = None
+
+    def _compact(self):
+        """Rewrites the store with the most recently used entries only. Must be called with the lock held."""
+        # The touch log holds this process's hits too, so replaying it orders entries by their last use anywhere.
+        for key in self._read_touches():
+            if key in self.rows:
+                self.rows.move_to_end(key)
+        row_bytes = 4 * self.dimension
+        keep_count = min(len(self.rows), int(self.max_bytes * _COMPACTION_TARGET) // row_bytes)
+        kept = list(self.rows.items())[len(self.rows) - keep_count:]
+        print(f"Compacting embedding cache {self.cache_dir}: keeping {len(kept)} of {len(self.rows)} entries")
+
+        kept = [(key, row) for key, row in kept if self._vectors is not None and row < len(self._vectors)]
+        with open(f"{self.vectors_path}.tmp", "wb") as f:
+            for key, row in kept:
+                f.write(np.asarray(self._vectors[row]).tobytes())
+        with open(f"{self.keys_path}.tmp", "w") as f:
+            f.write("".join(f"{row} {key}\n" for row, (key, _) in enumerate(kept)))
+        os.replace(f"{self.vectors_path}.tmp", self.vectors_path)
+        os.replace(f"{self.keys_path}.tmp", self.keys_path)
+        if os.path.exists(self.touches_path):
+            os.remove(self.touches_path)
+
+        self._generation = (self._generation or 0) + 1
+        self._write_meta()
+        # Forces _refresh to reload the rewritten key log from the start.
+        self._generation = None
+        self._vectors = None
+        self._refresh()
+
+
+class QueryEmbeddingCache:
+    """
+    Bounded in-process LRU of query embeddings with a time to live, in front of the query embedder. Queries are
+    keyed by embedder model and normalised text, so "How to sell?" and "how to sell" share one entry. Misses
+    fall through to an optional EmbeddingCache shared by all processes on the host.
+    """
+
+    def __init__(self, model_name: str, max_entries: int = 10000, ttl_seconds: float = 24 * 3600,
+                 disk_cache: EmbeddingCache = None):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_cache = disk_cache
+
+        self.entries = OrderedDict()  # (model name, normalised query) -> (expiry time, embedding)
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        return " ".join(query.lower().split()).rstrip(_QUERY_TRAILING_PUNCTUATION)
+
+    def _key(self, query: str) -> tuple:
+        return self.model_name, self.normalize(query)
+
+    def lookup(self, queries: list[str]) -> list:
+        """Returns the cached embedding of each query, or None where it is not cached or has expired."""
+        now = time.monotonic()
+        results = [None] * len(queries)
+        with self._lock:
+            for i, query in enumerate(queries):
+                key = self._key(query)
+                entry = self.entries.get(key)
+                if entry is None:
+                    continue
+                if entry[0] < now:
+                    del self.entries[key]
+                    continue
+                self.entries.move_to_end(key)
+                results[i] = entry[1]
+                self.hits += 1
+
+        missing = [i for i, embedding in enumerate(results) if embedding is None]
+        if missing and self.disk_cache:
+            disk_results = self.disk_cache.lookup([self.normalize(queries[i]) for i in missing])
+            found = [(i, embedding) for i, embedding in zip(missing, disk_results) if embedding is not None]
+            self._insert([queries[i] for i, _ in found], [embedding for _, embedding in found])
+            for i, embedding in found:
+                results[i] = embedding
+            self.disk_hits += len(found)
+
+        self.misses += sum(embedding is None for embedding in results)
+        return results
+
+    def put_many(self, queries: list[str], embeddings: np.array):
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(len(queries), -1)
+        self._insert(queries, embeddings)
+        if self.disk_cache:
+            self.disk_cache.put_many([self.normalize(query) for query in queries], embeddings)
+
+    def _insert(self, queries: list[str], embeddings):
+        expiry = time.monotonic() + self.ttl_seconds
+        with self._lock:
+            for query, embedding in zip(queries, embeddings):
+                key = self._key(query)
+                self.entries[key] = (expiry, embedding)
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0, "size": len(self.entries)}
@@ -0,0 +1,117 @@
+import os
+import sys
+import time
+import json
+import argparse
+import faiss
+import numpy as np
+
+# Add the parent directory to Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../")))
+
+from src.index_store import IndexVersion
+from src.index_utils import build_faiss_index, resolve_index_config, search_parameters
+
+
+# Index configs compared against the flat baseline, each with the search parameters swept at query time.
+CANDIDATES = [
+    ({"type": "hnsw", "M": 32, "ef_construction": 200}, [{"ef_search": ef} for ef in (16, 32, 64, 128, 256)]),
+    ({"type": "ivf_flat", "nlist": 1024}, [{"nprobe": nprobe} for nprobe in (1, 4, 16, 64)]),
+    ({"type": "ivf_pq", "nlist": 1024, "pq_m": 16, "pq_nbits": 8}, [{"nprobe": nprobe} for nprobe in (1, 4, 16, 64)]),
+]
+
+
+def load_flat_vectors(index_version: IndexVersion) -> np.array:
+    """Reads the vectors of a flat index, in chunk order."""
+    index = index_version.read_index(writable=True)
+    if not isinstance(index, faiss.IndexIDMap2):
+        raise ValueError(f"{index_version.version_dir} is a {type(index).__name__}, "
+                         f"the flat baseline needs an exact index")
+    # Ids are chunk positions and follow the storage order of the wrapped flat index.
+    return faiss.downcast_index(index.index).reconstruct_n(0, index.ntotal)
+
+
+def load_queries(index_path: str, vectors: np.array, questions_path: str = None, num_queries: int = 1000):
+    """Embeds the questions of a questions file, or samples chunk vectors as queries when none is given."""
+    if not questions_path:
+        rows = np.random.default_rng(0).choice(len(vectors), min(num_queries, len(vectors)), replace=False)
+        return np.ascontiguousarray(vectors[np.sort(rows)])
+
+    from src.docindex import DocIndex
+    with open(questions_path, 'r') as f:
+        questions = [q["question"] for q in json.load(f)][:num_queries]
+    doc_index = DocIndex(index_path=index_path)
+    return doc_index.retrieve_question_embeddings(questions)
+
+
+def measure(index, queries: np.array, ground_truth: np.array, top_k: int, search_params: dict = None) -> dict:
+    """Recall@k against the exact results, and the latency of one-query-at-a-time searches like in serving."""
+    params = search_parameters(index, search_params)
+    results = np.empty((len(queries), top_k), dtype=np.int64)
+    latencies = np.empty(len(queries))
+    for i in range(len(queries)):
+        start = time.perf_counter()
+        if params is None:
+            _, results[i:i + 1] = index.search(queries[i:i + 1], top_k)
+        else:
+            _, results[i:i + 1] = index.search(queries[i:i + 1], top_k, params=params)
+        latencies[i] = time.perf_counter() - start
+
+    hits = sum(len(np.intersect1d(found, expected)) for found, expected in zip(results, ground_truth))
+    return {
+        "search_params": search_params or {},
+        f"recall@{top_k}": hits / ground_truth.size,
+        "latency_ms_p50": float(np.percentile(latencies, 50) * 1000),
+        "latency_ms_p95": float(np.percentile(latencies, 95) * 1000),
+    }
+
+
+def main(index_path, output_path=None, questions_path=None, top_k=5, num_queries=1000):
+    """Builds every candidate index from the vectors of a flat index and reports recall vs latency."""
+    vectors = load_flat_vectors(IndexVersion(index_path))
+    queries = load_queries(index_path, vectors, questions_path, num_queries)
+    print(f"Comparing ANN indexes on {len(vectors)} vectors with {len(queries)} queries, top_k={top_k}")
+
+    flat_index = build_faiss_index(vectors)
+    _, ground_truth = flat_index.search(queries, top_k)
+
+    report = []
+    for index_config, sweep in [({"type": "flat"}, [None])] + CANDIDATES:
+        index_config = resolve_index_config(index_config)
+        start = time.perf_counter()
+        index = build_faiss_index(vectors, index_config)
+        build_seconds = time.perf_counter() - start
+        for search_params in sweep:
+            row = {"index": index_config, "build_seconds": build_seconds,
+                   "index_bytes": int(faiss.serialize_index(index).nbytes),
+                   **measure(index, queries, ground_truth, top_k, search_params)}
+            print(f"{index_config['type']:<9} {json.dumps(row['search_params']):<20} "
+                  f"recall@{top_k}={row[f'recall@{top_k}']:.3f} p50={row['latency_ms_p50']:.3f}ms "
+                  f"p95={row['latency_ms_p95']:.3f}ms size={row['index_bytes'] / 1024 ** 2:.1f}MB")
+            report.append(row)
+
+    if output_path:
+        with open(output_path, 'w') as f:
+            json.dump(report, f, indent=4)
+        print(f"Report saved to {output_path}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recall vs latency of approximate indexes against a flat index.")
+
+    parser.add_argument("--index_path", type=str, required=True, help="Path to a flat index directory.")
+    parser.add_argument("--questions_path", type=str, help="Questions JSON file, chunk vectors are used otherwise.")
+    parser.add_argument("--topk", default=5, type=int, help="Number of neighbours compared.")
+    parser.add_argument("--num_queries", default=1000, type=int, help="Number of queries.")
+    parser.add_argument("--output_path", type=str, help="Path to save the JSON report.")
+
+    args = parser.parse_args()
+
+    main(
+        index_path=args.index_path,
+        output_path=args.output_path,
+        questions_path=args.questions_path,
+        top_k=args.topk,
+        num_queries=args.num_queries,
+    )
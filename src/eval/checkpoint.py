@@ -0,0 +1,78 @@
+import os
+import json
+import threading
+from concurrent.futures import FIRST_COMPLETED, wait
+
+
+class JsonlCheckpoint:
+    """
+    Append-only JSON lines log of the finished items of a long generation run. Each record is written and flushed
+    as soon as its item completes, so an interrupted run loses at most the requests in flight and resumes by
+    reading the log back. A truncated last line, left by a crash mid-write, is ignored.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+
+    def load(self) -> list[dict]:
+        if not os.path.exists(self.path):
+            return []
+        records = []
+        with open(self.path, 'r') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    print(f"Skipping an incomplete checkpoint line in {self.path}")
+        return records
+
+    def append(self, record: dict):
+        with self._lock:
+            if self._file is None:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                self._file = open(self.path, 'a')
+                # Start a new line after the partial record of a crashed run.
+                if not self._ends_with_newline():
+                    self._file.write("\n")
+            self._file.write(json.dumps(record) + "\n")
+            self._file.flush()
+
+    def _ends_with_newline(self) -> bool:
+        with open(self.path, 'rb') as f:
+            if f.seek(0, os.SEEK_END) == 0:
+                return True
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def completed(items, submit, concurrency: int):
+    """
+    Yields (item, future) pairs in completion order, calling submit(item) for at most `concurrency` items at a time,
+    so a large input isn't queued up front.
+    """
+    items = iter(items)
+    pending = {}
+    while True:
+        for item in items:
+            pending[submit(item)] = item
+            if len(pending) >= concurrency:
+                break
+        if not pending:
+            return
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield pending.pop(future), future
@@ -0,0 +1,136 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import numpy as np
+
+# Add the parent directory to Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../")))
+
+from src.docindex import DocIndex
+from src.generation import DialogueSystemGraph
+
+PROMPTS_PATH = "demos/demo_v0/prompts"
+
+DEFAULT_QUESTIONS = [
+    "How do I get paid for my sales?",
+    "How can I create a return policy?",
+    "What are the fees for selling on eBay?",
+    "How do I print a shipping label?",
+    "How do I offer free shipping?",
+]
+
+
+class _StubResponse:
+    def __init__(self, content: str):
+        self.content = content
+
+
+class StubLLM:
+    """Chat model stand-in answering the intent and RAG prompts with canned JSON after a fixed latency."""
+
+    model_name = "stub"
+
+    def __init__(self, latency_seconds: float = 1.0):
+        self.latency_seconds = latency_seconds
+
+    def _response(self, messages) -> _StubResponse:
+        if "Paragraph 1:" in messages[-1].content:
+            return _StubResponse(json.dumps({"case": "Clear answer", "answer": "Stub answer.",
+                                             "source": ["https://www.ebay.com/help/home"]}))
+        return _StubResponse(json.dumps({"query": "stub query", "clarity": 10, "no_search": False,
+                                         "live_agent": False}))
+
+    def invoke(self, messages):
+        time.sleep(self.latency_seconds)
+        return self._response(messages)
+
+    async def ainvoke(self, messages):
+        await asyncio.sleep(self.latency_seconds)
+        return self._response(messages)
+
+
+def load_graph(index_path: str) -> DialogueSystemGraph:
+    return DialogueSystemGraph(
+        index=DocIndex(index_path=index_path),
+        prompt_file_intent=os.path.join(PROMPTS_PATH, "dialogue_system_input_prompt.txt"),
+        prompt_file_answerer=os.path.join(PROMPTS_PATH, "rag_probing_prompt.txt"),
+        no_intent_answer_file=os.path.join(PROMPTS_PATH, "no_intent_response.txt"),
+        live_agent_answer_file=os.path.join(PROMPTS_PATH, "live_agent_response.txt"),
+        no_response_answer_file=os.path.join(PROMPTS_PATH, "no_answer_response.txt"),
+    )
+
+
+async def run_sessions(graph: DialogueSystemGraph, llm: StubLLM, questions: list[str], sessions: int, top_k: int):
+    """Runs `sessions` concurrent conversations, each asking every question once, and returns their latencies."""
+    latencies = []
+
+    async def session():
+        user_context = {'num_live_agent_calls': 0}
+        for question in questions:
+            start = time.perf_counter()
+            await graph.aanswer_question([{"role": "user", "content": question}], llm, top_k, user_context)
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*[session() for _ in range(sessions)])
+    return latencies
+
+
+def main(index_path, questions_path=None, concurrency=(1, 4, 16, 64), num_questions=5, top_k=5,
+         llm_latency=1.0, output_path=None):
+    questions = DEFAULT_QUESTIONS
+    if questions_path:
+        with open(questions_path, 'r') as f:
+            questions = [q["question"] for q in json.load(f)]
+    questions = questions[:num_questions]
+
+    graph = load_graph(index_path)
+    llm = StubLLM(llm_latency)
+    # Warm the embedder and the index before timing.
+    graph.answer_question([{"role": "user", "content": questions[0]}], llm, top_k, {'num_live_agent_calls': 0})
+
+    report = []
+    for sessions in concurrency:
+        start = time.perf_counter()
+        latencies = asyncio.run(run_sessions(graph, llm, questions, sessions, top_k))
+        elapsed = time.perf_counter() - start
+        row = {"sessions": sessions, "questions": len(latencies), "seconds": elapsed,
+               "questions_per_second": len(latencies) / elapsed,
+               "latency_p50": float(np.percentile(latencies, 50)),
+               "latency_p95": float(np.percentile(latencies, 95))}
+        print(f"sessions={sessions:<4} {row['questions_per_second']:.2f} questions/s "
+              f"p50={row['latency_p50']:.2f}s p95={row['latency_p95']:.2f}s")
+        report.append(row)
+
+    if output_path:
+        with open(output_path, 'w') as f:
+            json.dump(report, f, indent=4)
+        print(f"Report saved to {output_path}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Throughput of the async dialogue pipeline against a stub LLM.")
+
+    parser.add_argument("--index_path", type=str, required=True, help="Path to the index directory.")
+    parser.add_argument("--questions_path", type=str, help="Questions JSON file, a few built-in questions otherwise.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64],
+                        help="Numbers of concurrent sessions to measure.")
+    parser.add_argument("--num_questions", default=5, type=int, help="Questions asked per session.")
+    parser.add_argument("--topk", default=5, type=int, help="Number of paragraphs retrieved.")
+    parser.add_argument("--llm_latency", default=1.0, type=float, help="Seconds the stub LLM takes per call.")
+    parser.add_argument("--output_path", type=str, help="Path to save the JSON report.")
+
+    args = parser.parse_args()
+
+    main(
+        index_path=args.index_path,
+        questions_path=args.questions_path,
+        concurrency=args.concurrency,
+        num_questions=args.num_questions,
+        top_k=args.topk,
+        llm_latency=args.llm_latency,
+        output_path=args.output_path,
+    )
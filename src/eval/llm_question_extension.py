@@ -1,8 +1,12 @@
 
 import json
+import time
 from pychomsky.chchat import EbayLLMChatWrapper
 import argparse
-from src.eval.llm_question_generator import generate_questions
+from tqdm import tqdm
+from src.config import LLM_MAX_WORKERS, QUESTION_VARIANT_BATCH_SIZE
+from src.eval.checkpoint import JsonlCheckpoint, completed
+from src.eval.llm_question_generator import llm_client, questions_result, submit_questions
 
 
 import os
@@ -13,52 +17,115 @@ propmt_file_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "./pr
 with open(propmt_file_path, 'r') as p_file:
     QUESTION_VARIANT_PROMPT = p_file.read()
 
-def generate_question_variants(questions, output_file):
+propmt_file_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "./prompts/question_variation_batch_generator.txt"))
+with open(propmt_file_path, 'r') as p_file:
+    QUESTION_VARIANT_BATCH_PROMPT = p_file.read()
+
+def _batch_variants(batch, result):
+    """
+    Variants of a batch of questions from a batched response, in input order, None for the missing ones. Entries
+    are matched on their original_question; when the response has one entry per question, an entry that matches
+    none is taken for the unmatched question at its position. Anything else is left out to be retried.
+    """
+    if not isinstance(result, list):
+        return [None] * len(batch)
+    variants = [None] * len(batch)
+    unmatched = set()
+    positions = {}
+    for i, q in enumerate(batch):
+        positions.setdefault(q, []).append(i)
+    for j, r in enumerate(result):
+        if not isinstance(r, dict):
+            continue
+        candidates = positions.get(r.get("original_question"))
+        if candidates:
+            variants[candidates.pop(0)] = r
+        else:
+            unmatched.add(j)
+    if len(result) == len(batch):
+        # A rephrased question still comes back at its input position.
+        for j in unmatched:
+            if variants[j] is None:
+                variants[j] = dict(result[j], original_question=batch[j])
+    return variants
+
+
+def generate_question_variants(questions, output_file, concurrency=LLM_MAX_WORKERS,
+                               batch_size=QUESTION_VARIANT_BATCH_SIZE, checkpoint_file=None):
+    """
+    Generate variants of each question and save them to a JSON file.
+
+    Questions are sent to the LLM `concurrency` requests at a time, `batch_size` questions per request, and the
+    variants of each original question are appended to a JSON lines checkpoint (`output_file` + ".jsonl" by default)
+    as soon as they arrive. A rerun skips the questions found in the checkpoint or in an existing output file; the
+    output file is written once at the end.
+    """
     print(f"Start quetion variants generation fro #{len(questions)} questions")
 
-    question_variants = []
-    visited_questions = set()
-    
+    checkpoint = JsonlCheckpoint(checkpoint_file or output_file + ".jsonl")
+    variants_by_question = {}
+
     # If the file exists, load the existing questions
     if os.path.exists(output_file):
         with open(output_file, 'r') as json_file:
-            question_variants = json.load(json_file)
-            visited_questions = set([q['original_question'] for q in question_variants])
-            print(f"Loaded #{len(visited_questions)} visited_questions")
-    
-    count = 0  # Counter to track the number of newly added questions
+            for q in json.load(json_file):
+                variants_by_question[q['original_question']] = q
+    for record in checkpoint.load():
+        variants_by_question[record['original_question']] = record
+    print(f"Loaded #{len(variants_by_question)} visited_questions")
 
+    urls = {}
     for question in questions:
-        q = question['question']
-        if q not in visited_questions:
-            variant_qs = generate_questions(str(QUESTION_VARIANT_PROMPT), q)
-
-            if variant_qs:
-                variant_qs["url"] = question["url"]
-                question_variants.append(variant_qs)
-                visited_questions.add(q)
-                count += 1  # Increment the counter for each new question added
-
-                # Save to file every time the count reaches a multiple of 50
-                if count % 20 == 0:
-                    with open(output_file, 'w') as json_file:
-                        json.dump(question_variants, json_file, indent=4)
-                    print(f"Intermediate save: wrote #{len(visited_questions)} questions so far")
-
-    # Final save at the end to ensure all questions are written to the file
+        if question['question'] not in variants_by_question:
+            urls.setdefault(question['question'], question['url'])
+    pending = list(urls)
+    batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+
+    def submit(batch):
+        if batch_size == 1:
+            return submit_questions(str(QUESTION_VARIANT_PROMPT), batch[0])
+        return submit_questions(str(QUESTION_VARIANT_BATCH_PROMPT), json.dumps(batch, indent=4))
+
+    start, start_stats = time.perf_counter(), llm_client.stats()
+    with checkpoint, tqdm(total=len(pending), desc="Generating Variants", unit="question") as progress:
+        for batch, future in completed(batches, submit, concurrency):
+            result = questions_result(future)
+            results = [result] if batch_size == 1 else _batch_variants(batch, result)
+            for q, variant_qs in zip(batch, results):
+                if isinstance(variant_qs, dict):
+                    variant_qs["url"] = urls[q]
+                    variants_by_question[q] = variant_qs
+                    checkpoint.append(variant_qs)
+            progress.update(len(batch))
+
+    elapsed = time.perf_counter() - start
+    stats = {name: value - start_stats[name] for name, value in llm_client.stats().items()}
+    print(f"Processed {len(pending)} questions in {elapsed:.1f}s ({len(pending) / elapsed:.2f} questions/s), "
+          f"{stats['requests']} requests, {stats['prompt_tokens']} prompt and {stats['completion_tokens']} "
+          f"completion tokens")
+
+    # Final save at the end, in the order of the input questions
+    order = {}
+    for i, question in enumerate(questions):
+        order.setdefault(question['question'], i)
+    question_variants = sorted(variants_by_question.values(),
+                               key=lambda q: order.get(q['original_question'], len(order)))
+    visited_questions = set(variants_by_question)
     with open(output_file, 'w') as json_file:
         json.dump(question_variants, json_file, indent=4)
     print(f"Final save: wrote #{len(visited_questions)} questions")
 
     return question_variants, visited_questions
 
-def main(input_data_path, output_data_path):
+def main(input_data_path, output_data_path, concurrency=LLM_MAX_WORKERS, batch_size=QUESTION_VARIANT_BATCH_SIZE):
     """
     Main function to generate synthetic question variants.
 
     Args:
         input_data_path (str): Path to the input JSON file containing questions.
         output_data_path (str): Path to the output JSON file for saving questions.
+        concurrency (int): Number of LLM requests in flight, up to the LLM_MAX_WORKERS of the shared client.
+        batch_size (int): Number of questions per LLM request.
     """
     if not os.path.exists(input_data_path):
         raise ValueError(f"The input path does not exist: {input_data_path}")
@@ -67,7 +134,7 @@ def main(input_data_path, output_data_path):
     with open(input_data_path, 'r') as file:
         questions = json.load(file)
     
-    generate_question_variants(questions, output_data_path)
+    generate_question_variants(questions, output_data_path, concurrency, batch_size)
 
 
 if __name__ == "__main__":
@@ -88,8 +155,20 @@ if __name__ == "__main__":
         type=str,
         required=True
     )
+    parser.add_argument(
+        "--concurrency",
+        help="Number of LLM requests in flight.",
+        type=int,
+        default=LLM_MAX_WORKERS
+    )
+    parser.add_argument(
+        "--batch_size",
+        help="Number of questions per LLM request.",
+        type=int,
+        default=QUESTION_VARIANT_BATCH_SIZE
+    )
 
     args = parser.parse_args()
 
     # Run the main function
-    main(args.input_data_path, args.output_data_path)
\ No newline at end of file
+    main(args.input_data_path, args.output_data_path, args.concurrency, args.batch_size)
\ No newline at end of file
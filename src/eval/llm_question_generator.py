@@ -1,66 +1,54 @@
 import json
+from concurrent.futures import Future
 from pychomsky.chchat import EbayLLMChatWrapper
-import random
-import time
 
+from src.config import LLM_CACHE_PATH, LLM_MAX_WORKERS, LLM_RATE_LIMITS
+from src.llm_cache import CachedChatModel, LLMResponseCache
+from src.llm_client import LLMClient
 
-llm = EbayLLMChatWrapper(
+
+def _is_json(content) -> bool:
+    try:
+        json.loads(content)
+        return True
+    except json.JSONDecodeError:
+        return False
+
+
+# Cached, so rerunning a generation replays the questions of the first run instead of calling the LLM again.
+llm = CachedChatModel(
+    EbayLLMChatWrapper(
         model_name="openai-chat-completions-gpt-4o-mini-2024-07-18",
         temperature=0.5,
         max_tokens=2048
-    )
+    ),
+    LLMResponseCache(LLM_CACHE_PATH),
+    validate=_is_json,
+)
+llm_client = LLMClient(max_workers=LLM_MAX_WORKERS, rate_limits=LLM_RATE_LIMITS)
 
-def retry_with_backoff(
-    func,
-    args=None,
-    kwargs=None,
-    max_retries=3,
-    base_sleep=2,
-    exceptions=(Exception,),
-    skip_retry_exceptions=(json.JSONDecodeError,),
-):
-    """
-    A generic retry mechanism with exponential backoff and jitter.
-
-    Args:
-        func (callable): The function to retry.
-        args (tuple): Positional arguments to pass to the function.
-        kwargs (dict): Keyword arguments to pass to the function.
-        max_retries (int): Maximum number of retries.
-        base_sleep (int): Base sleep time for exponential backoff.
-        exceptions (tuple): Tuple of exception types to retry on.
 
-    Returns:
-        Any: The result of the function if it succeeds.
-
-    Raises:
-        Exception: The last exception if all retries fail.
+def generate_questions(prompt, text):
     """
-    args = args or ()
-    kwargs = kwargs or {}
-    retries = 0
+    Generate questions using an LLM call.
+    """
+    return questions_result(submit_questions(prompt, text))
 
-    while retries <= max_retries:
-        try:
-            # Attempt the function call
-            return func(*args, **kwargs)
-        except skip_retry_exceptions as e:
-            retries += 1
-            if retries > max_retries:
-                return None
-        except exceptions as e:
-            retries += 1
-            if retries > max_retries:
-                return None
-            
-            sleep_time = base_sleep * retries
-            print(f"Retrying ({retries}/{max_retries}) after {sleep_time:.2f} seconds due to: The request limit has been reached for the resource")
-            time.sleep(sleep_time)
+
+def questions_result(future: Future):
+    """The questions of a submit_questions call, or None if the call failed."""
+    try:
+        return future.result()
+    except Exception as e:
+        # Rate limits and malformed responses are already retried by the client.
+        print(f"Question generation failed: {e}")
+        return None
 
 
-def generate_questions(prompt, text):
+def submit_questions(prompt, text) -> Future:
     """
-    Generate questions using an LLM call.
+    Queues the LLM call generating questions on the shared client, the future resolves to the parsed questions.
+    Responses that aren't valid JSON are asked for again by the client; the future raises once its retries run out.
     """
     formatted_prompt = prompt.replace("{{text}}", text)
     messages = [
@@ -68,20 +56,11 @@ def generate_questions(prompt, text):
         {"role": "user", "content": formatted_prompt}
     ]
 
-    # Define the function to call the LLM
-    def llm_call():
-        response = llm.invoke(messages)  # Replace `llm.invoke` with your actual API call
+    def parse(response):
         return extract_json(response.content)
 
-    # Use the generic retry mechanism
-    return retry_with_backoff(
-        llm_call,
-        max_retries=5,
-        base_sleep=10,
-        exceptions=(Exception,),
-        skip_retry_exceptions=(json.JSONDecodeError,)
-    )
-                              
+    return llm_client.submit(llm, messages, parse)
+
 
 def extract_json(content):
     """
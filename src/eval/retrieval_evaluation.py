@@ -1,5 +1,6 @@
 import os
 import pickle
+import numpy as np
 from tqdm import tqdm
 import sys
 import argparse
@@ -51,14 +52,19 @@ def calculate_mAP(hit_counts, total_cnt):
     return map
 
 class DocumentRetrievalEvaluator:
-    def __init__(self, document_path, chunk_index_path, chunk_size=384, model_name='MPNet-V2', question_emb_cach_path=None):
+    def __init__(self, document_path, chunk_index_path, chunk_size=384, model_name='MPNet-V2', question_emb_cach_path=None,
+                 retrieval_mode="dense", collapse=None):
         """
         Initialize the evaluator.
         
         :param base_path: Base directory for index and content files.
         :param embedder_model: Dictionary containing embedder model details (name, index_path).
         :param top_ks: List of top-k values for evaluation.
+        :param retrieval_mode: dense, lexical (BM25) or hybrid retrieval.
+        :param collapse: max or sum to retrieve distinct URLs instead of chunks.
         """
+        self.retrieval_mode = retrieval_mode
+        self.collapse = collapse
         self.model_name = model_name
         self.model_name = MODELS[model_name]
         
@@ -104,6 +110,22 @@ class DocumentRetrievalEvaluator:
 
         return res_urls
 
+    def embed_questions(self, questions, batch_size=256):
+        """
+        Embed questions in batches, reusing cached question embeddings.
+        
+        :param questions: List of question strings.
+        :param batch_size: Number of questions embedded per batch.
+        :return: Matrix with one normalised embedding row per question.
+        """
+        missing = [q for q in dict.fromkeys(questions) if q not in self.question_embedding_cache]
+        for start in tqdm(range(0, len(missing), batch_size), desc="Embedding Questions"):
+            batch = missing[start:start + batch_size]
+            for q, query_embedding in zip(batch, self.d.retrieve_question_embeddings(batch, batch_size)):
+                self.question_embedding_cache[q] = query_embedding.reshape(1, -1)
+
+        return np.vstack([self.question_embedding_cache[q] for q in questions])
+
     def evaluate(self, questions, top_k):
         """
         Evaluate the retrieval performance for given questions.
@@ -111,11 +133,16 @@ class DocumentRetrievalEvaluator:
         :param questions: List of dictionaries containing 'url' and 'question'.
         :return: Dictionary of hit counts for each top_k value.
         """
+        # All questions are searched with a single batched index call.
+        question_texts = [question["question"] for question in questions]
+        query_embeddings = self.embed_questions(question_texts) if self.retrieval_mode != "lexical" else None
+        _, results = self.d.search_many(question_texts, top_k, mode=self.retrieval_mode,
+                                        query_embeddings=query_embeddings, collapse=self.collapse)
+
         hit_counts = defaultdict(int)
-        for question in tqdm(questions, desc="Evaluating Questions"):
+        for question, hits in zip(questions, results):
             gt_url = question["url"]
-            q = question["question"]
-            recall_urls = self.search(question=q, top_k=top_k)
+            recall_urls = [result["url"] for result in hits]
             
             hit = 0
             for idx, url in enumerate(recall_urls):
@@ -141,7 +168,8 @@ class DocumentRetrievalEvaluator:
             print(f"Hit@{k}: {hits}/{total_questions} ({percentage:.2f}%)")
 
 
-def main(questions_path, document_path, chunk_index_path, top_k=5, chunk_size=384, index_model_name='MPNet-V2', question_emb_cach_path=None, question_type="standard"):
+def main(questions_path, document_path, chunk_index_path, top_k=5, chunk_size=384, index_model_name='MPNet-V2', question_emb_cach_path=None, question_type="standard",
+         retrieval_mode="dense", collapse=None):
     assert os.path.exists(questions_path), f"The questions file does not exist: {questions_path}"
     assert os.path.exists(document_path), f"The document file does not exist: {document_path}"
 
@@ -155,6 +183,8 @@ def main(questions_path, document_path, chunk_index_path, top_k=5, chunk_size=38
         model_name=index_model_name,
         chunk_size=chunk_size,
         question_emb_cach_path=question_emb_cach_path,
+        retrieval_mode=retrieval_mode,
+        collapse=collapse,
     )
 
     if question_type == "standard":
@@ -192,6 +222,9 @@ if __name__ == "__main__":
     parser.add_argument("--document_path", type=str, required=True, help="Path to the document JSON file.")
     parser.add_argument("--chunk_index_path", type=str, required=True, help="Path to the chunk index directory.")
     parser.add_argument("--question_emb_cach_path", type=str, help="Path to cache question embeddings.")
+    parser.add_argument("--retrieval_mode", default="dense", choices=["dense", "lexical", "hybrid"],
+                        help="Dense, BM25 or hybrid retrieval.")
+    parser.add_argument("--collapse", choices=["max", "sum"], help="Evaluate the top distinct URLs instead of chunks.")
 
     args = parser.parse_args()
 
@@ -202,4 +235,6 @@ if __name__ == "__main__":
         top_k=args.topk,
         index_model_name=args.index_model_name,
         question_emb_cach_path=args.question_emb_cach_path,
+        retrieval_mode=args.retrieval_mode,
+        collapse=args.collapse,
     )
@@ -1,8 +1,11 @@
 import os
+import time
 import argparse
 from tqdm import tqdm
 import json
-from src.eval.llm_question_generator import generate_questions
+from src.config import LLM_MAX_WORKERS
+from src.eval.checkpoint import JsonlCheckpoint, completed
+from src.eval.llm_question_generator import llm, llm_client, questions_result, submit_questions
 
 
 # Define the synthetic question prompt as a constant
@@ -11,82 +14,95 @@ with open(propmt_file_path, 'r') as p_file:
     SYNTHETIC_QUESTION_PROMPT = p_file.read()
 
 
-def generate_synthetic_questions(documents, output_file):
+def generate_synthetic_questions(documents, output_file, concurrency=LLM_MAX_WORKERS, checkpoint_file=None):
     """
     Generate synthetic questions from a list of documents and save them to a JSON file.
 
+    Documents are sent to the LLM `concurrency` at a time and the questions of each one are appended to a JSON lines
+    checkpoint (`output_file` + ".jsonl" by default) as soon as they arrive. A rerun skips the documents found in the
+    checkpoint or in an existing output file; the output file is written once at the end.
+
     Args:
         documents (list): List of dictionaries, where each dictionary contains "url" and "content" keys.
         output_file (str): Path to the output JSON file to store generated questions.
+        concurrency (int): Number of LLM requests in flight, up to the LLM_MAX_WORKERS of the shared client.
+        checkpoint_file (str): Path to the JSON lines checkpoint.
 
     Returns:
         tuple: A list of generated questions and a set of visited URLs.
     """
 
-    questions = []
-    visited_urls = set()
+    checkpoint = JsonlCheckpoint(checkpoint_file or output_file + ".jsonl")
+    questions_by_url = {}
     if os.path.exists(output_file):
-        print(output_file)
         with open(output_file, 'r') as json_file:
-            questions = json.load(json_file)
-            visited_urls = set([q['url'] for q in questions])
-            print(f"proload question for #{len(visited_urls)} documents")
-        
-   # Calculate the remaining documents to process
-    rest_doc_cnt = len(documents) - len(visited_urls)
-
-    if rest_doc_cnt == 0:
+            for q in json.load(json_file):
+                questions_by_url.setdefault(q['url'], []).append(q)
+    for record in checkpoint.load():
+        questions_by_url[record['url']] = record['questions']
+    if questions_by_url:
+        print(f"proload question for #{len(questions_by_url)} documents")
+
+    def collect():
+        # Questions in document order, whatever order they were generated in.
+        order = {doc["url"]: i for i, doc in enumerate(documents)}
+        urls = sorted(questions_by_url, key=lambda url: order.get(url, len(order)))
+        return [q for url in urls for q in questions_by_url[url]]
+
+    rest_docs = [doc for doc in documents if doc["url"] not in questions_by_url]
+    if not rest_docs:
         print("All documents have generated questions. Skipping.")
-        return questions, visited_urls
-    
-    print(f"Starting to generate questions for {rest_doc_cnt} documents...")
+        return collect(), set(questions_by_url)
 
-    count = 0
+    print(f"Starting to generate questions for {len(rest_docs)} documents...")
 
-    # Use tqdm to show progress
-    for doc in tqdm(documents, desc="Generating Questions"):
-        url = doc["url"]
+    def submit(doc):
+        return submit_questions(str(SYNTHETIC_QUESTION_PROMPT), doc["content"])
 
-        # Skip documents that have already been processed
-        if url not in visited_urls:
+    start, start_stats, start_hits = time.perf_counter(), llm_client.stats(), llm.hits
+    with checkpoint, tqdm(total=len(rest_docs), desc="Generating Questions", unit="doc") as progress:
+        for doc, future in completed(rest_docs, submit, concurrency):
+            url = doc["url"]
+            qs = questions_result(future)
             try:
-                # Generate questions using the provided function
-                qs = generate_questions(str(SYNTHETIC_QUESTION_PROMPT), doc["content"])
-
                 if qs:
-                    # Append new questions to the list
-                    questions += [{
-                        "question": q["question"], 
+                    questions_by_url[url] = [{
+                        "question": q["question"],
                         "answer": q["answer"],
                         "url": url
                     } for q in qs]
-                    visited_urls.add(url)
-                    count += 1
-
-                    # Save to file every time the count reaches a multiple of 50
-                    if count % 20 == 0:
-                        with open(output_file, 'w') as json_file:
-                            json.dump(questions, json_file, indent=4)
-                        print(f"Intermediate save: wrote #{len(visited_urls)} documents' qeustions so far")
-
+                    checkpoint.append({"url": url, "questions": questions_by_url[url]})
             except Exception as e:
-                # Log any exceptions during question generation
+                # Log malformed generations, the document is retried on the next run.
                 print(f"Error processing URL {url}: {e}")
 
+            progress.update()
+            stats = llm_client.stats()
+            progress.set_postfix(prompt_tokens=stats["prompt_tokens"], completion_tokens=stats["completion_tokens"],
+                                 cache_hits=llm.hits)
+
+    elapsed = time.perf_counter() - start
+    stats = {name: value - start_stats[name] for name, value in llm_client.stats().items()}
+    print(f"Processed {len(rest_docs)} documents in {elapsed:.1f}s ({len(rest_docs) / elapsed:.2f} docs/s), "
+          f"{stats['prompt_tokens']} prompt and {stats['completion_tokens']} completion tokens, "
+          f"{llm.hits - start_hits} cached responses")
+
     # Save all generated questions to the output file
+    questions = collect()
     with open(output_file, 'w') as json_file:
         json.dump(questions, json_file, indent=4)
 
     print(f"Finished generating questions. Total: {len(questions)}")
-    return questions, visited_urls
+    return questions, set(questions_by_url)
 
-def main(input_data_path, output_data_path):
+def main(input_data_path, output_data_path, concurrency=LLM_MAX_WORKERS):
     """
     Main function to generate synthetic questions from documents.
 
     Args:
         input_data_path (str): Path to the input JSON file containing documents.
         output_data_path (str): Path to the output JSON file for saving questions.
+        concurrency (int): Number of LLM requests in flight.
     """
     if not os.path.exists(input_data_path):
         raise ValueError(f"The input path does not exist: {input_data_path}")
@@ -95,7 +111,7 @@ def main(input_data_path, output_data_path):
     with open(input_data_path, 'r') as file:
         documents = json.load(file)
     
-    questions, _ = generate_synthetic_questions(documents, output_data_path)
+    questions, _ = generate_synthetic_questions(documents, output_data_path, concurrency)
 
     return questions
 
@@ -118,8 +134,14 @@ if __name__ == "__main__":
         type=str,
         required=True
     )
+    parser.add_argument(
+        "--concurrency",
+        help="Number of LLM requests in flight.",
+        type=int,
+        default=LLM_MAX_WORKERS
+    )
 
     args = parser.parse_args()
 
     # Run the main function
-    main(args.input_data_path, args.output_data_path)
\ No newline at end of file
+    main(args.input_data_path, args.output_data_path, args.concurrency)
\ No newline at end of file
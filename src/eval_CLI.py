@@ -15,6 +15,7 @@ class EvalCLI(object):
     - generate_questions: Generate synthetic questions from documents.
     - generate_question_variants: Extend synthetic questions into variants.
     - evaluate_retrieval: Evaluate retrieval models using synthetic and variant questions.
+    - evaluate_ann: Compare recall and latency of approximate indexes against the flat index.
     """
 
     def __init__(self, sys_args):
@@ -25,6 +26,7 @@ class EvalCLI(object):
             generate_questions           Generate synthetic questions from documents
             generate_question_variants   Extend synthetic questions into variants
             evaluate_retrieval           Evaluate retrieval models
+            evaluate_ann                 Compare approximate indexes against the flat index
         ''')
         parser.add_argument('command', help='Subcommand to run')
         parser.add_argument("--config_file_path", default="", help="Path to the configuration file")
@@ -95,15 +97,18 @@ class EvalCLI(object):
 
                 chuck_size = variant.get("chunk_size", 384)
                 model_name = variant.get("model_name", "MPNet-V2")
+                retrieval_mode = variant.get("retrieval_mode", "dense")
+                collapse = variant.get("collapse")
 
                 if "index_file_path" in variant:
                     index_file_path =  variant["index_file_path"]
                 else:
-                    index_file_path = os.path.join(index_cache_path, f"{expr_name}_{model_name}_{chuck_size}_index.pkl")
+                    index_file_path = os.path.join(index_cache_path, f"{expr_name}_{model_name}_{chuck_size}_index")
                 generate_question_path = os.path.join(expr_dir, f"questions.json")
                 question_variant_path = os.path.join(expr_dir, f"question_variants.json")
                 question_emb_cach_path = os.path.join(expr_dir, f"{model_name}_question_emb.pkl")
                 question_variant_emb_cach_path = os.path.join(expr_dir, f"{model_name}_question_variant_emb.pkl")
+                ann_report_path = os.path.join(expr_dir, f"{model_name}_{chuck_size}_ann_report.json")
                
 
                 experiments.append({
@@ -111,11 +116,14 @@ class EvalCLI(object):
                     "document_path": document_path,
                     "index_model_name": model_name,
                     "chuck_size": chuck_size,
+                    "retrieval_mode": retrieval_mode,
+                    "collapse": collapse,
                     "index_file_path": index_file_path,
                     "generate_question_path": generate_question_path,
                     "question_variant_path": question_variant_path,
                     "question_emb_cach_path": question_emb_cach_path if cache_question_emb else None,
                     "question_variant_emb_cache_path": question_variant_emb_cach_path if cache_question_emb else None,
+                    "ann_report_path": ann_report_path,
                     "output_path": output_path
                 })
 
@@ -133,6 +141,14 @@ class EvalCLI(object):
         for experiment in experiments_config:
             main(experiment["document_path"], experiment["generate_question_path"])
 
+    def evaluate_ann(self, experiments_config, **args):
+        from src.eval.ann_evaluation import main
+        for experiment in experiments_config:
+            # The flat index of the experiment is built by evaluate_retrieval.
+            questions_path = experiment["generate_question_path"]
+            main(experiment["index_file_path"], experiment["ann_report_path"],
+                 questions_path=questions_path if os.path.exists(questions_path) else None)
+
     def evalate_retrieval(self, experiments_config, output_path=None, evaluate_variants=False):
 
         # questions_path, document_path, chunk_index_path, top_k=5, chunk_size=384, index_model_name='MPNet-V2', question_emb_cach_path=None
@@ -159,11 +175,15 @@ class EvalCLI(object):
                                  chunk_index_path=experiment["index_file_path"],
                                  chunk_size=experiment["chuck_size"],
                                  index_model_name=experiment["index_model_name"],
-                                 question_emb_cach_path=experiment["question_emb_cach_path"])
+                                 question_emb_cach_path=experiment["question_emb_cach_path"],
+                                 retrieval_mode=experiment["retrieval_mode"],
+                                 collapse=experiment["collapse"])
             print(f"[Step 2 Completed] Metrics: hit_rate={hit_rate}, mAP={mAP}\n")
 
             expr_result = {
                     "chunk_size": experiment["chuck_size"],
+                    "retrieval_mode": experiment["retrieval_mode"],
+                    "collapse": experiment["collapse"],
                     "metrics":{
                         "hit_rate": hit_rate,
                         "mAP": mAP
@@ -184,7 +204,9 @@ class EvalCLI(object):
                                     chunk_size=experiment["chuck_size"],
                                     index_model_name=experiment["index_model_name"],
                                     question_emb_cach_path=experiment["question_variant_emb_cache_path"],
-                                    question_type="variant")
+                                    question_type="variant",
+                                    retrieval_mode=experiment["retrieval_mode"],
+                                    collapse=experiment["collapse"])
                 print(f"[Step 4 Completed] Metrics: variant_hit_rate={variant_hit_rate}, variant_mAP={variant_mAP}\n")
 
                 expr_result["metrics"]["variant_hit_rate"] = variant_hit_rate
@@ -1,19 +1,24 @@
 import json
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 
 from langchain_core.messages import HumanMessage
 from pychomsky.chchat import AzureOpenAIChatWrapper, EbayLLMChatWrapper
 
+from src.config import LLM_CACHE_PATH
+from src.answer_cache import SemanticAnswerCache
+from src.llm_cache import CachedChatModel, LLMResponseCache
+from src.llm_client import LLMClient
+from src.prompt_builder import PromptBuilder, format_message, format_paragraph
+from src.rerank import CrossEncoderReranker
+
 
 _LIVE_AGENT_CALLS_THRESH = 2
 
 
 def conversation_from_messages(messages: list) -> str:
-    conversation = ""
-
-    for message in messages:
-        conversation += message['role'].upper() + ':\n'
-        conversation += message['content'] + '\n\n'
-    return conversation
+    return "".join(format_message(message) for message in messages)
 
 
 def parse_json_safely(json_string: str) -> dict | None:
@@ -51,44 +56,264 @@ def format_answer_from_json(json_response, default_link="https://www.ebay.com/he
         return f"Please go to {default_link} to get support."
 
 
+class StreamingJsonField:
+    """
+    Incremental parser of a JSON object streamed in chunks, decoding the value of the first top-level string field
+    among `fields` as it arrives. feed() returns the newly decoded text of that field; raw holds everything fed.
+    """
+
+    def __init__(self, fields: tuple = ("answer",)):
+        self.fields = fields
+        self.field = None
+        self.value = ""
+        self.raw = ""
+        self.closed = False
+        self._depth = 0
+        self._in_string = False
+        self._streaming = False
+        self._escape = ""
+        self._high_surrogate = ""
+        self._string = []
+        self._key = None
+        self._after_colon = False
+
+    def feed(self, chunk: str) -> str:
+        self.raw += chunk
+        decoded = []
+        for char in chunk:
+            if self._in_string:
+                self._string_char(char, decoded)
+            elif char == '"':
+                self._in_string = True
+                self._string = []
+                self._streaming = self._depth == 1 and self._after_colon and self.field is None and \
+                    self._key in self.fields
+                if self._streaming:
+                    self.field = self._key
+            elif char in '{[':
+                self._depth += 1
+            elif char in '}]':
+                self._depth -= 1
+                self.closed = self._depth == 0
+            elif self._depth == 1 and char == ':':
+                self._after_colon = True
+            elif self._depth == 1 and char == ',':
+                self._after_colon, self._key = False, None
+        text = "".join(decoded)
+        self.value += text
+        return text
+
+    def _string_char(self, char: str, decoded: list):
+        if self._escape:
+            self._escape += char
+            if self._escape[1] == 'u' and len(self._escape) < 6:
+                return
+            char, self._escape = json.loads(f'"{self._escape}"'), ""
+            # A character outside the BMP comes as two \u escapes.
+            if '\ud800' <= char <= '\udbff':
+                self._high_surrogate = char
+                return
+            if self._high_surrogate:
+                char = (self._high_surrogate + char).encode('utf-16', 'surrogatepass').decode('utf-16')
+                self._high_surrogate = ""
+        elif char == '\\':
+            self._escape = char
+            return
+        elif char == '"':
+            self._in_string = False
+            if self._streaming:
+                self._streaming = False
+            elif self._depth == 1 and not self._after_colon:
+                self._key = "".join(self._string)
+            return
+
+        if self._streaming:
+            decoded.append(char)
+        else:
+            self._string.append(char)
+
+
+def _remaining_response(streamed: str, response: str) -> str:
+    """What is left to show of the final response once `streamed` is already on screen."""
+    if response.startswith(streamed):
+        return response[len(streamed):]
+    return f"\n\n{response}" if streamed else response
+
+
+def _model_name(llm) -> str:
+    return getattr(llm, 'model_name', None) or type(llm).__name__
+
+
 class Answerer:
-    def __init__(self, index, prompt_file):
+    def __init__(self, index, prompt_file, collapse: str | None = None, reranker: CrossEncoderReranker = None,
+                 answer_cache: SemanticAnswerCache = None, prompt_builder: PromptBuilder = None,
+                 llm_client: LLMClient = None):
         self.index = index
+        # "max" or "sum" retrieves top_k distinct webpages instead of top_k chunks.
+        self.collapse = collapse
+        # Picks the top_k paragraphs out of reranker.candidates retrieved ones.
+        self.reranker = reranker
+        self.answer_cache = answer_cache
+        # Fits the history and paragraphs into token budgets, the whole conversation and all paragraphs otherwise.
+        self.prompt_builder = prompt_builder
+        # Rate limits and retries the LLM calls when set.
+        self.llm_client = llm_client
         # Load the prompt template from the file
         with open(prompt_file, 'r') as file:
             self.prompt_template = file.read()
 
-    def get_raw_response(self, messages: list[dict], llm: AzureOpenAIChatWrapper, top_k: int, query: str | None = None):
-        # Perform the search to retrieve relevant paragraphs
-        assert messages and messages[-1]['role'] == 'user'
-        if not query:
-            query = messages[-1]['content']
-
-        search_results = self.index.search_full(query, top_k)
-
-        # Change for the future when we'll have more metadata in the index
-        combined_paragraphs_webpages = "\n".join(
-            [f"Paragraph {i + 1}:\n{res['chunk']}\nSource {i + 1}:\n{res['url']}\n" for i, res in
-             enumerate(search_results)])
-
-        conversation = conversation_from_messages(messages)
+    def invoke_llm(self, llm: AzureOpenAIChatWrapper, messages: list):
+        return self.llm_client.invoke(llm, messages) if self.llm_client else llm.invoke(messages)
+
+    async def ainvoke_llm(self, llm: AzureOpenAIChatWrapper, messages: list):
+        if self.llm_client:
+            return await asyncio.wrap_future(self.llm_client.submit(llm, messages))
+        return await llm.ainvoke(messages)
+
+    def stream_llm(self, llm: AzureOpenAIChatWrapper, messages: list):
+        return self.llm_client.stream(llm, messages) if self.llm_client else llm.stream(messages)
+
+    def retrieve(self, query: str, top_k: int) -> list[dict]:
+        """Perform the search to retrieve relevant paragraphs"""
+        if self.reranker:
+            search_results = self.index.search_full(query, max(top_k, self.reranker.candidates),
+                                                    collapse=self.collapse)
+            return self.reranker.rerank(query, search_results, top_k)
+        return self.index.search_full(query, top_k, collapse=self.collapse)
+
+    def build_prompt(self, messages: list[dict], search_results: list[dict], metrics: dict | None = None) -> str:
+        token_counts = {}
+        if self.prompt_builder:
+            combined_paragraphs_webpages = self.prompt_builder.paragraphs(search_results, token_counts)
+            conversation = self.prompt_builder.history(messages, token_counts)
+        else:
+            # Change for the future when we'll have more metadata in the index
+            combined_paragraphs_webpages = "\n".join(
+                [format_paragraph(i, res['chunk'], res['url']) for i, res in enumerate(search_results)])
+            conversation = conversation_from_messages(messages)
 
         # Format the prompt with the retrieved data and the question
         prompt = self.prompt_template.format(paragraphs=combined_paragraphs_webpages, messages=conversation)
         print(f"Prompt: \n{prompt}")
+        if self.prompt_builder:
+            token_counts['prompt'] = self.prompt_builder.count(prompt)
+            print(f"Prompt tokens: {token_counts}")
+            if metrics is not None:
+                metrics['prompt_tokens'] = token_counts
+        return prompt
+
+    def get_raw_response(self, messages: list[dict], llm: AzureOpenAIChatWrapper, top_k: int, query: str | None = None,
+                         search_results: list[dict] | None = None):
+        assert messages and messages[-1]['role'] == 'user'
+        if search_results is None:
+            search_results = self.retrieve(query or messages[-1]['content'], top_k)
+        prompt = self.build_prompt(messages, search_results)
 
         # Get the JSON response from the conversation chain
-        json_response = llm.invoke([HumanMessage(content=prompt)])
+        json_response = self.invoke_llm(llm, [HumanMessage(content=prompt)])
         print(f"JSON Response: \n{json_response.content}")
         return json_response
 
-    def answer_question(self, messages: list[dict], llm: AzureOpenAIChatWrapper, top_k: int, query: str | None = None):
-        json_response = self.get_raw_response(messages, llm, top_k, query)
+    async def aget_raw_response(self, messages: list[dict], llm: AzureOpenAIChatWrapper, top_k: int,
+                                query: str | None = None, search_results: list[dict] | None = None):
+        """get_raw_response without blocking the event loop, the search runs in the default thread pool."""
+        assert messages and messages[-1]['role'] == 'user'
+        if search_results is None:
+            search_results = await asyncio.to_thread(self.retrieve, query or messages[-1]['content'], top_k)
+        prompt = self.build_prompt(messages, search_results)
 
-        assistant_response = format_answer_from_json(json_response.content)
+        json_response = await self.ainvoke_llm(llm, [HumanMessage(content=prompt)])
+        print(f"JSON Response: \n{json_response.content}")
+        return json_response
 
+    def stream_raw_response(self, messages: list[dict], llm: AzureOpenAIChatWrapper, top_k: int,
+                            parser: StreamingJsonField, query: str | None = None,
+                            search_results: list[dict] | None = None, started: float | None = None,
+                            metrics: dict | None = None):
+        """
+        Streams the response through `parser`, yielding the text of its field as it is generated. metrics gets the
+        time to first token and the total time, counted from `started` (now by default).
+        """
+        assert messages and messages[-1]['role'] == 'user'
+        started = started or time.perf_counter()
+        if search_results is None:
+            search_results = self.retrieve(query or messages[-1]['content'], top_k)
+        prompt = self.build_prompt(messages, search_results, metrics)
+
+        for chunk in self.stream_llm(llm, [HumanMessage(content=prompt)]):
+            text = parser.feed(chunk.content)
+            if text:
+                if metrics is not None and 'time_to_first_token' not in metrics:
+                    metrics['time_to_first_token'] = time.perf_counter() - started
+                yield text
+        if metrics is not None:
+            metrics['total_seconds'] = time.perf_counter() - started
+            # Without a streamed field the response is only shown once complete.
+            metrics.setdefault('time_to_first_token', metrics['total_seconds'])
+        print(f"JSON Response: \n{parser.raw}")
+
+    def cache_namespace(self, messages: list[dict], llm: AzureOpenAIChatWrapper, top_k: int) -> str:
+        """Everything besides the question an answer depends on."""
+        return SemanticAnswerCache.namespace(self.index.identity, self.prompt_template, _model_name(llm), top_k,
+                                             self.collapse, self.reranker is not None, messages[:-1])
+
+    def lookup_cache(self, namespace: str | None, question: str, use_cache: bool = True):
+        """Returns the cached answer, if any, and the question embedding to cache a new answer under."""
+        if not self.answer_cache:
+            return None, None
+        if not use_cache:
+            self.answer_cache.bypass()
+            return None, None
+        question_embedding = self.index.retrieve_question_embedding(question)
+        return self.answer_cache.lookup(namespace, question_embedding), question_embedding
+
+    def _format_answer(self, content: str, namespace: str | None, question_embedding) -> str:
+        assistant_response = format_answer_from_json(content)
+
+        # Don't keep the support fallback of a malformed response.
+        if question_embedding is not None and parse_json_safely(content) is not None:
+            self.answer_cache.put(namespace, question_embedding, assistant_response)
         return assistant_response
 
+    def answer_question(self, messages: list[dict], llm: AzureOpenAIChatWrapper, top_k: int, query: str | None = None,
+                        use_cache: bool = True):
+        namespace = self.cache_namespace(messages, llm, top_k) if self.answer_cache else None
+        cached_response, question_embedding = self.lookup_cache(namespace, query or messages[-1]['content'],
+                                                                use_cache)
+        if cached_response is not None:
+            return cached_response
+
+        json_response = self.get_raw_response(messages, llm, top_k, query)
+        return self._format_answer(json_response.content, namespace, question_embedding)
+
+    async def aanswer_question(self, messages: list[dict], llm: AzureOpenAIChatWrapper, top_k: int,
+                               query: str | None = None, use_cache: bool = True):
+        namespace = self.cache_namespace(messages, llm, top_k) if self.answer_cache else None
+        cached_response, question_embedding = await asyncio.to_thread(
+            self.lookup_cache, namespace, query or messages[-1]['content'], use_cache)
+        if cached_response is not None:
+            return cached_response
+
+        json_response = await self.aget_raw_response(messages, llm, top_k, query)
+        return self._format_answer(json_response.content, namespace, question_embedding)
+
+    def stream_answer(self, messages: list[dict], llm: AzureOpenAIChatWrapper, top_k: int, query: str | None = None,
+                      use_cache: bool = True, metrics: dict | None = None):
+        """answer_question yielding the answer as it is generated and the sources once the response is complete."""
+        started = time.perf_counter()
+        namespace = self.cache_namespace(messages, llm, top_k) if self.answer_cache else None
+        cached_response, question_embedding = self.lookup_cache(namespace, query or messages[-1]['content'],
+                                                                use_cache)
+        if cached_response is not None:
+            yield cached_response
+            return
+
+        parser = StreamingJsonField()
+        yield from self.stream_raw_response(messages, llm, top_k, parser, query, started=started, metrics=metrics)
+        remaining = _remaining_response(parser.value, self._format_answer(parser.raw, namespace, question_embedding))
+        if remaining:
+            yield remaining
+
 
 class DialogueSystemGraph:
     def __init__(
@@ -99,8 +324,24 @@ class DialogueSystemGraph:
             no_intent_answer_file,
             live_agent_answer_file,
             no_response_answer_file,
+            collapse: str | None = None,
+            reranker: CrossEncoderReranker = None,
+            answer_cache: SemanticAnswerCache = None,
+            speculative_retrieval: bool = False,
+            speculation_threshold: float = 0.9,
+            prompt_builder: PromptBuilder = None,
+            llm_client: LLMClient = None,
     ):
-        self.answerer = Answerer(index, prompt_file_answerer)
+        self.answerer = Answerer(index, prompt_file_answerer, collapse, reranker, answer_cache, prompt_builder,
+                                 llm_client)
+        # Retrieves for the raw user message while the intent call runs, and keeps the results when the rewritten
+        # query embeds at least speculation_threshold cosine-similar to the message.
+        self.speculative_retrieval = speculative_retrieval
+        self.speculation_threshold = speculation_threshold
+        self.speculation_hits = 0
+        self.speculation_misses = 0
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="speculative-retrieval") \
+            if speculative_retrieval else None
         with open(prompt_file_intent, 'r') as file:
             self.intent_prompt = file.read()
 
@@ -113,54 +354,128 @@ class DialogueSystemGraph:
         with open(no_response_answer_file, 'r') as file:
             self.no_response_answer = file.read()
 
-    def answer_question(self, messages: list[dict], llm: AzureOpenAIChatWrapper, top_k: int, user_context: dict):
-        assert messages and messages[-1]['role'] == 'user'
+    def _cache_namespace(self, messages: list[dict], llm: AzureOpenAIChatWrapper, top_k: int) -> str | None:
+        if not self.answerer.answer_cache:
+            return None
+        return SemanticAnswerCache.namespace(self.intent_prompt, self.answerer.cache_namespace(messages, llm, top_k))
 
-        conversation = conversation_from_messages(messages)
+    def _build_intent_prompt(self, messages: list[dict]) -> str:
+        prompt_builder = self.answerer.prompt_builder
+        token_counts = {}
+        if prompt_builder:
+            conversation = prompt_builder.history(messages, token_counts)
+        else:
+            conversation = conversation_from_messages(messages)
 
         # Format the prompt with the retrieved data and the question
         prompt = self.intent_prompt.format(messages=conversation)
         print(f"Intent prompt: \n{prompt}")
+        if prompt_builder:
+            token_counts['prompt'] = prompt_builder.count(prompt)
+            print(f"Intent prompt tokens: {token_counts}")
+        return prompt
 
-        json_response = llm.invoke([HumanMessage(content=prompt)])
+    @staticmethod
+    def _parse_intent(json_response) -> dict:
         print(f"Intent Response: \n{json_response.content}")
 
         intent_response = parse_json_safely(json_response.content)
 
         assert intent_response
+        return intent_response
 
-        query = intent_response.get('query', None)
-        clarity = intent_response.get('clarity', 10)
-        missing_details = intent_response.get('missing_details', [])
-        no_search = intent_response.get('no_search', None)
-        user = intent_response.get('user', None)
-        live_agent = intent_response.get('live_agent', None)
-
-        if no_search and not live_agent:
-            # It's not something we can answer
-            return self.no_intent_answer_file, intent_response
+    def _rag_answer(self, content: str) -> str:
+        rag_response = parse_json_safely(content)
 
-        assistant_response = ''
+        response_type = rag_response['case']
 
-        if not no_search:
-            # We need to fetch the RAG response
-            call_llm = self.answerer.get_raw_response(messages, llm, top_k, query)
-            rag_response = parse_json_safely(call_llm.content)
+        if response_type == 'Clear answer':
+            sources = "\n".join([f"- {source}" for source in set(rag_response['source'])])
+            return f"{rag_response['answer']}\n\nFor more information please visit:\n{sources}"
 
-            response_type = rag_response['case']
+        elif response_type == 'Ambiguity':
+            sources = "\n".join([f"- {source}" for source in set(rag_response['source'])])
+            return f"{rag_response['question']}\n\nFor more information please visit:\n{sources}"
 
-            if response_type == 'Clear answer':
-                sources = "\n".join([f"- {source}" for source in set(rag_response['source'])])
-                answer_string = f"{rag_response['answer']}\n\nFor more information please visit:\n{sources}"
-                assistant_response += answer_string
+        return self.no_response_answer
 
-            elif response_type == 'Ambiguity':
-                sources = "\n".join([f"- {source}" for source in set(rag_response['source'])])
-                answer_string = f"{rag_response['question']}\n\nFor more information please visit:\n{sources}"
-                assistant_response += answer_string
+    def _reuse_speculation(self, message: str, query: str | None) -> bool:
+        """Whether results retrieved for the user message can stand in for the results of the rewritten query."""
+        if query and " ".join(query.lower().split()) != " ".join(message.lower().split()):
+            message_embedding, query_embedding = self.answerer.index.retrieve_question_embeddings([message, query])
+            reuse = float(message_embedding @ query_embedding) >= self.speculation_threshold
+        else:
+            reuse = True
+        if reuse:
+            self.speculation_hits += 1
+        else:
+            self.speculation_misses += 1
+            print(f"Speculative retrieval discarded, the query was rewritten to: {query}")
+        return reuse
+
+    def _detect_intent(self, messages: list[dict], llm: AzureOpenAIChatWrapper, top_k: int):
+        """Detects the intent of the conversation, returns it with the speculative search results when reusable."""
+        speculation = None
+        if self.speculative_retrieval:
+            speculation = self._executor.submit(self.answerer.retrieve, messages[-1]['content'], top_k)
+
+        json_response = self.answerer.invoke_llm(llm, [HumanMessage(content=self._build_intent_prompt(messages))])
+        intent_response = self._parse_intent(json_response)
+
+        search_results = None
+        if speculation and not intent_response.get('no_search', None) and \
+                self._reuse_speculation(messages[-1]['content'], intent_response.get('query', None)):
+            search_results = speculation.result()
+        return intent_response, search_results
+
+    def _answer_intent(self, messages: list[dict], llm: AzureOpenAIChatWrapper, top_k: int):
+        """Detects the intent of the conversation and answers it from the index when it needs a search."""
+        intent_response, search_results = self._detect_intent(messages, llm, top_k)
+
+        if intent_response.get('no_search', None):
+            return '', intent_response
+
+        # We need to fetch the RAG response
+        call_llm = self.answerer.get_raw_response(messages, llm, top_k, intent_response.get('query', None),
+                                                  search_results)
+        return self._rag_answer(call_llm.content), intent_response
+
+    async def _aanswer_intent(self, messages: list[dict], llm: AzureOpenAIChatWrapper, top_k: int):
+        speculation = None
+        if self.speculative_retrieval:
+            speculation = asyncio.create_task(asyncio.to_thread(self.answerer.retrieve, messages[-1]['content'], top_k))
+
+        try:
+            json_response = await self.answerer.ainvoke_llm(
+                llm, [HumanMessage(content=self._build_intent_prompt(messages))])
+            intent_response = self._parse_intent(json_response)
+
+            if intent_response.get('no_search', None):
+                return '', intent_response
+
+            query = intent_response.get('query', None)
+            search_results = None
+            if speculation and await asyncio.to_thread(self._reuse_speculation, messages[-1]['content'], query):
+                search_results = await speculation
+        finally:
+            if speculation and not speculation.done():
+                speculation.cancel()
+
+        call_llm = await self.answerer.aget_raw_response(messages, llm, top_k, query, search_results)
+        return self._rag_answer(call_llm.content), intent_response
+
+    def speculation_stats(self) -> dict:
+        attempts = self.speculation_hits + self.speculation_misses
+        return {"hits": self.speculation_hits, "misses": self.speculation_misses,
+                "hit_rate": self.speculation_hits / attempts if attempts else 0.0}
+
+    def _finish(self, assistant_response: str, intent_response: dict, user_context: dict):
+        no_search = intent_response.get('no_search', None)
+        live_agent = intent_response.get('live_agent', None)
 
-            else:
-                assistant_response += self.no_response_answer
+        if no_search and not live_agent:
+            # It's not something we can answer
+            return self.no_intent_answer_file, intent_response
 
         if live_agent:
             # Live agent was requested
@@ -172,6 +487,7 @@ class DialogueSystemGraph:
         else:
             user_context['num_live_agent_calls'] = 0
 
+        # clarity, missing_details = intent_response.get('clarity', 10), intent_response.get('missing_details', [])
         # if clarity < 8 and missing_details:
         #     assistant_response += f"\n\nPlease provide the following info:"
         #     for question in missing_details:
@@ -179,8 +495,87 @@ class DialogueSystemGraph:
 
         return assistant_response, intent_response
 
+    def answer_question(self, messages: list[dict], llm: AzureOpenAIChatWrapper, top_k: int, user_context: dict,
+                        use_cache: bool = True):
+        assert messages and messages[-1]['role'] == 'user'
 
-def load_llm(model: str, max_tokens: int, temperature: float) -> AzureOpenAIChatWrapper:
+        namespace = self._cache_namespace(messages, llm, top_k)
+        cached, question_embedding = self.answerer.lookup_cache(namespace, messages[-1]['content'], use_cache)
+        if cached is not None:
+            # The live agent handling depends on the user context, so only the intent and RAG answer are cached.
+            return self._finish(*cached, user_context)
+
+        assistant_response, intent_response = self._answer_intent(messages, llm, top_k)
+        if question_embedding is not None:
+            self.answerer.answer_cache.put(namespace, question_embedding, (assistant_response, intent_response))
+        return self._finish(assistant_response, intent_response, user_context)
+
+    async def aanswer_question(self, messages: list[dict], llm: AzureOpenAIChatWrapper, top_k: int,
+                               user_context: dict, use_cache: bool = True):
+        """
+        answer_question for asyncio servers: the LLM calls are awaited through the wrapper's ainvoke and the
+        embedding and search run in the default thread pool, so one process can serve many conversations at once.
+        """
+        assert messages and messages[-1]['role'] == 'user'
+
+        namespace = self._cache_namespace(messages, llm, top_k)
+        cached, question_embedding = await asyncio.to_thread(
+            self.answerer.lookup_cache, namespace, messages[-1]['content'], use_cache)
+        if cached is not None:
+            return self._finish(*cached, user_context)
+
+        assistant_response, intent_response = await self._aanswer_intent(messages, llm, top_k)
+        if question_embedding is not None:
+            self.answerer.answer_cache.put(namespace, question_embedding, (assistant_response, intent_response))
+        return self._finish(assistant_response, intent_response, user_context)
+
+    def stream_answer_question(self, messages: list[dict], llm: AzureOpenAIChatWrapper, top_k: int,
+                               user_context: dict, use_cache: bool = True, metrics: dict | None = None):
+        """
+        answer_question streaming the RAG answer. Runs the intent call, then returns a generator of the response
+        text for st.write_stream together with the intent.
+        """
+        assert messages and messages[-1]['role'] == 'user'
+        started = time.perf_counter()
+
+        namespace = self._cache_namespace(messages, llm, top_k)
+        cached, question_embedding = self.answerer.lookup_cache(namespace, messages[-1]['content'], use_cache)
+        if cached is not None:
+            assistant_response, intent_response = self._finish(*cached, user_context)
+            return iter([assistant_response]), intent_response
+
+        intent_response, search_results = self._detect_intent(messages, llm, top_k)
+        if intent_response.get('no_search', None):
+            if question_embedding is not None:
+                self.answerer.answer_cache.put(namespace, question_embedding, ('', intent_response))
+            assistant_response, intent_response = self._finish('', intent_response, user_context)
+            return iter([assistant_response]), intent_response
+
+        def stream():
+            # The question of an ambiguous case is shown like an answer.
+            parser = StreamingJsonField(("answer", "question"))
+            yield from self.answerer.stream_raw_response(messages, llm, top_k, parser,
+                                                         intent_response.get('query', None), search_results,
+                                                         started, metrics)
+            rag_answer = self._rag_answer(parser.raw)
+            if question_embedding is not None:
+                self.answerer.answer_cache.put(namespace, question_embedding, (rag_answer, intent_response))
+            remaining = _remaining_response(parser.value, self._finish(rag_answer, intent_response, user_context)[0])
+            if remaining:
+                yield remaining
+
+        return stream(), intent_response
+
+
+def load_llm(model: str, max_tokens: int, temperature: float = 0.0, cache: bool | None = None) \
+        -> AzureOpenAIChatWrapper:
+    """Responses are cached on disk when `cache` is set, by default for deterministic (temperature 0) models."""
     llm = EbayLLMChatWrapper(model_name=model, max_tokens=max_tokens, temperature=temperature)
 
+    if cache is None:
+        cache = temperature == 0
+    if cache:
+        # Both the intent and the answer prompts ask for a JSON object, anything else is not replayed.
+        llm = CachedChatModel(llm, LLMResponseCache(LLM_CACHE_PATH),
+                              validate=lambda content: parse_json_safely(content) is not None)
     return llm
@@ -0,0 +1,251 @@
+import os
+import json
+import array
+import shutil
+import hashlib
+import datetime
+import faiss
+import numpy as np
+
+from src.bm25 import BM25Index, BM25IndexWriter
+from src.chunk_filter import ChunkFilters, write_chunk_attributes
+from src.chunk_store import ChunkStore, ChunkStoreWriter, DEFAULT_BLOCK_SIZE
+
+# On-disk layout of an index directory:
+#   CURRENT               name of the published version directory
+#   v000001/              one directory per index version
+#       manifest.json     format version, embedder model, index config, dimension, chunk size, counts and checksums
+#       index.faiss       FAISS index (flat, HNSW or IVF), ids are chunk positions
+#       docs.json         document table, one {"url", "title", "source", "locale", "hash"} row per document
+#       chunk_to_doc.npy  int32 document id of every chunk
+#       chunks.bin        utf-8 chunk text, concatenated, optionally zlib-compressed in blocks
+#       chunk_offsets.npy int64 offsets of every chunk in the uncompressed text, plus the end offset
+#       chunk_blocks.npy  int64 offsets of the compressed blocks in chunks.bin, only when compressed
+#       chunk_spans.npy   int64 (start, end) character span of every chunk in its document
+#       bm25_*            BM25 inverted index over the chunks: vocabulary, CSR postings and their impacts
+#       attr_<name>.npy   code of a filter attribute (source, locale) of every chunk, and attr_<name>_bitmaps.npy
+#                         the bitmap of the chunks of every attribute value, values are listed in the manifest
+FORMAT_VERSION = 1
+
+_CURRENT_FILE = "CURRENT"
+_MANIFEST_FILE = "manifest.json"
+_INDEX_FILE = "index.faiss"
+_DOCS_FILE = "docs.json"
+_CHUNK_TO_DOC_FILE = "chunk_to_doc.npy"
+_CHUNK_SPANS_FILE = "chunk_spans.npy"
+
+# Versions kept on disk, older ones may still be mapped by running processes.
+_KEEP_VERSIONS = 2
+
+# Zero-copy mmap of the vectors, graphs and inverted lists of every index type, so processes on a host share one
+# copy of the index through the page cache. FAISS builds before IO_FLAG_MMAP_IFC (the 1.7.4 of the Krylov image)
+# only map IVF inverted lists and read flat and HNSW storage into each process.
+_MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+
+def current_version_dir(index_path: str) -> str | None:
+    current_file = os.path.join(index_path, _CURRENT_FILE)
+    if not os.path.isfile(current_file):
+        return None
+    with open(current_file, 'r') as f:
+        return os.path.join(index_path, f.read().strip())
+
+
+def index_exists(index_path: str) -> bool:
+    """True for a published index directory, or a legacy pickled index file."""
+    return os.path.isfile(index_path) or current_version_dir(index_path) is not None
+
+
+def next_version(index_path: str) -> int:
+    version_dir = current_version_dir(index_path)
+    if version_dir is None:
+        return 1
+    return IndexVersion.read_manifest(version_dir)["version"] + 1
+
+
+def aggregate_by_document(chunk_to_doc: np.array, chunk_ids: np.array, scores: np.array):
+    """
+    Collapses chunk hits onto their documents. Returns the document ids ordered by their best hit, with the best
+    score, the summed score and the number of hits of each document.
+    """
+    chunk_ids, scores = np.asarray(chunk_ids), np.asarray(scores)
+    found = chunk_ids >= 0
+    doc_ids = np.asarray(chunk_to_doc)[chunk_ids[found]]
+    scores = scores[found]
+
+    unique_doc_ids, inverse, hits = np.unique(doc_ids, return_inverse=True, return_counts=True)
+    best = np.full(len(unique_doc_ids), -np.inf, dtype=np.float32)
+    np.maximum.at(best, inverse, scores)
+    total = np.bincount(inverse, weights=scores, minlength=len(unique_doc_ids)).astype(np.float32)
+
+    order = np.argsort(-best, kind="stable")
+    return unique_doc_ids[order], best[order], total[order], hits[order]
+
+
+def _file_checksum(path: str) -> str:
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+class IndexVersionWriter:
+    """Writes a new version of an index chunk by chunk, then publishes it by atomically swapping CURRENT."""
+
+    def __init__(self, index_path: str, version: int, chunk_compression: str | None = None,
+                 chunk_block_size: int = DEFAULT_BLOCK_SIZE):
+        self.index_path = index_path
+        self.version = version
+        self.version_name = f"v{version:06d}"
+        self.version_dir = os.path.join(index_path, self.version_name)
+        # Leftovers of a crashed writer are never published, it is safe to start over.
+        shutil.rmtree(self.version_dir, ignore_errors=True)
+        os.makedirs(self.version_dir)
+
+        self.docs = []
+        self._doc_ids = {}
+        self._chunk_to_doc = array.array('i')
+        self._chunk_spans = array.array('q')
+        self._chunks = ChunkStoreWriter(self.version_dir, chunk_compression, chunk_block_size)
+        self._bm25 = BM25IndexWriter(self.version_dir)
+
+    @property
+    def num_chunks(self) -> int:
+        return len(self._chunk_to_doc)
+
+    def _doc_id(self, url: str) -> int:
+        doc_id = self._doc_ids.get(url)
+        if doc_id is None:
+            doc_id = self._doc_ids[url] = len(self.docs)
+            self.docs.append({"url": url})
+        return doc_id
+
+    def add_chunk(self, url: str, chunk: str, span: tuple):
+        self._chunks.add(chunk)
+        self._bm25.add(chunk)
+        self._chunk_spans.extend(span)
+        self._chunk_to_doc.append(self._doc_id(url))
+
+    def finish(self, index, embedder_model: str, chunk_size: int, documents: dict,
+               index_config: dict | None = None) -> str:
+        """
+        Writes the index, tables and manifest, publishes the version and returns its directory. documents maps
+        every source URL to its {"hash", "title", "source", "locale"}.
+        """
+        chunk_files = self._chunks.close() + self._bm25.close()
+        assert index.ntotal == self.num_chunks, f"Index has {index.ntotal} vectors for {self.num_chunks} chunks"
+
+        # Documents without any chunk still need their hash for incremental updates.
+        for url in documents:
+            self._doc_id(url)
+        for doc in self.docs:
+            doc.update({"title": "", "source": "", "locale": "", "hash": None, **documents.get(doc["url"], {})})
+
+        faiss.write_index(index, os.path.join(self.version_dir, _INDEX_FILE))
+        with open(os.path.join(self.version_dir, _DOCS_FILE), 'w', encoding='utf-8') as f:
+            json.dump(self.docs, f, ensure_ascii=False)
+        chunk_to_doc = np.frombuffer(self._chunk_to_doc, dtype=np.int32)
+        np.save(os.path.join(self.version_dir, _CHUNK_TO_DOC_FILE), chunk_to_doc)
+        attribute_files, attributes = write_chunk_attributes(self.version_dir, self.docs, chunk_to_doc)
+        np.save(os.path.join(self.version_dir, _CHUNK_SPANS_FILE),
+                np.frombuffer(self._chunk_spans, dtype=np.int64).reshape(-1, 2))
+
+        data_files = [_INDEX_FILE, _DOCS_FILE, _CHUNK_TO_DOC_FILE, _CHUNK_SPANS_FILE] + chunk_files + attribute_files
+        manifest = {
+            "format_version": FORMAT_VERSION,
+            "version": self.version,
+            "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            "embedder_model": embedder_model,
+            "index": index_config or {"type": "flat"},
+            "dimension": index.d,
+            "chunk_size": chunk_size,
+            "chunk_compression": self._chunks.compression,
+            "chunk_block_size": self._chunks.block_size,
+            "bm25": {"k1": self._bm25.k1, "b": self._bm25.b},
+            "attributes": attributes,
+            "num_chunks": self.num_chunks,
+            "num_docs": len(self.docs),
+            "checksums": {name: _file_checksum(os.path.join(self.version_dir, name)) for name in data_files},
+        }
+        with open(os.path.join(self.version_dir, _MANIFEST_FILE), 'w') as f:
+            json.dump(manifest, f, indent=4)
+
+        self._publish()
+        return self.version_dir
+
+    def _publish(self):
+        tmp_path = os.path.join(self.index_path, f"{_CURRENT_FILE}.tmp")
+        with open(tmp_path, 'w') as f:
+            f.write(self.version_name)
+        os.replace(tmp_path, os.path.join(self.index_path, _CURRENT_FILE))
+        print(f"Published index version {self.version} at {self.version_dir}")
+
+        versions = sorted(name for name in os.listdir(self.index_path)
+                          if name.startswith("v") and name != self.version_name
+                          and os.path.isdir(os.path.join(self.index_path, name)))
+        for name in versions[:max(0, len(versions) - (_KEEP_VERSIONS - 1))]:
+            shutil.rmtree(os.path.join(self.index_path, name), ignore_errors=True)
+
+
+class IndexVersion:
+    """Read-only view of the published version of an index directory, backed by memory maps."""
+
+    def __init__(self, index_path: str, verify: bool = False, chunk_cache_size: int = 1024):
+        self.version_dir = current_version_dir(index_path)
+        if self.version_dir is None:
+            raise FileNotFoundError(f"No published index version at {index_path}")
+        self.manifest = self.read_manifest(self.version_dir)
+        if self.manifest["format_version"] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported index format version {self.manifest['format_version']} "
+                             f"at {self.version_dir}")
+        if verify:
+            self.verify()
+
+        with open(self._path(_DOCS_FILE), 'r', encoding='utf-8') as f:
+            self.docs = json.load(f)
+        self.chunk_to_doc = np.load(self._path(_CHUNK_TO_DOC_FILE), mmap_mode='r')
+        self.chunk_spans = np.load(self._path(_CHUNK_SPANS_FILE), mmap_mode='r')
+        self.chunks = ChunkStore(self.version_dir, self.manifest.get("chunk_compression"),
+                                 self.manifest.get("chunk_block_size", DEFAULT_BLOCK_SIZE), chunk_cache_size)
+        # Versions written before the lexical index have no BM25 files.
+        self.bm25 = BM25Index(self.version_dir, self.num_chunks) if "bm25" in self.manifest else None
+        self.filters = ChunkFilters(self.docs, self.chunk_to_doc, self.version_dir, self.manifest.get("attributes"))
+
+    @staticmethod
+    def read_manifest(version_dir: str) -> dict:
+        with open(os.path.join(version_dir, _MANIFEST_FILE), 'r') as f:
+            return json.load(f)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.version_dir, name)
+
+    @property
+    def version(self) -> int:
+        return self.manifest["version"]
+
+    @property
+    def num_chunks(self) -> int:
+        return self.manifest["num_chunks"]
+
+    def verify(self):
+        for name, checksum in self.manifest["checksums"].items():
+            if _file_checksum(self._path(name)) != checksum:
+                raise ValueError(f"Checksum mismatch for {name} in {self.version_dir}")
+
+    def read_index(self, writable: bool = False):
+        """Memory-maps the FAISS index, or reads a private writable copy for updates."""
+        return faiss.read_index(self._path(_INDEX_FILE), 0 if writable else _MMAP_FLAGS)
+
+    def chunk(self, i: int) -> str:
+        return self.chunks[i]
+
+    def url(self, i: int) -> str:
+        return self.docs[self.chunk_to_doc[i]]["url"]
+
+    def doc(self, i: int) -> dict:
+        """Document row of chunk i."""
+        return self.docs[self.chunk_to_doc[i]]
+
+    def doc_hashes(self) -> dict:
+        return {doc["url"]: doc["hash"] for doc in self.docs}
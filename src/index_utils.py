@@ -1,5 +1,12 @@
 import os
-import pickle
+import re
+import hashlib
+import shutil
+import tempfile
+import itertools
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import faiss
 import numpy as np
 from transformers import AutoTokenizer
@@ -7,17 +14,162 @@ import json
 from tqdm import tqdm
 
 from src.embedder import Embedder
+from src.embedding_cache import EmbeddingCache
+from src.index_store import IndexVersion, IndexVersionWriter, index_exists, next_version
 
+# Number of embedding batches gathered before a flush, so length-sorting has enough chunks to group.
+_EMBED_WINDOW_BATCHES = 8
+# Documents tokenized per batch encode.
+_TOKENIZE_BATCH_DOCUMENTS = 64
+# Documents per shard in parallel builds, and shards in flight per worker.
+_SHARD_DOCUMENTS = 64
+_SHARDS_IN_FLIGHT_PER_WORKER = 2
+# Characters read at a time when streaming a JSON array.
+_JSON_READ_SIZE = 1 << 20
+# Rows added to FAISS at a time from the embedding buffer.
+_INDEX_ADD_BLOCK = 65536
 
-def build_faiss_index(embeddings: np.array) -> faiss.IndexFlatIP:
-    """Builds a FAISS index for the provided embeddings."""
+_JSON_ARRAY_SEPARATORS = re.compile(r"[\s,]*")
+# Help guides carry their title in the first content line.
+_HELP_GUIDE_TITLE_PREFIX = "Help webpage title:"
+_MAX_TITLE_CHARS = 200
+
+_worker_embedder = None
+_worker_embedding_cache = None
+
+
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+# Build and default search parameters of each index type, overridden by the "index" entry of EMBEDDER_MODELS.
+_INDEX_DEFAULTS = {
+    "flat": {},
+    "hnsw": {"M": 32, "ef_construction": 200, "ef_search": 64},
+    "ivf_flat": {"nlist": 1024, "nprobe": 16},
+    "ivf_pq": {"nlist": 1024, "pq_m": 16, "pq_nbits": 8, "nprobe": 16},
+}
+# IVF coarse quantizers are trained on a sample of up to this many vectors per list, and need at least the
+# minimum per list for k-means to be meaningful; nlist is lowered for smaller corpora.
+_IVF_TRAIN_POINTS_PER_LIST = 256
+_IVF_MIN_POINTS_PER_LIST = 39
+
+
+def resolve_index_config(index_config: dict | None = None) -> dict:
+    """Fills an index config in with the defaults of its type, flat when no config is given."""
+    index_config = dict(index_config or {"type": "flat"})
+    index_type = index_config.setdefault("type", "flat")
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unsupported index type: {index_type}, expected one of {INDEX_TYPES}")
+    return {**_INDEX_DEFAULTS[index_type], **index_config}
+
+
+def _training_sample(embeddings: np.array, num_points: int) -> np.array:
+    if num_points >= len(embeddings):
+        return np.ascontiguousarray(embeddings)
+    rows = np.sort(np.random.default_rng(0).choice(len(embeddings), num_points, replace=False))
+    return np.ascontiguousarray(embeddings[rows])
+
+
+def _ivf_index(embeddings: np.array, index_config: dict):
+    num_vectors, dimension = embeddings.shape
+    nlist = max(1, min(index_config["nlist"], num_vectors // _IVF_MIN_POINTS_PER_LIST))
+    if nlist != index_config["nlist"]:
+        print(f"Lowering nlist from {index_config['nlist']} to {nlist} for {num_vectors} vectors")
+
+    quantizer = faiss.IndexFlatIP(dimension)
+    if index_config["type"] == "ivf_flat":
+        index = faiss.IndexIVFFlat(quantizer, dimension, nlist, faiss.METRIC_INNER_PRODUCT)
+    else:
+        pq_m, pq_nbits = index_config["pq_m"], index_config["pq_nbits"]
+        if dimension % pq_m:
+            raise ValueError(f"pq_m={pq_m} must divide the embedding dimension {dimension}")
+        # Every PQ centroid needs at least one training vector.
+        pq_nbits = max(1, min(pq_nbits, int(np.log2(max(num_vectors, 2)))))
+        if pq_nbits != index_config["pq_nbits"]:
+            print(f"Lowering pq_nbits from {index_config['pq_nbits']} to {pq_nbits} for {num_vectors} vectors")
+        index = faiss.IndexIVFPQ(quantizer, dimension, nlist, pq_m, pq_nbits, faiss.METRIC_INNER_PRODUCT)
+
+    print(f"Training {index_config['type']} index with {nlist} lists")
+    index.train(_training_sample(embeddings, nlist * _IVF_TRAIN_POINTS_PER_LIST))
+    index.nprobe = min(index_config["nprobe"], nlist)
+    return index
+
+
+def build_faiss_index(embeddings: np.array, index_config: dict | None = None):
+    """
+    Builds a FAISS index of the configured type for the provided embeddings, ids are the chunk positions.
+    Flat indexes are exact and ID-mapped so they can be updated in place; HNSW and IVF indexes are approximate,
+    trained here when needed, and rebuilt on updates.
+    """
+    index_config = resolve_index_config(index_config)
     dimension = embeddings.shape[1]
-    index = faiss.IndexFlatIP(dimension)
-    index.add(embeddings)
+    if index_config["type"] == "flat":
+        index = faiss.IndexIDMap2(faiss.IndexFlatIP(dimension))
+    elif index_config["type"] == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, index_config["M"], faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = index_config["ef_construction"]
+        index.hnsw.efSearch = index_config["ef_search"]
+    else:
+        index = _ivf_index(embeddings, index_config)
+
+    for start in range(0, len(embeddings), _INDEX_ADD_BLOCK):
+        block = np.ascontiguousarray(embeddings[start:start + _INDEX_ADD_BLOCK])
+        if isinstance(index, faiss.IndexIDMap2):
+            index.add_with_ids(block, np.arange(start, start + len(block), dtype=np.int64))
+        else:
+            # Vectors are numbered in insertion order, which keeps ids equal to chunk positions.
+            index.add(block)
     return index
 
 
-def split_into_chunks(text: str, tokenizer: AutoTokenizer, chunk_size=384, overlap=50):
+def search_parameters(index, search_params: dict | None = None, selector=None):
+    """
+    Per-query FAISS search parameters: "ef_search" for HNSW, "nprobe" for IVF, and an IDSelector restricting the
+    search to some ids for any index type. Returns None when nothing is overridden, the index then searches with
+    the parameters it was built with.
+    """
+    if not search_params and selector is None:
+        return None
+    search_params = search_params or {}
+    if isinstance(index, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW()
+        params.efSearch = int(search_params.get("ef_search", index.hnsw.efSearch))
+    elif isinstance(index, faiss.IndexIVF):
+        params = faiss.SearchParametersIVF()
+        params.nprobe = int(search_params.get("nprobe", index.nprobe))
+    elif selector is not None:
+        params = faiss.SearchParameters()
+    else:
+        return None
+    if selector is not None:
+        params.sel = selector
+    return params
+
+
+def split_texts_into_chunks(texts: list[str], tokenizer: AutoTokenizer, chunk_size=384, overlap=50) -> list[list]:
+    """
+    Splits many texts into overlapping token windows with one batch encode. Each chunk is returned as a
+    (chunk_text, start, end) tuple where chunk_text == text[start:end], sliced from the original text through the
+    fast tokenizer's offset mappings instead of detokenising every window.
+    """
+    if not tokenizer.is_fast:
+        # Slow tokenizers have no offset mappings, fall back to decoding each window.
+        return [[(chunk, -1, -1) for chunk in _decode_into_chunks(text, tokenizer, chunk_size, overlap)]
+                for text in texts]
+
+    encodings = tokenizer(texts, add_special_tokens=False, return_offsets_mapping=True,
+                          return_attention_mask=False, return_token_type_ids=False, verbose=False)
+    all_chunks = []
+    for text, offsets in zip(texts, encodings["offset_mapping"]):
+        chunks = []
+        for i in range(0, len(offsets), chunk_size - overlap):
+            window = offsets[i:i + chunk_size]
+            start, end = window[0][0], window[-1][1]
+            chunks.append((text[start:end], start, end))
+        all_chunks.append(chunks)
+
+    return all_chunks
+
+
+def _decode_into_chunks(text: str, tokenizer: AutoTokenizer, chunk_size=384, overlap=50):
     tokens = tokenizer.encode(text, add_special_tokens=False)
     chunks = []
     for i in range(0, len(tokens), chunk_size - overlap):
@@ -28,46 +180,405 @@ def split_into_chunks(text: str, tokenizer: AutoTokenizer, chunk_size=384, overl
     return chunks
 
 
-def build_index(sources_files: list, index_file_path: str, embedder: Embedder, chunk_size: int, dev: bool = False):
-    all_data = []
-    for sources_file in sources_files:
-        print(f'Loading content from {os.getcwd() + "/" + sources_file}')
-        with open(sources_file, 'r', encoding='utf-8') as json_file:
-            json_data = json.load(json_file)
-            all_data.extend(json_data)
+def split_into_chunks(text: str, tokenizer: AutoTokenizer, chunk_size=384, overlap=50):
+    return [chunk for chunk, _, _ in split_texts_into_chunks([text], tokenizer, chunk_size, overlap)[0]]
+
+
+def iter_batches(iterable, batch_size: int):
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, batch_size)):
+        yield batch
+
+
+def _iter_json_array(path: str):
+    """Yields the items of a top-level JSON array one at a time, without loading the whole file."""
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as json_file:
+        buffer, pos, eof, started = "", 0, False, False
+        while True:
+            pos = _JSON_ARRAY_SEPARATORS.match(buffer, pos).end()
+            if pos < len(buffer):
+                if not started:
+                    if buffer[pos] != '[':
+                        raise ValueError(f"Expected a JSON array in {path}")
+                    started, pos = True, pos + 1
+                    continue
+                if buffer[pos] == ']':
+                    return
+                try:
+                    item, end = decoder.raw_decode(buffer, pos)
+                    # A number ending the buffer may go on in the next read.
+                    if end < len(buffer) or eof:
+                        yield item
+                        pos = end
+                        continue
+                except json.JSONDecodeError:
+                    # The item may just be cut off by the end of the buffer.
+                    if eof:
+                        raise
+            elif eof:
+                raise ValueError(f"Unexpected end of JSON array in {path}")
+
+            more = json_file.read(_JSON_READ_SIZE)
+            eof = not more
+            buffer, pos = buffer[pos:] + more, 0
 
+
+def _iter_jsonl(path: str):
+    with open(path, 'r', encoding='utf-8') as jsonl_file:
+        for line in jsonl_file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_documents(sources_files: list, dev: bool = False):
+    """
+    Streams documents from JSON array or JSONL (.jsonl) source files. Documents without a "source" are tagged
+    with the name of their file.
+    """
+    def generate():
+        for sources_file in sources_files:
+            print(f'Loading content from {os.getcwd() + "/" + sources_file}')
+            source = os.path.splitext(os.path.basename(sources_file))[0]
+            documents = _iter_jsonl(sources_file) if sources_file.endswith(".jsonl") else _iter_json_array(sources_file)
+            for document in documents:
+                document.setdefault("source", source)
+                yield document
+
+    documents = generate()
     if dev:
-        all_data = all_data[:10]
-        index_file_path = index_file_path.replace(".pkl", "_dev.pkl")
-    print(f"Building index for {len(all_data)} documents")
+        documents = itertools.islice(documents, 10)
+    return documents
+
+
+def load_documents(sources_files: list, dev: bool = False) -> list:
+    return list(iter_documents(sources_files, dev))
+
+
+def iter_document_chunks(documents, tokenizer: AutoTokenizer, chunk_size: int, progress: bool = True):
+    """Yields (url, chunk, start, end) for every chunk, tokenizing documents in batches."""
+    with tqdm(desc="Processing documents", disable=not progress) as progress_bar:
+        for batch in iter_batches(documents, _TOKENIZE_BATCH_DOCUMENTS):
+            # Split the texts into chunks
+            batch_chunks = split_texts_into_chunks([document.get("content", "") for document in batch], tokenizer,
+                                                   chunk_size)
+            for document, document_chunks in zip(batch, batch_chunks):
+                url = document.get("url", "")
+                for chunk, start, end in document_chunks:
+                    yield url, chunk, start, end
+            progress_bar.update(len(batch))
+
+
+class ChunkBatches:
+    """Keeps embedded chunk batches in memory, used for the bounded per-shard results of parallel builds."""
+
+    def __init__(self):
+        self.batches = []
+
+    def add(self, embeddings: np.array, urls: list, chunks: list, spans: list):
+        self.batches.append((embeddings, urls, chunks, spans))
+
+
+class IndexBuildBuffer:
+    """
+    Spools build output to a work directory as it is produced: embeddings are written into a growable float32
+    memmap and chunk metadata is appended to a JSONL file, so build memory is bounded by the batch size.
+    """
+
+    def __init__(self, work_dir: str, initial_capacity: int = 4096):
+        self.embeddings_path = os.path.join(work_dir, "embeddings.f32")
+        self.metadata_path = os.path.join(work_dir, "chunks.jsonl")
+        self.initial_capacity = initial_capacity
+        self.num_chunks = 0
+        self.dimension = None
+        self._capacity = 0
+        self._embeddings = None
+        self._metadata_file = open(self.metadata_path, 'w', encoding='utf-8')
 
-    embeddings, urls, chunks = [], [], []
-    for document in tqdm(all_data, desc="Processing documents"):
-        content = document.get("content", "")
+    def add(self, embeddings: np.array, urls: list, chunks: list, spans: list):
+        if not urls:
+            return
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if self.dimension is None:
+            self.dimension = embeddings.shape[1]
+        self._reserve(self.num_chunks + len(embeddings))
+        self._embeddings[self.num_chunks:self.num_chunks + len(embeddings)] = embeddings
+
+        for url, chunk, (start, end) in zip(urls, chunks, spans):
+            self._metadata_file.write(json.dumps({"url": url, "chunk": chunk, "start": start, "end": end},
+                                                 ensure_ascii=False) + "\n")
+        self.num_chunks += len(embeddings)
+
+    def _reserve(self, num_rows: int):
+        if num_rows <= self._capacity:
+            return
+        self._capacity = max(num_rows, 2 * self._capacity, self.initial_capacity)
+        if self._embeddings is not None:
+            self._embeddings.flush()
+        with open(self.embeddings_path, 'ab') as f:
+            f.truncate(self._capacity * self.dimension * 4)
+        self._embeddings = np.memmap(self.embeddings_path, dtype=np.float32, mode='r+',
+                                     shape=(self._capacity, self.dimension))
+
+    def embeddings(self) -> np.array:
+        """L2-normalised view of the embeddings written so far."""
+        if self._embeddings is None:
+            return np.empty((0, self.dimension or 0), dtype=np.float32)
+        embeddings = self._embeddings[:self.num_chunks]
+        faiss.normalize_L2(embeddings)
+        return embeddings
+
+    def iter_metadata(self):
+        self._metadata_file.flush()
+        with open(self.metadata_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                yield json.loads(line)
+
+    def read_metadata(self):
+        urls, chunks, spans = [], [], []
+        for record in self.iter_metadata():
+            urls.append(record["url"])
+            chunks.append(record["chunk"])
+            spans.append((record["start"], record["end"]))
+        return urls, chunks, spans
+
+    def close(self):
+        self._metadata_file.close()
+        self._embeddings = None
+
+
+def embed_chunks(chunk_stream, embedder: Embedder, sink, batch_size: int = 32,
+                 embedding_cache: EmbeddingCache = None):
+    """
+    Embeds (url, chunk, start, end) tuples from a stream, a window of batches at a time, and hands every window
+    to sink.add in stream order. Chunks found in the embedding cache are not sent to the model.
+    """
+    window_size = batch_size * _EMBED_WINDOW_BATCHES
+    for window in iter_batches(chunk_stream, window_size):
+        urls = [url for url, _, _, _ in window]
+        chunks = [chunk for _, chunk, _, _ in window]
+        spans = [(start, end) for _, _, start, end in window]
+        if embedding_cache:
+            embeddings = embedding_cache.embed(embedder, chunks, batch_size=batch_size)
+        else:
+            embeddings = embedder.generate_embeddings(chunks, batch_size=batch_size)
+        sink.add(embeddings, urls, chunks, spans)
+
+
+def _init_shard_worker(embedder_model_name: str, vector_prime_tokenizer_path: str, threads_per_worker: int,
+                       embedding_cache_dir: str = None, embedding_cache_max_bytes: int = None):
+    global _worker_embedder, _worker_embedding_cache
+    import torch
+    torch.set_num_threads(threads_per_worker)
+    _worker_embedder = Embedder(embedder_model_name=embedder_model_name,
+                                vector_prime_tokenizer_path=vector_prime_tokenizer_path)
+    if embedding_cache_dir:
+        _worker_embedding_cache = EmbeddingCache(embedding_cache_dir, embedder_model_name,
+                                                 embedding_cache_max_bytes)
+
+
+def _embed_shard(shard: list, chunk_size: int, batch_size: int):
+    batches = ChunkBatches()
+    embed_chunks(iter_document_chunks(shard, _worker_embedder.tokenizer, chunk_size, progress=False),
+                 _worker_embedder, batches, batch_size, _worker_embedding_cache)
+    return batches.batches
+
+
+def embed_documents_parallel(documents, embedder: Embedder, sink, chunk_size: int, batch_size: int, workers: int,
+                             embedding_cache: EmbeddingCache = None):
+    """
+    Chunks and embeds a document stream in a pool of worker processes, each with its own Embedder.
+    Shards are handed to the sink in shard order, so the result is ordered exactly like a serial build, and only
+    a bounded number of shards is in flight at a time.
+    """
+    threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+    print(f"Embedding documents in shards of {_SHARD_DOCUMENTS} with {workers} workers")
+
+    with ProcessPoolExecutor(max_workers=workers,
+                             mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_shard_worker,
+                             initargs=(embedder.embedder_model_name, embedder.vector_prime_tokenizer_path,
+                                       threads_per_worker,
+                                       embedding_cache.root_dir if embedding_cache else None,
+                                       embedding_cache.max_bytes if embedding_cache else None)) as executor:
+        in_flight = deque()
+        with tqdm(desc="Processing documents") as progress_bar:
+            for shard in iter_batches(documents, _SHARD_DOCUMENTS):
+                in_flight.append((len(shard), executor.submit(_embed_shard, shard, chunk_size, batch_size)))
+                while len(in_flight) >= workers * _SHARDS_IN_FLIGHT_PER_WORKER:
+                    _collect_shard(in_flight.popleft(), sink, progress_bar)
+            while in_flight:
+                _collect_shard(in_flight.popleft(), sink, progress_bar)
+
+
+def _collect_shard(shard_future, sink, progress_bar):
+    shard_size, future = shard_future
+    for embeddings, urls, chunks, spans in future.result():
+        sink.add(embeddings, urls, chunks, spans)
+    progress_bar.update(shard_size)
+
+
+def document_title(document: dict) -> str:
+    """The document's title, or the first line of its content, without the help guides' title prefix."""
+    title = document.get("title")
+    if title is None:
+        title = document.get("content", "").lstrip().split("\n", 1)[0]
+        if title.startswith(_HELP_GUIDE_TITLE_PREFIX):
+            title = title[len(_HELP_GUIDE_TITLE_PREFIX):]
+    return title.strip()[:_MAX_TITLE_CHARS]
+
+
+def _hashed(documents, hashers: dict, doc_info: dict):
+    """Passes documents through while hashing their content per URL and recording their title, source and locale."""
+    for document in documents:
         url = document.get("url", "")
+        hasher = hashers.setdefault(url, hashlib.sha256())
+        hasher.update(document.get("content", "").encode("utf-8"))
+        if url not in doc_info:
+            doc_info[url] = {"title": document_title(document), "source": document.get("source", ""),
+                             "locale": document.get("locale", "")}
+        yield document
+
+
+def _document_table(hashers: dict, doc_info: dict) -> dict:
+    return {url: {"hash": hasher.hexdigest(), **doc_info[url]} for url, hasher in hashers.items()}
+
+
+def document_table(documents) -> dict:
+    """
+    Content hash, title, source and locale per URL; documents sharing a URL are hashed together, in order, and the
+    first one gives the title.
+    """
+    hashers, doc_info = {}, {}
+    for _ in _hashed(documents, hashers, doc_info):
+        pass
+    return _document_table(hashers, doc_info)
+
+
+def embed_documents(documents, embedder: Embedder, buffer: IndexBuildBuffer, chunk_size: int, batch_size: int = 32,
+                    workers: int = 1, embedding_cache: EmbeddingCache = None) -> np.array:
+    """
+    Chunks and embeds a document stream into the build buffer, returns the L2-normalised float32 embeddings.
+    Urls, chunks and the (start, end) character span of each chunk in its document are spooled by the buffer.
+    """
+    if workers > 1:
+        embed_documents_parallel(documents, embedder, buffer, chunk_size, batch_size, workers, embedding_cache)
+    else:
+        # Chunks are streamed into the embedder and embedded in batches instead of one at a time.
+        embed_chunks(iter_document_chunks(documents, embedder.tokenizer, chunk_size), embedder, buffer, batch_size,
+                     embedding_cache)
+
+    print(f"Generated embeddings for {buffer.num_chunks} chunks")
+    return buffer.embeddings()
+
+
+def _work_dir(index_path: str) -> str:
+    # Spool inside the index directory, build boxes have far more disk there than in /tmp.
+    os.makedirs(index_path, exist_ok=True)
+    return tempfile.mkdtemp(prefix=".build-", dir=index_path)
+
+
+def dev_index_path(index_path: str) -> str:
+    return f"{index_path.rstrip(os.sep)}_dev"
+
+
+def build_index(sources_files: list, index_file_path: str, embedder: Embedder, chunk_size: int, dev: bool = False,
+                batch_size: int = 32, workers: int = 1, embedding_cache: EmbeddingCache = None,
+                chunk_compression: str | None = None, index_config: dict | None = None) -> str:
+    """Builds a new version of the index directory at index_file_path, returns the path it was written to."""
+    if dev:
+        index_file_path = dev_index_path(index_file_path)
+    print(f"Building index from {sources_files}")
+
+    hashers, doc_info = {}, {}
+    work_dir = _work_dir(index_file_path)
+    try:
+        buffer = IndexBuildBuffer(work_dir)
+        embeddings = embed_documents(_hashed(iter_documents(sources_files, dev), hashers, doc_info), embedder,
+                                     buffer, chunk_size, batch_size, workers, embedding_cache)
+
+        # Build FAISS index
+        index_config = resolve_index_config(index_config)
+        index = build_faiss_index(embeddings, index_config)
+
+        # Chunk text and metadata are streamed from the build spool into the index files.
+        writer = IndexVersionWriter(index_file_path, next_version(index_file_path), chunk_compression)
+        for record in buffer.iter_metadata():
+            writer.add_chunk(record["url"], record["chunk"], (record["start"], record["end"]))
+        buffer.close()
+        print(f"Index build completed for {len(hashers)} documents")
+        writer.finish(index, embedder.embedder_model_name, chunk_size, _document_table(hashers, doc_info),
+                      index_config)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return index_file_path
+
+
+def update_index(sources_files: list, index_file_path: str, embedder: Embedder, chunk_size: int, dev: bool = False,
+                 batch_size: int = 32, workers: int = 1, embedding_cache: EmbeddingCache = None,
+                 chunk_compression: str | None = None, index_config: dict | None = None) -> str:
+    """
+    Incrementally updates an existing index: only new or changed URLs are re-chunked and re-embedded, and the
+    vectors of changed or removed URLs are dropped from the ID-mapped index. The result is written as the next
+    index version. Falls back to a full build when the existing index can't be updated in place.
+    """
+    index_config = resolve_index_config(index_config)
+    existing_index_path = dev_index_path(index_file_path) if dev else index_file_path
+    if os.path.isfile(existing_index_path) or not index_exists(existing_index_path):
+        # Legacy pickled indexes have no content hashes.
+        return build_index(sources_files, index_file_path, embedder, chunk_size, dev, batch_size, workers,
+                           embedding_cache, chunk_compression, index_config)
+
+    current = IndexVersion(existing_index_path)
+    index = current.read_index(writable=True)
+    if (not isinstance(index, faiss.IndexIDMap2) or current.manifest["embedder_model"] != embedder.embedder_model_name
+            or current.manifest["chunk_size"] != chunk_size
+            or resolve_index_config(current.manifest.get("index")) != index_config):
+        print(f"Index at {existing_index_path} does not support incremental updates with these settings, rebuilding")
+        return build_index(sources_files, index_file_path, embedder, chunk_size, dev, batch_size, workers,
+                           embedding_cache, chunk_compression, index_config)
 
-        # Split the text into chunks
-        text_chunks = split_into_chunks(content, embedder.tokenizer, chunk_size)
+    # First pass over the sources only hashes them, the second one streams the changed documents.
+    old_hashes = current.doc_hashes()
+    new_documents = document_table(iter_documents(sources_files, dev))
+    new_hashes = {url: doc["hash"] for url, doc in new_documents.items()}
+    stale_urls = {url for url, doc_hash in old_hashes.items() if new_hashes.get(url) != doc_hash}
+    changed_urls = {url for url, doc_hash in new_hashes.items() if old_hashes.get(url) != doc_hash}
+    if not stale_urls and not changed_urls:
+        print(f"Index at {existing_index_path} is up to date")
+        return existing_index_path
 
-        # Index the chunks.
-        for chunk in text_chunks:
-            urls.append(url)
-            embeddings.append(embedder.generate_embedding(chunk))
-            chunks.append(chunk)
+    print(f"Updating index: {len(changed_urls - stale_urls)} new, {len(changed_urls & stale_urls)} changed, "
+          f"{len(stale_urls - changed_urls)} removed documents")
 
-    print(f"Generated embeddings for {len(embeddings)} chunks")
+    # Drop the vectors of stale urls, then renumber the survivors so ids stay equal to chunk positions.
+    stale_doc_ids = [doc_id for doc_id, doc in enumerate(current.docs) if doc["url"] in stale_urls]
+    index.remove_ids(np.flatnonzero(np.isin(current.chunk_to_doc, stale_doc_ids)).astype(np.int64))
+    kept_ids = faiss.vector_to_array(index.id_map)
+    faiss.copy_array_to_vector(np.arange(len(kept_ids), dtype=np.int64), index.id_map)
+    index.construct_rev_map()
 
-    # Stack embeddings into a single numpy array
-    embeddings = np.vstack(embeddings).astype(np.float32)
-    faiss.normalize_L2(embeddings)
+    writer = IndexVersionWriter(existing_index_path, current.version + 1, chunk_compression)
+    for i in kept_ids:
+        writer.add_chunk(current.url(i), current.chunk(i), tuple(current.chunk_spans[i]))
 
-    # Build FAISS index
-    index = build_faiss_index(embeddings)
+    work_dir = _work_dir(existing_index_path)
+    try:
+        if changed_urls:
+            changed_documents = (document for document in iter_documents(sources_files, dev)
+                                 if document.get("url", "") in changed_urls)
+            buffer = IndexBuildBuffer(work_dir)
+            embeddings = embed_documents(changed_documents, embedder, buffer, chunk_size, batch_size, workers,
+                                         embedding_cache)
+            if buffer.num_chunks:
+                index.add_with_ids(np.ascontiguousarray(embeddings),
+                                   np.arange(len(kept_ids), len(kept_ids) + buffer.num_chunks, dtype=np.int64))
+            for record in buffer.iter_metadata():
+                writer.add_chunk(record["url"], record["chunk"], (record["start"], record["end"]))
+            buffer.close()
+        writer.finish(index, embedder.embedder_model_name, chunk_size, new_documents, index_config)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
 
-    # Save FAISS index and metadata together in a pickle file
-    print(f"Index build completed, saving to {index_file_path}")
-    with open(index_file_path, 'wb') as f:
-        pickle.dump({"index": index,
-                     "urls": urls,
-                     "chunks": chunks,
-                     "embedder_model": embedder.embedder_model_name}, f)
\ No newline at end of file
+    return existing_index_path
@@ -0,0 +1,141 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import sqlite3
+import threading
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+
+def _message_fields(message) -> tuple:
+    if isinstance(message, dict):
+        return message['role'], message['content']
+    return message.type, message.content
+
+
+class LLMResponseCache:
+    """
+    Chat responses stored in SQLite by request key. The database runs in WAL mode, so any number of processes on a
+    host (eval jobs, the demo) read it concurrently while one of them writes.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS responses "
+                               "(key TEXT PRIMARY KEY, model TEXT, content TEXT, created REAL)")
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections can't be shared between threads.
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    @staticmethod
+    def key(model_name: str, temperature, max_tokens, messages: list) -> str:
+        prompt = json.dumps([_message_fields(message) for message in messages], ensure_ascii=False)
+        request = json.dumps([model_name, temperature, max_tokens, hashlib.sha256(prompt.encode('utf-8')).hexdigest()])
+        return hashlib.sha256(request.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        row = self._connection().execute("SELECT content FROM responses WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key: str, model_name: str, content: str):
+        with self._connection() as connection:
+            connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                               (key, model_name, content, time.time()))
+
+    def delete(self, key: str):
+        with self._connection() as connection:
+            connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+
+
+class CachedChatModel:
+    """
+    Chat wrapper answering repeated requests from an LLMResponseCache. Requests are keyed by model name, temperature,
+    max_tokens and the hash of the messages, so reruns of an experiment replay the responses of the first run.
+    Anything besides invoke, ainvoke and stream is delegated to the wrapped model.
+
+    validate(content) -> bool decides which responses are worth replaying: the others are returned but not stored,
+    and stored ones it rejects count as misses, so a malformed generation is asked for again on the next run.
+    """
+
+    def __init__(self, llm, cache: LLMResponseCache, validate=None):
+        self.llm = llm
+        self.cache = cache
+        self.validate = validate
+        self.hits = 0
+        self.misses = 0
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
+
+    def _key(self, messages: list) -> str:
+        return self.cache.key(self.llm.model_name, getattr(self.llm, 'temperature', None),
+                              getattr(self.llm, 'max_tokens', None), messages)
+
+    def _valid(self, content: str) -> bool:
+        return self.validate is None or self.validate(content)
+
+    def _lookup(self, key: str) -> str | None:
+        content = self.cache.get(key)
+        if content is not None and not self._valid(content):
+            content = None
+        if content is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return content
+
+    def cached_response(self, messages: list) -> AIMessage | None:
+        content = self._lookup(self._key(messages))
+        return None if content is None else AIMessage(content=content)
+
+    def store(self, messages: list, content: str):
+        if self._valid(content):
+            self.cache.put(self._key(messages), self.llm.model_name, content)
+
+    def evict(self, messages: list):
+        """Drops the stored response to messages, for callers that find it unusable."""
+        self.cache.delete(self._key(messages))
+
+    def invoke(self, messages: list, **kwargs):
+        response = self.cached_response(messages)
+        if response is None:
+            response = self.llm.invoke(messages, **kwargs)
+            self.store(messages, response.content)
+        return response
+
+    async def ainvoke(self, messages: list, **kwargs):
+        response = await asyncio.to_thread(self.cached_response, messages)
+        if response is None:
+            response = await self.llm.ainvoke(messages, **kwargs)
+            await asyncio.to_thread(self.store, messages, response.content)
+        return response
+
+    def stream(self, messages: list, **kwargs):
+        yield from self.stream_from(self.llm.stream, messages, **kwargs)
+
+    def stream_from(self, stream, messages: list, **kwargs):
+        """Replays a cached response as a single chunk, or streams `stream(messages)` and caches it once complete."""
+        response = self.cached_response(messages)
+        if response is not None:
+            yield AIMessageChunk(content=response.content)
+            return
+        chunks = []
+        for chunk in stream(messages, **kwargs):
+            chunks.append(chunk.content)
+            yield chunk
+        self.store(messages, "".join(chunks))
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0}
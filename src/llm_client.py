@@ -0,0 +1,208 @@
+import time
+import random
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from src.llm_cache import CachedChatModel
+
+_RATE_LIMIT_MARKERS = ("429", "rate limit", "request limit", "too many requests")
+
+
+def _content(message) -> str:
+    return message['content'] if isinstance(message, dict) else message.content
+
+
+def estimate_tokens(messages: list, max_tokens: int | None = None) -> int:
+    """Prompt tokens at ~4 characters per token, plus the completion tokens the request may use."""
+    return sum(len(_content(message)) for message in messages) // 4 + (max_tokens or 0)
+
+
+def is_rate_limited(error: Exception) -> bool:
+    status_code = getattr(error, 'status_code', None) or getattr(getattr(error, 'response', None), 'status_code', None)
+    return status_code == 429 or any(marker in str(error).lower() for marker in _RATE_LIMIT_MARKERS)
+
+
+def token_usage(response) -> tuple[int, int]:
+    """Prompt and completion tokens reported with a chat response, zeros if the wrapper doesn't report them."""
+    usage = getattr(response, 'usage_metadata', None)
+    if usage:
+        return usage.get('input_tokens', 0), usage.get('output_tokens', 0)
+    usage = (getattr(response, 'response_metadata', None) or {}).get('token_usage') or {}
+    return usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0)
+
+
+def _retry_after(error: Exception) -> float | None:
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Allows `per_minute` units a minute, refilled continuously, with bursts of up to a minute's worth."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1):
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                wait = self.paused_until - now
+                if wait <= 0:
+                    if self.tokens >= amount:
+                        self.tokens -= amount
+                        return
+                    wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """Holds every caller back for `seconds`, used when the service reports the quota is exhausted."""
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class LLMClient:
+    """
+    Runs chat model calls on a bounded worker pool within per-model requests and tokens per minute limits.
+    Rate-limited (429) calls are retried with exponential backoff and full jitter, and also pause the other calls
+    to the same model, so a burst of workers does not keep hitting an exhausted quota. Other errors are raised.
+    Calls submitted with a parse function are also asked again, up to parse_retries times, when it raises ValueError
+    (json.JSONDecodeError included) on the response.
+
+    rate_limits maps model names to {"requests_per_minute": ..., "tokens_per_minute": ...}, the "default" entry
+    applying to the models not listed; a missing or None limit is not enforced.
+    """
+
+    def __init__(self, max_workers: int = 8, rate_limits: dict | None = None, max_retries: int = 6,
+                 base_backoff: float = 1.0, max_backoff: float = 60.0, parse_retries: int = 3):
+        self.rate_limits = rate_limits or {}
+        self.max_retries = max_retries
+        self.parse_retries = parse_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.requests = 0
+        self.rate_limited = 0
+        self.parse_failures = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm")
+
+    def _model_buckets(self, model_name: str) -> tuple:
+        with self._lock:
+            buckets = self._buckets.get(model_name)
+            if buckets is None:
+                limits = self.rate_limits.get(model_name, self.rate_limits.get("default", {}))
+                buckets = self._buckets[model_name] = tuple(
+                    TokenBucket(limits[name]) if limits.get(name) else None
+                    for name in ("requests_per_minute", "tokens_per_minute"))
+            return buckets
+
+    def _acquire(self, llm, messages: list) -> tuple:
+        buckets = self._model_buckets(getattr(llm, 'model_name', type(llm).__name__))
+        requests, tokens = buckets
+        if requests:
+            requests.acquire()
+        if tokens:
+            tokens.acquire(estimate_tokens(messages, getattr(llm, 'max_tokens', None)))
+        return buckets
+
+    def _backoff(self, error: Exception, attempt: int, buckets: tuple):
+        with self._lock:
+            self.rate_limited += 1
+        delay = _retry_after(error) or random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** attempt))
+        print(f"Rate limited ({attempt + 1}/{self.max_retries}), retrying in {delay:.2f}s: {error}")
+        for bucket in buckets:
+            if bucket:
+                bucket.pause(delay)
+        time.sleep(delay)
+
+    def invoke(self, llm, messages: list, **kwargs):
+        """llm.invoke(messages) in the calling thread, within the rate limits and retried when rate limited."""
+        if isinstance(llm, CachedChatModel):
+            # Cached responses don't count against the limits.
+            response = llm.cached_response(messages)
+            if response is None:
+                response = self.invoke(llm.llm, messages, **kwargs)
+                llm.store(messages, response.content)
+            return response
+
+        for attempt in range(self.max_retries + 1):
+            buckets = self._acquire(llm, messages)
+            with self._lock:
+                self.requests += 1
+            try:
+                response = llm.invoke(messages, **kwargs)
+            except Exception as e:
+                if not is_rate_limited(e) or attempt == self.max_retries:
+                    raise
+                self._backoff(e, attempt, buckets)
+                continue
+            prompt_tokens, completion_tokens = token_usage(response)
+            with self._lock:
+                self.prompt_tokens += prompt_tokens
+                self.completion_tokens += completion_tokens
+            return response
+
+    def stream(self, llm, messages: list, **kwargs):
+        """llm.stream(messages) within the rate limits, retried when rate limited before the first chunk."""
+        if isinstance(llm, CachedChatModel):
+            yield from llm.stream_from(lambda msgs, **kw: self.stream(llm.llm, msgs, **kw), messages, **kwargs)
+            return
+
+        for attempt in range(self.max_retries + 1):
+            buckets = self._acquire(llm, messages)
+            with self._lock:
+                self.requests += 1
+            started = False
+            try:
+                for chunk in llm.stream(messages, **kwargs):
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                if started or not is_rate_limited(e) or attempt == self.max_retries:
+                    raise
+                self._backoff(e, attempt, buckets)
+
+    def _call(self, llm, messages: list, parse, **kwargs):
+        if not parse:
+            return self.invoke(llm, messages, **kwargs)
+        for attempt in range(self.parse_retries + 1):
+            response = self.invoke(llm, messages, **kwargs)
+            try:
+                return parse(response)
+            except ValueError as e:
+                with self._lock:
+                    self.parse_failures += 1
+                if isinstance(llm, CachedChatModel):
+                    # Ask the model again rather than replaying the same response.
+                    llm.evict(messages)
+                if attempt == self.parse_retries:
+                    raise
+                print(f"Unusable response ({attempt + 1}/{self.parse_retries}), retrying: {e}")
+
+    def submit(self, llm, messages: list, parse=None, **kwargs) -> Future:
+        """
+        Queues llm.invoke(messages) on the worker pool, the future resolving to parse(response) if given. A response
+        parse raises ValueError on is requested again, the last error being set on the future.
+        """
+        return self._executor.submit(self._call, llm, messages, parse, **kwargs)
+
+    def map(self, llm, messages_list: list[list], parse=None, **kwargs) -> list[Future]:
+        return [self.submit(llm, messages, parse, **kwargs) for messages in messages_list]
+
+    def stats(self) -> dict:
+        return {"requests": self.requests, "rate_limited": self.rate_limited, "parse_failures": self.parse_failures,
+                "prompt_tokens": self.prompt_tokens, "completion_tokens": self.completion_tokens}
@@ -0,0 +1,96 @@
+import tiktoken
+
+
+def format_message(message: dict) -> str:
+    return f"{message['role'].upper()}:\n{message['content']}\n\n"
+
+
+def format_paragraph(i: int, chunk: str, url: str) -> str:
+    return f"Paragraph {i + 1}:\n{chunk}\nSource {i + 1}:\n{url}\n"
+
+
+class PromptBuilder:
+    """
+    Fits the conversation and the retrieved paragraphs of a prompt into token budgets. The history keeps the most
+    recent turns that fit, optionally preceded by a short summary of the earlier user questions; paragraphs are
+    kept in rank order and the first one that does not fit is cut to the remaining budget. Tokens are counted with
+    tiktoken, which approximates the tokenizers of the non-OpenAI chat models.
+    """
+
+    def __init__(self, encoding: str = "cl100k_base", history_tokens: int = 1024, paragraph_tokens: int = 3072,
+                 summary_tokens: int = 0, min_paragraph_tokens: int = 64):
+        self.encoding = tiktoken.get_encoding(encoding)
+        self.history_tokens = history_tokens
+        self.paragraph_tokens = paragraph_tokens
+        self.summary_tokens = summary_tokens
+        # A paragraph is cut only if at least this many of its tokens fit.
+        self.min_paragraph_tokens = min_paragraph_tokens
+
+    def count(self, text: str) -> int:
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def _truncate(self, text: str, max_tokens: int) -> str:
+        tokens = self.encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else self.encoding.decode(tokens[:max_tokens])
+
+    def history(self, messages: list[dict], counts: dict | None = None) -> str:
+        """
+        The most recent turns within the history budget, the last one always included. When turns are dropped, the
+        summary takes up to summary_tokens of the budget.
+        """
+        turns, used = self._recent_turns(messages, self.history_tokens)
+        summary = ""
+        if len(turns) < len(messages) and self.summary_tokens:
+            turns, used = self._recent_turns(messages, self.history_tokens - self.summary_tokens)
+            summary = self._summary(messages[:len(messages) - len(turns)])
+        if counts is not None:
+            counts.update(history=used + self.count(summary), dropped_turns=len(messages) - len(turns))
+        return summary + "".join(reversed(turns))
+
+    def _recent_turns(self, messages: list[dict], budget: int):
+        """The formatted turns that fit the budget, latest first, and their token count."""
+        turns, used = [], 0
+        for message in reversed(messages):
+            turn = format_message(message)
+            tokens = self.count(turn)
+            if turns and used + tokens > budget:
+                break
+            turns.append(turn)
+            used += tokens
+        return turns, used
+
+    def _summary(self, messages: list[dict]) -> str:
+        header = "SUMMARY:\nEarlier in the conversation the user asked:\n"
+        questions = [message['content'] for message in messages if message['role'] == 'user']
+        lines, used = [], self.count(header) + 1
+        # The latest questions are the most likely to be referred to.
+        for question in reversed(questions):
+            line = f"- {' '.join(question.split())}\n"
+            tokens = self.count(line)
+            if used + tokens > self.summary_tokens:
+                break
+            lines.append(line)
+            used += tokens
+        if not lines:
+            return ""
+        return f"{header}{''.join(reversed(lines))}\n"
+
+    def paragraphs(self, search_results: list[dict], counts: dict | None = None) -> str:
+        """Formats the search results in rank order within the paragraph budget."""
+        paragraphs, used = [], 0
+        for i, res in enumerate(search_results):
+            paragraph = format_paragraph(i, res['chunk'], res['url'])
+            tokens = self.count(paragraph)
+            if used + tokens > self.paragraph_tokens:
+                remaining = self.paragraph_tokens - used - self.count(format_paragraph(i, "", res['url']))
+                if remaining >= self.min_paragraph_tokens or not paragraphs:
+                    chunk = self._truncate(res['chunk'], max(remaining, 0))
+                    paragraphs.append(format_paragraph(i, chunk, res['url']))
+                    used += self.count(paragraphs[-1])
+                break
+            paragraphs.append(paragraph)
+            used += tokens
+
+        if counts is not None:
+            counts.update(paragraphs=used, dropped_paragraphs=len(search_results) - len(paragraphs))
+        return "\n".join(paragraphs)
@@ -1,7 +1,7 @@
 import os
 import pathlib
 from src.docindex import DocIndex
-from src.pykrylov_jobs.pykrylov_utils.krylov_config import GenericConfig
+from src.pykrylov_jobs.pykrylov_utils.krylov_config import GenericConfig, KrylovConfig
 from src.pykrylov_jobs.pykrylov_utils.krylov_utils import print_time, KryEnv
 
 _DEFAULT_VECTOR_PRIME_PATH = "data/ebay/data/gfuchs/LLMs/vector_prime_tokenizer"
@@ -19,6 +19,11 @@ class IndexBuilderConfig:
         self.chunk_size = int(gc.get_man("chunk_size"))
         self.dev_mode = gc.get_bool("dev_mode")
         self.vector_prime_tokenizer_path = gc.get("vector_prime_tokenizer_path")
+        self.incremental = gc.get_bool("incremental")
+        self.chunk_compression = gc.get("chunk_compression")
+        self.index_config = gc.get("index")
+        # Defaults to one worker per requested krylov cpu.
+        self.workers = int(gc.get("workers") or KrylovConfig(root_gc).cpu_count)
 
 
 def get_embedder_param(embedder_path_or_name: str, output_dir: str) -> dict:
@@ -27,9 +32,9 @@ def get_embedder_param(embedder_path_or_name: str, output_dir: str) -> dict:
         f"Invalid embedder path or name: {embedder_path_or_name}"
     if 'mpnet' in embedder_path_or_name:
         embedder_path_or_name = os.path.join(KryEnv.data_dir(), KryEnv.user_dir(), embedder_path_or_name)
-        index_output_dir = os.path.join(output_dir, 'mpnet_index.pkl')
+        index_output_dir = os.path.join(output_dir, 'mpnet_index')
     elif 'EBAY_INTERNAL_VECTOR_PRIME' in embedder_path_or_name:
-        index_output_dir = os.path.join(output_dir, 'vector_prime_index.pkl')
+        index_output_dir = os.path.join(output_dir, 'vector_prime_index')
 
     return {'embedder_path_or_name': embedder_path_or_name, 'index_output_dir': index_output_dir}
 
@@ -59,7 +64,11 @@ class IndexBuilder:
             index_path=embedder_details['index_output_dir'],
             embedder_model_name=embedder_details['embedder_path_or_name'],
             chunk_size=conf.chunk_size,
-            dev=conf.dev_mode
+            dev=conf.dev_mode,
+            workers=conf.workers,
+            incremental=conf.incremental,
+            chunk_compression=conf.chunk_compression,
+            index_config=conf.index_config
         )
 
         print(f"Script is done, time: {print_time()}")
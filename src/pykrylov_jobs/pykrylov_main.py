@@ -21,6 +21,8 @@ def main():
     parser.add_argument('--config-path', type=str, help='config file', required=True)
     parser.add_argument('--project-name', type=str, help='project name', required=True, default="how-to-agent")
     parser.add_argument('--service-account', type=str, help='service account', required=False)
+    parser.add_argument('--workers', type=int, help='index builder worker processes (default: krylov cpu_count)',
+                        required=False)
 
     args = parser.parse_args()
 
@@ -30,6 +32,9 @@ def main():
         if not config_dict["krylov"].get("service_account"):
             config_dict["krylov"]["service_account"] = args.service_account
 
+    if args.workers:
+        config_dict["index_builder"]["workers"] = args.workers
+
     root_gc = GenericConfig(config_dict)
     gc_ser = json.dumps(root_gc.to_dict())
     kry = Krylovizator(root_gc)
@@ -0,0 +1,100 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+import numpy as np
+from sentence_transformers import CrossEncoder
+
+
+class CrossEncoderReranker:
+    """
+    Reorders retrieved chunks by the score of a local cross-encoder, which reads the query and the chunk together.
+    All the uncached (query, chunk) pairs of a request are scored in one batched forward pass. When the pass does
+    not finish within the time budget the retrieval order is kept: a pass still queued is cancelled, and one
+    already running completes in the background, caching its scores for the next time the query comes. Requests
+    arriving while such an abandoned pass runs keep their retrieval order rather than queue behind it.
+    """
+
+    def __init__(self, model_name: str, candidates: int = 50, time_budget_seconds: float | None = None,
+                 batch_size: int = 64, cache_size: int = 100000, max_length: int = 512):
+        self.model_name = model_name
+        self.candidates = candidates
+        self.time_budget_seconds = time_budget_seconds
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self.model = CrossEncoder(model_name, max_length=max_length)
+
+        self.scores = OrderedDict()  # (query, chunk hash) -> score
+        self.reranked = 0
+        self.timeouts = 0
+        self.skipped = 0
+        self._abandoned = None
+        self._lock = threading.Lock()
+        # A single worker, so a pass that overran its budget delays the next ones instead of competing with them.
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+
+    @staticmethod
+    def _key(query: str, chunk: str) -> tuple:
+        # Chunks run to a few KB, the cache holds a digest of each instead.
+        return query, hashlib.blake2b(chunk.encode('utf-8'), digest_size=16).digest()
+
+    def _lookup(self, query: str, chunks: list[str]) -> list:
+        keys = [self._key(query, chunk) for chunk in chunks]
+        with self._lock:
+            results = []
+            for key in keys:
+                score = self.scores.get(key)
+                if score is not None:
+                    self.scores.move_to_end(key)
+                results.append(score)
+            return results
+
+    def _score(self, query: str, chunks: list[str]) -> np.array:
+        scores = self.model.predict([(query, chunk) for chunk in chunks], batch_size=self.batch_size,
+                                    show_progress_bar=False)
+        keys = [self._key(query, chunk) for chunk in chunks]
+        with self._lock:
+            for key, score in zip(keys, scores):
+                self.scores[key] = float(score)
+            while len(self.scores) > self.cache_size:
+                self.scores.popitem(last=False)
+        return scores
+
+    def rerank(self, query: str, results: list[dict], top_k: int, time_budget_seconds: float | None = None) \
+            -> list[dict]:
+        """
+        Returns the top_k of the search results by cross-encoder score, with the score under "rerank_score", or
+        the first top_k results in their retrieval order if scoring overruns the budget (the reranker's by default).
+        """
+        if time_budget_seconds is None:
+            time_budget_seconds = self.time_budget_seconds
+        results = results[:self.candidates]
+        chunks = [res['chunk'] for res in results]
+        scores = self._lookup(query, chunks)
+
+        missing = list(dict.fromkeys(chunk for chunk, score in zip(chunks, scores) if score is None))
+        if missing:
+            abandoned = self._abandoned
+            if abandoned is not None and not abandoned.done():
+                # The worker is busy with a pass nobody waits for, this one would only time out behind it.
+                self.skipped += 1
+                return results[:top_k]
+            future = self._executor.submit(self._score, query, missing)
+            try:
+                missing_scores = dict(zip(missing, future.result(timeout=time_budget_seconds)))
+            except TimeoutError:
+                if not future.cancel():
+                    self._abandoned = future
+                self.timeouts += 1
+                print(f"Reranking {len(missing)} chunks exceeded {time_budget_seconds}s, keeping the retrieval order")
+                return results[:top_k]
+            scores = [missing_scores[chunk] if score is None else score for chunk, score in zip(chunks, scores)]
+
+        self.reranked += 1
+        order = np.argsort(-np.asarray(scores, dtype=np.float32), kind="stable")[:top_k]
+        return [{**results[i], "rerank_score": float(scores[i])} for i in order]
+
+    def stats(self) -> dict:
+        return {"reranked": self.reranked, "timeouts": self.timeouts, "skipped": self.skipped,
+                "cached_scores": len(self.scores)}
@@ -0,0 +1,47 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from src import answer_cache
+from src.answer_cache import SemanticAnswerCache
+
+QUESTION = np.array([1, 0, 0, 0], dtype=np.float32)
+# Cosine similarity 0.98 with QUESTION, and an unrelated question.
+PARAPHRASE = np.array([0.98, np.sqrt(1 - 0.98 ** 2), 0, 0], dtype=np.float32)
+OTHER_QUESTION = np.array([0, 0, 1, 0], dtype=np.float32)
+
+
+def test_namespaces_isolate_answers():
+    cache = SemanticAnswerCache(threshold=0.95)
+    index_v1 = cache.namespace("index", 1, "prompt", "gpt-4o", [])
+    index_v2 = cache.namespace("index", 2, "prompt", "gpt-4o", [])
+    follow_up = cache.namespace("index", 1, "prompt", "gpt-4o", [{"role": "user", "content": "How do I sell?"}])
+    assert len({index_v1, index_v2, follow_up}) == 3
+    assert cache.namespace("index", 1, "prompt", "gpt-4o", []) == index_v1
+
+    cache.put(index_v1, QUESTION * 3, "answer v1")
+    cache.put(index_v2, QUESTION, "answer v2")
+    assert cache.lookup(index_v1, PARAPHRASE) == "answer v1"
+    assert cache.lookup(index_v2, PARAPHRASE) == "answer v2"
+    assert cache.lookup(follow_up, QUESTION) is None
+    assert cache.lookup(index_v1, OTHER_QUESTION) is None
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 2
+
+
+def test_entries_expire_and_the_least_recently_used_are_evicted(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(answer_cache, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    cache = SemanticAnswerCache(max_entries=2, ttl_seconds=60)
+    namespace = cache.namespace("index", 1)
+    cache.put(namespace, QUESTION, "first")
+    cache.put(namespace, OTHER_QUESTION, "second")
+    assert cache.lookup(namespace, QUESTION) == "first"
+
+    # "second" is now the least recently used.
+    cache.put(cache.namespace("index", 2), QUESTION, "third")
+    assert cache.lookup(namespace, OTHER_QUESTION) is None
+    assert cache.lookup(namespace, QUESTION) == "first"
+
+    now[0] = 61
+    assert cache.lookup(namespace, QUESTION) is None
+    assert namespace not in cache.indexes and cache.stats()["size"] == 1
@@ -0,0 +1,30 @@
+import numpy as np
+
+from src.bm25 import BM25Index, BM25IndexWriter, tokenize
+
+
+def test_bm25_matches_brute_force(tmp_path):
+    chunks = ["How do I get paid for my sales", "Return policy for sales", "", "paid paid PAID fees",
+              "shipping labels and fees"]
+    writer = BM25IndexWriter(str(tmp_path))
+    for chunk in chunks:
+        writer.add(chunk)
+    writer.close()
+    index = BM25Index(str(tmp_path), len(chunks))
+
+    docs = [tokenize(chunk) for chunk in chunks]
+    avg_length = np.mean([len(doc) for doc in docs])
+    query = "paid fees sales unknown"
+    expected = np.zeros(len(chunks))
+    for term in set(tokenize(query)):
+        doc_freq = sum(term in doc for doc in docs)
+        idf = np.log1p((len(docs) - doc_freq + 0.5) / (doc_freq + 0.5))
+        for i, doc in enumerate(docs):
+            freq = doc.count(term)
+            norm = writer.k1 * (1 - writer.b + writer.b * len(doc) / avg_length)
+            expected[i] += idf * freq * (writer.k1 + 1) / (freq + norm)
+    np.testing.assert_allclose(index.scores(query), expected, rtol=1e-5)
+
+    scores, ids = index.search(query, top_k=len(chunks) + 1)
+    assert list(ids[:4]) == list(np.argsort(-expected, kind="stable")[:4]) and ids[-1] == -1
+    assert np.all(index.search("unknown", top_k=2)[1] == -1)
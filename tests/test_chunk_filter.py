@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from src.chunk_filter import ChunkFilters, write_chunk_attributes
+from src.index_utils import build_faiss_index, search_parameters
+
+DOCS = [
+    {"url": "https://www.ebay.com/help/selling/fees", "source": "help_guides_data", "locale": "en_US"},
+    {"url": "https://www.ebay.com/help/buying/returns", "source": "help_guides_data", "locale": "en_GB"},
+    {"url": "https://community.ebay.com/t5/a", "source": "community"},
+    {"url": "https://www.ebay.com/help/selling/labels", "source": "policies", "locale": "en_US"},
+]
+# Enough chunks that the bitmaps span several bytes, with a size that isn't a multiple of 8.
+CHUNK_TO_DOC = np.array([0, 0, 1, 2, 2, 2, 3, 1, 0, 3, 3, 2, 1, 0, 0, 2, 3, 1, 1, 2, 0])
+
+FILTERS = [
+    {"source": "help_guides_data"},
+    {"source": ["community", "policies"]},
+    {"locale": ""},
+    {"source": "help_guides_data", "locale": "en_US"},
+    {"url_prefix": "https://www.ebay.com/help/selling/"},
+    {"url_prefix": ["https://community.ebay.com/", "https://www.ebay.com/help/buying/"], "source": "community"},
+    {"source": "unknown"},
+]
+
+
+def _expected_mask(filters: dict) -> np.array:
+    matching_docs = []
+    for doc in DOCS:
+        matches = True
+        for name, wanted in filters.items():
+            wanted = [wanted] if isinstance(wanted, str) else wanted
+            if name == "url_prefix":
+                matches &= any(doc["url"].startswith(prefix) for prefix in wanted)
+            else:
+                matches &= doc.get(name, "") in wanted
+        matching_docs.append(matches)
+    return np.array(matching_docs)[CHUNK_TO_DOC]
+
+
+@pytest.fixture(params=["precomputed", "document_table"])
+def chunk_filters(request, tmp_path):
+    if request.param == "document_table":
+        return ChunkFilters(DOCS, CHUNK_TO_DOC)
+    _, attributes = write_chunk_attributes(str(tmp_path), DOCS, CHUNK_TO_DOC)
+    return ChunkFilters(DOCS, CHUNK_TO_DOC, str(tmp_path), attributes)
+
+
+@pytest.mark.parametrize("filters", FILTERS)
+def test_chunk_filters_match_the_document_table(chunk_filters, filters):
+    chunk_filter = chunk_filters.resolve(filters)
+    expected = _expected_mask(filters)
+    np.testing.assert_array_equal(chunk_filter.mask, expected)
+    assert chunk_filter.count == expected.sum()
+    assert chunk_filters.resolve(dict(reversed(filters.items()))) is chunk_filter
+
+
+@pytest.mark.parametrize("filters", FILTERS)
+def test_faiss_search_only_returns_selected_chunks(chunk_filters, filters):
+    embeddings = np.random.default_rng(0).standard_normal((len(CHUNK_TO_DOC), 8)).astype(np.float32)
+    index = build_faiss_index(embeddings)
+    chunk_filter = chunk_filters.resolve(filters)
+
+    params = search_parameters(index, selector=chunk_filter.selector)
+    _, ids = index.search(embeddings[:3], len(CHUNK_TO_DOC), params=params)
+    for row in ids:
+        assert sorted(row[row >= 0]) == list(np.flatnonzero(chunk_filter.mask))
+
+
+def test_chunk_filters_reject_unknown_attributes(chunk_filters):
+    assert chunk_filters.resolve(None) is None and chunk_filters.resolve({}) is None
+    with pytest.raises(ValueError):
+        chunk_filters.resolve({"category": "selling"})
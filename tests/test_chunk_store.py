@@ -0,0 +1,25 @@
+import pytest
+
+from src.chunk_store import ChunkStore, ChunkStoreWriter
+
+
+@pytest.mark.parametrize("compression,block_size", [(None, 16), ("zlib", 1), ("zlib", 7), ("zlib", 1 << 14)])
+def test_chunk_store_round_trip(tmp_path, compression, block_size):
+    chunks = ["first chunk", "", "café – 日本語 😀", "x" * 100, "", "last"]
+    writer = ChunkStoreWriter(str(tmp_path), compression, block_size)
+    for chunk in chunks:
+        writer.add(chunk)
+    writer.close()
+
+    store = ChunkStore(str(tmp_path), compression, block_size, cache_size=2, block_cache_size=2)
+    assert len(store) == len(chunks)
+    assert [store[i] for i in reversed(range(len(chunks)))] == chunks[::-1]
+    assert store.get_many([5, 0, 2]) == [chunks[5], chunks[0], chunks[2]]
+    assert store[-1] == chunks[-1]
+    with pytest.raises(IndexError):
+        store[len(chunks)]
+
+
+def test_chunk_store_empty(tmp_path):
+    ChunkStoreWriter(str(tmp_path)).close()
+    assert len(ChunkStore(str(tmp_path))) == 0
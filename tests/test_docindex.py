@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from src.docindex import DocIndex
+from src.index_utils import build_faiss_index
+
+# Similarity of every chunk of each document to the query, doc0 fills the first fetch on its own.
+DOC_SCORES = [[0.99, 0.98, 0.97, 0.96, 0.95, 0.94, 0.93, 0.92, 0.91, 0.90], [0.85], [0.80], [0.3, 0.3, 0.3, 0.3],
+              [0.1]]
+QUERIES = np.array([[1, 0, 0, 0], [-1, 0, 0, 0]], dtype=np.float32)
+
+
+def _unit_vector(score: float) -> np.array:
+    # Inner product `score` with the first axis.
+    return np.array([score, np.sqrt(1 - score ** 2), 0, 0], dtype=np.float32)
+
+
+@pytest.fixture
+def doc_index():
+    chunks = [(doc_id, j, score) for doc_id, scores in enumerate(DOC_SCORES) for j, score in enumerate(scores)]
+    # Chunk positions don't follow the documents or the scores.
+    chunks = [chunks[i] for i in np.random.default_rng(0).permutation(len(chunks))]
+
+    index = DocIndex(embedding_cache_dir=None)
+    index.docs = [{"url": f"https://www.ebay.com/help/{doc_id}", "title": f"Doc {doc_id}"}
+                  for doc_id in range(len(DOC_SCORES))]
+    index.chunk_to_doc = np.array([doc_id for doc_id, _, _ in chunks], dtype=np.int32)
+    index.chunks = [f"doc{doc_id} chunk{j}" for doc_id, j, _ in chunks]
+    index.index = build_faiss_index(np.stack([_unit_vector(score) for _, _, score in chunks]))
+
+    search_chunks = index._search_chunks
+    index.fetches = []
+
+    def recording_search_chunks(questions, query_embeddings, top_k, *args):
+        index.fetches.append((len(query_embeddings), top_k))
+        return search_chunks(questions, query_embeddings, top_k, *args)
+
+    index._search_chunks = recording_search_chunks
+    return index
+
+
+def test_collapse_doubles_the_fetch_for_unfinished_queries(doc_index):
+    scores, results = doc_index.search_many_with_embeddings(QUERIES, top_k=3, collapse="max")
+
+    # The second query finds 3 documents in the first 9 chunks, the first one needs all 17.
+    assert doc_index.fetches == [(2, 9), (1, 17)]
+    assert [result["url"][-1] for result in results[0]] == ["0", "1", "2"]
+    assert [result["url"][-1] for result in results[1]] == ["4", "3", "2"]
+    np.testing.assert_allclose(scores[0], [0.99, 0.85, 0.80], rtol=1e-5)
+    assert results[0][0]["chunk"] == "doc0 chunk0" and results[0][0]["num_chunks"] == 10
+    assert results[1][1]["chunk"].startswith("doc3 ") and results[1][1]["num_chunks"] == 4
+
+
+def test_collapse_sum_ranks_documents_by_their_summed_hits(doc_index):
+    scores, results = doc_index.search_many_with_embeddings(QUERIES[:1], top_k=3, collapse="sum")
+
+    assert [result["url"][-1] for result in results[0]] == ["0", "3", "1"]
+    np.testing.assert_allclose(scores[0], [sum(DOC_SCORES[0]), 1.2, 0.85], rtol=1e-5)
+    # The best chunk is still the one shown for a document.
+    assert results[0][0]["chunk"] == "doc0 chunk0"
+
+
+def test_collapse_returns_fewer_documents_than_top_k_when_the_index_runs_out(doc_index):
+    scores, results = doc_index.search_many_with_embeddings(QUERIES[:1], top_k=10, collapse="max")
+
+    assert doc_index.fetches == [(1, 17)]
+    assert len(results[0]) == len(DOC_SCORES)
+    assert scores[0, len(DOC_SCORES):].tolist() == [0] * (10 - len(DOC_SCORES))
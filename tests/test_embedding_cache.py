@@ -0,0 +1,83 @@
+import numpy as np
+
+from src import embedding_cache
+from src.embedding_cache import EmbeddingCache
+
+
+def _vector(i: float) -> np.array:
+    return np.full(4, i, dtype=np.float32)
+
+
+def test_embedding_cache_round_trip_across_instances(tmp_path):
+    writer = EmbeddingCache(str(tmp_path), "model/name")
+    writer.put_many(["a", "b", "a"], np.stack([_vector(1), _vector(2), _vector(3)]))
+    reader = EmbeddingCache(str(tmp_path), "model/name")
+    a, b, missing = reader.lookup(["a", "b", "c"])
+    np.testing.assert_array_equal(a, _vector(1))
+    np.testing.assert_array_equal(b, _vector(2))
+    assert missing is None
+
+    # The reader picks up entries added by another instance.
+    writer.put_many(["c"], _vector(4)[None])
+    np.testing.assert_array_equal(reader.lookup(["c"])[0], _vector(4))
+
+
+def test_embedding_cache_survives_a_torn_write(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), "model")
+    cache.put_many(["a"], _vector(1)[None])
+    # Crash after the vectors were appended, and in the middle of a key record.
+    with open(cache.vectors_path, "ab") as f:
+        f.write(_vector(9).tobytes() + b"\0\0")
+    with open(cache.keys_path, "a") as f:
+        f.write("1 " + EmbeddingCache.key("lost")[:10])
+
+    EmbeddingCache(str(tmp_path), "model").put_many(["b"], _vector(2)[None])
+    a, b, lost = EmbeddingCache(str(tmp_path), "model").lookup(["a", "b", "lost"])
+    np.testing.assert_array_equal(a, _vector(1))
+    np.testing.assert_array_equal(b, _vector(2))
+    assert lost is None
+
+
+def test_embedding_cache_reads_key_only_logs(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), "model")
+    cache.put_many(["a", "b"], np.stack([_vector(1), _vector(2)]))
+    with open(cache.keys_path, "w") as f:
+        f.write(f"{EmbeddingCache.key('a')}\n{EmbeddingCache.key('b')}\n")
+    a, b = EmbeddingCache(str(tmp_path), "model").lookup(["a", "b"])
+    np.testing.assert_array_equal(a, _vector(1))
+    np.testing.assert_array_equal(b, _vector(2))
+
+
+def test_embedding_cache_remaps_after_compaction_by_another_instance(tmp_path):
+    reader = EmbeddingCache(str(tmp_path), "model")
+    reader.put_many(["a", "b"], np.stack([_vector(1), _vector(2)]))
+
+    # Keeps a single 16 byte row when compacting, then grows back to the reader's row count.
+    writer = EmbeddingCache(str(tmp_path), "model", max_bytes=20)
+    writer.put_many(["c"], _vector(3)[None])
+    writer.max_bytes = 1 << 20
+    writer.put_many(["d"], _vector(4)[None])
+    assert not (tmp_path / "model" / "touches.log").exists()
+
+    a, b, c, d = reader.lookup(["a", "b", "c", "d"])
+    assert a is None and b is None
+    np.testing.assert_array_equal(c, _vector(3))
+    np.testing.assert_array_equal(d, _vector(4))
+
+
+def test_embedding_cache_compaction_keeps_entries_read_by_another_instance(tmp_path, monkeypatch):
+    monkeypatch.setattr(embedding_cache, "_TOUCH_FLUSH_KEYS", 1)
+    # Room for 3 rows of 16 bytes, compaction keeps int(56 * 0.8) // 16 = 2 of them.
+    writer = EmbeddingCache(str(tmp_path), "model", max_bytes=56)
+    writer.put_many(["a", "b", "c"], np.stack([_vector(1), _vector(2), _vector(3)]))
+
+    # Only the reader uses "a", the writer's own order would evict it first.
+    reader = EmbeddingCache(str(tmp_path), "model")
+    np.testing.assert_array_equal(reader.lookup(["a"])[0], _vector(1))
+    writer.put_many(["d"], _vector(4)[None])
+    assert not (tmp_path / "model" / "touches.log").exists()
+
+    a, b, c, d = EmbeddingCache(str(tmp_path), "model").lookup(["a", "b", "c", "d"])
+    assert b is None and c is None
+    np.testing.assert_array_equal(a, _vector(1))
+    np.testing.assert_array_equal(d, _vector(4))
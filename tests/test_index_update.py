@@ -0,0 +1,74 @@
+import hashlib
+import json
+import re
+
+import faiss
+import numpy as np
+
+from src.index_store import IndexVersion
+from src.index_utils import build_index, update_index
+
+CHUNK_SIZE = 64
+
+
+class _WhitespaceTokenizer:
+    is_fast = True
+
+    def __call__(self, texts, **kwargs):
+        return {"offset_mapping": [[match.span() for match in re.finditer(r"\S+", text)] for text in texts]}
+
+
+class _HashEmbedder:
+    """Embeds each text as a vector seeded by its hash, so any chunk's expected vector can be recomputed."""
+    embedder_model_name = "hash"
+    vector_prime_tokenizer_path = None
+    tokenizer = _WhitespaceTokenizer()
+
+    def __init__(self):
+        self.embedded = 0
+
+    def generate_embeddings(self, texts, batch_size=32, **kwargs):
+        self.embedded += len(texts)
+        return np.stack([_embedding(text) for text in texts])
+
+
+def _embedding(text: str) -> np.array:
+    seed = int(hashlib.md5(text.encode("utf-8")).hexdigest()[:8], 16)
+    return np.random.default_rng(seed).standard_normal(16).astype(np.float32)
+
+
+def _document(i: int, words: int = 80) -> dict:
+    return {"url": f"https://www.ebay.com/help/{i}", "content": " ".join(f"doc{i}-word{j}" for j in range(words))}
+
+
+def test_update_index_renumbers_ids_to_chunk_positions(tmp_path):
+    sources = tmp_path / "docs.json"
+    documents = [_document(i) for i in range(6)]
+    sources.write_text(json.dumps(documents))
+    embedder = _HashEmbedder()
+    index_path = build_index([str(sources)], str(tmp_path / "index"), embedder, CHUNK_SIZE)
+
+    # One changed, one removed and one new document.
+    documents[1] = _document(1, words=40)
+    del documents[4]
+    documents.append(_document(6))
+    sources.write_text(json.dumps(documents))
+    embedder.embedded = 0
+    update_index([str(sources)], index_path, embedder, CHUNK_SIZE)
+
+    version = IndexVersion(index_path)
+    index = version.read_index()
+    assert version.version == 2
+    assert index.ntotal == version.num_chunks
+    np.testing.assert_array_equal(faiss.vector_to_array(index.id_map), np.arange(version.num_chunks))
+    assert embedder.embedded == sum(version.url(i) in (documents[1]["url"], documents[-1]["url"])
+                                    for i in range(version.num_chunks))
+
+    # Reconstructing goes through the reverse id map, each id must map back to the vector of its own chunk.
+    for i in range(version.num_chunks):
+        expected = _embedding(version.chunk(i))
+        np.testing.assert_allclose(index.reconstruct(i), expected / np.linalg.norm(expected), atol=1e-6)
+    assert {version.url(i) for i in range(version.num_chunks)} == {document["url"] for document in documents}
+
+    _, ids = index.search(_embedding(version.chunk(version.num_chunks - 1))[None], 1)
+    assert ids[0][0] == version.num_chunks - 1
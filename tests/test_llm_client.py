@@ -0,0 +1,114 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from src import llm_client
+from src.llm_client import LLMClient
+
+MESSAGES = [{"role": "user", "content": "Reply in JSON"}]
+
+
+class RateLimitError(Exception):
+    def __init__(self, retry_after: str | None = None):
+        super().__init__("Error code: 429")
+        self.status_code = 429
+        self.response = SimpleNamespace(status_code=429, headers={"retry-after": retry_after} if retry_after else {})
+
+
+class _ScriptedModel:
+    """Chat model stand-in answering each invoke with the next scripted reply, raising it if it is an error."""
+    model_name = "scripted"
+
+    def __init__(self, *replies, clock=None):
+        self.replies = list(replies)
+        self.calls = 0
+        self.clock = clock
+        self.call_times = []
+
+    def invoke(self, messages, **kwargs):
+        self.calls += 1
+        if self.clock:
+            self.call_times.append(self.clock.now)
+        reply = self.replies.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        return SimpleNamespace(content=reply, usage_metadata={"input_tokens": 10, "output_tokens": 2})
+
+
+class _Clock:
+    """Replaces the time module of llm_client, sleeping only advances the clock."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(llm_client, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def sleeps(clock):
+    return clock.sleeps
+
+
+def test_rate_limited_calls_back_off_and_retry(sleeps):
+    client = LLMClient(max_retries=3, base_backoff=0.5, max_backoff=1.0)
+    llm = _ScriptedModel(RateLimitError(), RateLimitError(), RateLimitError(retry_after="7"), "ok")
+
+    assert client.invoke(llm, MESSAGES).content == "ok"
+    assert llm.calls == 4
+    # Full jitter below base_backoff * 2 ** attempt capped at max_backoff, then the service's retry-after.
+    assert 0 <= sleeps[0] <= 0.5 and 0 <= sleeps[1] <= 1.0 and sleeps[2] == 7
+    assert client.stats() == {"requests": 4, "rate_limited": 3, "parse_failures": 0, "prompt_tokens": 10,
+                              "completion_tokens": 2}
+
+
+def test_rate_limit_pauses_the_other_calls_to_the_model(clock):
+    client = LLMClient(rate_limits={"default": {"requests_per_minute": 600}})
+    client.invoke(_ScriptedModel(RateLimitError(retry_after="30"), "ok"), MESSAGES)
+    requests_bucket, tokens_bucket = client._model_buckets("scripted")
+    assert tokens_bucket is None and requests_bucket.paused_until == 30
+
+    # A call made by another thread during the backoff waits for the pause to end.
+    clock.now = 10
+    llm = _ScriptedModel("ok", clock=clock)
+    client.invoke(llm, MESSAGES)
+    assert llm.call_times == [30]
+
+
+def test_other_errors_and_exhausted_retries_are_raised(sleeps):
+    client = LLMClient(max_retries=2, base_backoff=0.01)
+    llm = _ScriptedModel(RuntimeError("bad request"))
+    with pytest.raises(RuntimeError):
+        client.invoke(llm, MESSAGES)
+    assert llm.calls == 1 and not sleeps
+
+    llm = _ScriptedModel(*[RateLimitError() for _ in range(3)])
+    with pytest.raises(RateLimitError):
+        client.invoke(llm, MESSAGES)
+    assert llm.calls == 3 and len(sleeps) == 2
+
+
+def test_unparseable_responses_are_requested_again(sleeps):
+    client = LLMClient(parse_retries=2)
+    llm = _ScriptedModel("not json", '{"answer": 1', '{"answer": 2}')
+    assert client.submit(llm, MESSAGES, parse=lambda response: json.loads(response.content)).result() == \
+        {"answer": 2}
+    assert llm.calls == 3 and client.parse_failures == 2
+
+    llm = _ScriptedModel("not json", "still not json", "nor this")
+    future = client.submit(llm, MESSAGES, parse=lambda response: json.loads(response.content))
+    assert isinstance(future.exception(), json.JSONDecodeError)
+    assert llm.calls == 3 and client.parse_failures == 5
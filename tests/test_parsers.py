@@ -0,0 +1,40 @@
+import json
+
+import pytest
+
+from src import index_utils
+
+DOCUMENTS = [
+    {"url": "https://www.ebay.com/help/a", "content": "He said \"hi\" [not the end] {nor this}\\"},
+    {"url": "https://www.ebay.com/help/b", "content": "Unicode: café – 日本語 😀,   and \n newlines"},
+    {"url": "https://www.ebay.com/help/c", "nested": [[], [1, 2.5e3, -0.1], {"]": "["}], "n": 12345, "x": None},
+]
+
+
+def _write(tmp_path, text: str) -> str:
+    path = tmp_path / "docs.json"
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+@pytest.mark.parametrize("read_size", [1, 2, 3, 7, 64, 1 << 20])
+@pytest.mark.parametrize("text", [
+    json.dumps(DOCUMENTS),
+    json.dumps(DOCUMENTS, indent=4, ensure_ascii=False) + "\n\n  ",
+    "[]",
+    "  [ ]  \n",
+    "[1, 23, 456, \"7]8\", true, null]",
+])
+def test_iter_json_array_matches_json_load(tmp_path, monkeypatch, read_size, text):
+    monkeypatch.setattr(index_utils, "_JSON_READ_SIZE", read_size)
+    path = _write(tmp_path, text)
+    with open(path, 'r', encoding='utf-8') as f:
+        expected = json.load(f)
+    assert list(index_utils._iter_json_array(path)) == expected
+
+
+@pytest.mark.parametrize("text", ["", "{\"a\": 1}", "[{\"a\": 1}", "[{\"a\": 1},"])
+def test_iter_json_array_rejects_invalid_input(tmp_path, monkeypatch, text):
+    monkeypatch.setattr(index_utils, "_JSON_READ_SIZE", 4)
+    with pytest.raises(ValueError):
+        list(index_utils._iter_json_array(_write(tmp_path, text)))
@@ -0,0 +1,81 @@
+import pytest
+
+from src import prompt_builder
+from src.prompt_builder import PromptBuilder, format_message, format_paragraph
+
+
+class _CharEncoding:
+    """One token per character, so budgets can be checked with len()."""
+
+    def encode(self, text, **kwargs):
+        return [ord(char) for char in text]
+
+    def decode(self, tokens):
+        return "".join(chr(token) for token in tokens)
+
+
+@pytest.fixture(autouse=True)
+def char_encoding(monkeypatch):
+    monkeypatch.setattr(prompt_builder.tiktoken, "get_encoding", lambda name: _CharEncoding())
+
+
+MESSAGES = [
+    {"role": "user", "content": "How do I  return an item?"},
+    {"role": "assistant", "content": "Open your purchase history and select Return this item."},
+    {"role": "user", "content": "What if the seller\ndoesn't answer?"},
+    {"role": "assistant", "content": "Ask eBay to step in after 3 business days."},
+    {"role": "user", "content": "And the refund?"},
+]
+
+
+def test_history_keeps_the_recent_turns_that_fit():
+    last_two = format_message(MESSAGES[-2]) + format_message(MESSAGES[-1])
+    builder = PromptBuilder(history_tokens=len(last_two) + 10)
+    counts = {}
+    assert builder.history(MESSAGES, counts) == last_two
+    assert counts == {"history": len(last_two), "dropped_turns": 3}
+
+
+def test_history_always_keeps_the_last_turn():
+    builder = PromptBuilder(history_tokens=5)
+    assert builder.history(MESSAGES) == format_message(MESSAGES[-1])
+    assert PromptBuilder().history([]) == ""
+
+
+def test_history_summarizes_the_dropped_questions():
+    last = format_message(MESSAGES[-1])
+    summary = ("SUMMARY:\nEarlier in the conversation the user asked:\n"
+               "- How do I return an item?\n- What if the seller doesn't answer?\n\n")
+    builder = PromptBuilder(history_tokens=len(summary) + len(last) + 20, summary_tokens=len(summary))
+    counts = {}
+    assert builder.history(MESSAGES, counts) == summary + last
+    assert counts == {"history": len(summary + last), "dropped_turns": 4}
+
+    # Without room for every question, the latest ones are kept.
+    builder.summary_tokens -= 1
+    assert "- How do I" not in builder.history(MESSAGES) and "- What if" in builder.history(MESSAGES)
+
+
+RESULTS = [{"chunk": "a" * 100, "url": "https://www.ebay.com/help/1"},
+           {"chunk": "b" * 100, "url": "https://www.ebay.com/help/2"},
+           {"chunk": "c" * 100, "url": "https://www.ebay.com/help/3"}]
+
+
+def test_paragraphs_cut_the_first_one_that_does_not_fit():
+    first = format_paragraph(0, RESULTS[0]["chunk"], RESULTS[0]["url"])
+    second_overhead = len(format_paragraph(1, "", RESULTS[1]["url"]))
+    builder = PromptBuilder(paragraph_tokens=len(first) + second_overhead + 40, min_paragraph_tokens=30)
+    counts = {}
+    text = builder.paragraphs(RESULTS, counts)
+    assert text == "\n".join([first, format_paragraph(1, "b" * 40, RESULTS[1]["url"])])
+    assert counts == {"paragraphs": builder.paragraph_tokens, "dropped_paragraphs": 1}
+
+    # Below min_paragraph_tokens the paragraph is dropped instead.
+    builder.min_paragraph_tokens = 41
+    assert builder.paragraphs(RESULTS) == first
+
+
+def test_paragraphs_always_keep_part_of_the_first_one():
+    overhead = len(format_paragraph(0, "", RESULTS[0]["url"]))
+    builder = PromptBuilder(paragraph_tokens=overhead + 10, min_paragraph_tokens=64)
+    assert builder.paragraphs(RESULTS) == format_paragraph(0, "a" * 10, RESULTS[0]["url"])
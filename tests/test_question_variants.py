@@ -0,0 +1,30 @@
+from src.eval.llm_question_extension import _batch_variants
+
+BATCH = ["How do I sell?", "How do I return an item?", "How do I sell?"]
+
+
+def _variants(question: str, *variants) -> dict:
+    return {"original_question": question, "variants": list(variants)}
+
+
+def test_batch_variants_match_on_the_original_question():
+    result = [_variants("How do I return an item?", "Returning an item"), _variants("How do I sell?", "Selling 1"),
+              _variants("How do I sell?", "Selling 2")]
+    assert _batch_variants(BATCH, result) == [result[1], result[0], result[2]]
+
+
+def test_batch_variants_take_rephrased_questions_by_position():
+    result = [_variants("How do I sell?", "Selling 1"), _variants("How can I return an item?", "Returning an item"),
+              _variants("How do I sell?", "Selling 2")]
+    assert _batch_variants(BATCH, result) == [result[0], _variants("How do I return an item?", "Returning an item"),
+                                              result[2]]
+
+
+def test_batch_variants_leave_unmatched_questions_out():
+    # With an entry missing, a rephrased one can't be placed and is retried with the missing question.
+    result = [_variants("How can I return an item?", "Returning an item"), _variants("How do I sell?", "Selling")]
+    assert _batch_variants(BATCH, result) == [result[1], None, None]
+    assert _batch_variants(BATCH, ["not an entry", _variants("How do I sell?", "Selling")]) == \
+        [_variants("How do I sell?", "Selling"), None, None]
+    assert _batch_variants(BATCH, {"variants": []}) == [None, None, None]
+    assert _batch_variants(BATCH, None) == [None, None, None]
@@ -0,0 +1,29 @@
+import json
+
+import pytest
+
+from src.generation import StreamingJsonField
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 5, 1000])
+def test_streaming_json_field_matches_json_loads(chunk_size):
+    response = json.dumps({"case": "Clear answer", "answer": "Say \"hi\" \\ to 😀 – {x} [y]\nok",
+                           "source": ["https://www.ebay.com/help/home"]})
+    parser = StreamingJsonField()
+    streamed = "".join(parser.feed(response[i:i + chunk_size]) for i in range(0, len(response), chunk_size))
+    assert streamed == parser.value == json.loads(response)["answer"]
+    assert parser.field == "answer" and parser.closed and parser.raw == response
+
+
+def test_streaming_json_field_ignores_nested_and_value_fields():
+    response = '{"meta": {"answer": "nested"}, "case": "answer", "answer": "top"}'
+    parser = StreamingJsonField()
+    for char in response:
+        parser.feed(char)
+    assert parser.value == "top"
+
+
+def test_streaming_json_field_without_the_field():
+    parser = StreamingJsonField()
+    assert parser.feed('{"case": "No answer"}') == ""
+    assert parser.field is None and parser.closed